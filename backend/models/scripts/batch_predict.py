@@ -0,0 +1,162 @@
+"""
+Bulk bone fracture prediction over a directory of X-rays
+Streams images through a multi-worker DataLoader, runs batched inference and
+appends one JSON line per image, so memory stays flat regardless of corpus size
+"""
+
+import json
+import os
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+
+from image_io import load_image
+from predict_api import INPUT_SIZE, load_model, get_transform, format_result
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def list_images(input_dir):
+    """All image files under `input_dir`, as sorted paths relative to it."""
+    paths = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return sorted(paths)
+
+
+def drop_partial_line(output_path):
+    """
+    Truncate a results file after its last complete line
+
+    An interrupted run can leave a record without its trailing newline;
+    appending to it would glue the next record onto that line.
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            f.seek(max(0, end - 65536))
+            chunk = f.read(end - max(0, end - 65536))
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                end = end - len(chunk) + newline + 1
+                break
+            end -= len(chunk)
+        if end < size:
+            f.truncate(end)
+            print(f"Dropped a partially written record at the end of {output_path}", file=sys.stderr)
+
+
+def read_completed(output_path):
+    """Images already recorded in an existing results file (for resuming)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['image'])
+            except (ValueError, KeyError):
+                # A partially written last line from an interrupted run
+                continue
+    return done
+
+
+class ImageDirectoryDataset(Dataset):
+    """Decodes and preprocesses images exactly like predict_fracture_json."""
+
+    def __init__(self, input_dir, image_paths, transform=None):
+        self.input_dir = input_dir
+        self.image_paths = image_paths
+        self.transform = transform or get_transform()
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, index):
+        rel_path = self.image_paths[index]
+        try:
+            image = load_image(os.path.join(self.input_dir, rel_path), size=INPUT_SIZE)
+            return self.transform(image), rel_path, None
+        except Exception as e:
+            return None, rel_path, str(e)
+
+
+def collate_predictions(samples):
+    """Stack decodable images and pass unreadable ones through with their error."""
+    ok = [(tensor, path) for tensor, path, error in samples if error is None]
+    failed = [(path, error) for _, path, error in samples if error is not None]
+    tensors = torch.stack([tensor for tensor, _ in ok]) if ok else None
+    return tensors, [path for _, path in ok], failed
+
+
+def predict_directory(input_dir, output_path, model_path="./pretrained_models/bone_fracture_model.pth",
+                      batch_size=32, num_workers=4, log_every=10, backend='torch', num_threads=None,
+                      inter_op_threads=None):
+    """
+    Score every image under `input_dir` and append the results to a JSONL file
+
+    Images already present in `output_path` are skipped, so an interrupted run
+    can simply be restarted with the same arguments.
+
+    Returns:
+        dict: counts and throughput for this run
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    all_images = list_images(input_dir)
+    drop_partial_line(output_path)
+    done = read_completed(output_path)
+    pending = [path for path in all_images if path not in done]
+    print(f"Found {len(all_images)} images, {len(done)} already scored, {len(pending)} to go",
+          file=sys.stderr)
+
+    summary = {'total': len(all_images), 'skipped': len(all_images) - len(pending),
+               'processed': 0, 'errors': 0, 'seconds': 0.0, 'images_per_sec': 0.0}
+    if not pending:
+        return summary
+
+    model = load_model(model_path, device, backend, num_threads, inter_op_threads)
+    loader = DataLoader(
+        ImageDirectoryDataset(input_dir, pending),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=collate_predictions,
+        pin_memory=device.type == 'cuda',
+    )
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    with open(output_path, 'a', encoding='utf-8') as out, torch.no_grad():
+        for step, (tensors, paths, failed) in enumerate(loader, 1):
+            if tensors is not None:
+                probabilities = F.softmax(model(tensors.to(device)), dim=1).cpu().numpy()
+                for path, row in zip(paths, probabilities):
+                    out.write(json.dumps({'image': path, **format_result(row)}) + '\n')
+            for path, error in failed:
+                out.write(json.dumps({'image': path, 'error': error, 'prediction': None,
+                                      'confidence': 0, 'probabilities': {}}) + '\n')
+            out.flush()
+
+            summary['processed'] += len(paths) + len(failed)
+            summary['errors'] += len(failed)
+            if step % log_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{summary['processed']}/{len(pending)} images, "
+                      f"{summary['processed'] / elapsed:.1f} images/sec", file=sys.stderr)
+
+    summary['seconds'] = time.perf_counter() - start
+    summary['images_per_sec'] = summary['processed'] / summary['seconds']
+    print(f"Scored {summary['processed']} images in {summary['seconds']:.1f}s "
+          f"({summary['images_per_sec']:.1f} images/sec)", file=sys.stderr)
+    return summary
@@ -0,0 +1,138 @@
+"""
+Dynamic micro-batching for the fracture classifier
+Requests that arrive within a short window are stacked into one tensor and
+run through the model in a single forward pass
+"""
+
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from instrumentation import observe
+
+
+class MicroBatcher:
+    """
+    Queue in front of a classifier that groups concurrent requests into batches
+
+    A batch is dispatched as soon as it holds `max_batch_size` images or the
+    oldest queued request has waited `max_wait_ms`, whichever comes first.
+
+    Args:
+        model: Loaded classifier in eval mode
+        device: Device the model lives on
+        max_batch_size: Upper bound on images per forward pass
+        max_wait_ms: Longest time a request waits for others to join its batch
+        stats_window: Number of recent requests kept for wait-time percentiles
+    """
+
+    def __init__(self, model, device, max_batch_size=16, max_wait_ms=5.0, stats_window=1000):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._wait_times = deque(maxlen=stats_window)
+        self._num_requests = 0
+        self._num_batches = 0
+
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, image_tensor):
+        """
+        Queue one preprocessed image tensor of shape (C, H, W)
+
+        Returns:
+            Future: resolves to the softmax probabilities for that image
+        """
+        if self._closed:
+            raise RuntimeError('MicroBatcher has been closed')
+        future = Future()
+        self._queue.put((image_tensor, future, time.perf_counter()))
+        return future
+
+    def predict(self, image_tensor, timeout=None):
+        """Blocking helper around `submit`."""
+        return self.submit(image_tensor).result(timeout=timeout)
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: finish this batch, stop on the next one
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                break
+
+            dispatched = time.perf_counter()
+            tensors, futures, enqueued = zip(*batch)
+            try:
+                stacked = torch.stack(tensors).to(self.device)
+                with torch.no_grad():
+                    probabilities = F.softmax(self.model(stacked), dim=1).cpu().numpy()
+                for future, row in zip(futures, probabilities):
+                    future.set_result(row)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+
+            with self._stats_lock:
+                self._num_batches += 1
+                self._num_requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._wait_times.extend((dispatched - t) * 1000 for t in enqueued)
+            observe('batch_size', len(batch), endpoint='predict')
+
+    def stats(self):
+        """Queue depth, batch-size histogram and per-request wait times (ms)."""
+        with self._stats_lock:
+            waits = np.array(self._wait_times) if self._wait_times else np.zeros(1)
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'requests': self._num_requests,
+                'batches': self._num_batches,
+                'mean_batch_size': self._num_requests / self._num_batches if self._num_batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'wait_ms': {
+                    'mean': float(waits.mean()),
+                    'p50': float(np.percentile(waits, 50)),
+                    'p95': float(np.percentile(waits, 95)),
+                    'max': float(waits.max()),
+                },
+            }
+
+    def close(self):
+        """Stop accepting requests and let the worker drain what is queued."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
@@ -0,0 +1,265 @@
+"""
+Inference benchmark for the prediction entry points
+Measures cold start, model load, preprocessing, forward pass and end-to-end
+latency (p50/p95/p99) plus throughput for the ResNet classifier and the YOLO
+detector, and the cost of their ensemble with and without TTA, on synthetic
+X-rays. Uses randomly initialized weights, so it runs offline, and writes
+machine-readable JSON for diffing between commits.
+
+Run from backend/models/scripts:
+    python -m bench.bench_inference --output bench_results.json
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench.synthetic import DEFAULT_RESOLUTIONS, make_xrays
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+
+
+def summarize(timings_ms):
+    timings = np.asarray(timings_ms, dtype=np.float64)
+    return {
+        'n': int(timings.size),
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'p99_ms': float(np.percentile(timings, 99)),
+    }
+
+
+def time_calls(fn, iterations, warmup=2):
+    """Wall-clock milliseconds of `iterations` calls to `fn` after `warmup` untimed ones."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def time_subprocess(args, repeats, cwd=None):
+    """Wall-clock milliseconds of running a fresh Python process `repeats` times."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=cwd or SCRIPTS_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_random_classifier(path):
+    """Randomly initialized ResNet-50 with the 2-class head, saved like train_model does."""
+    import torch
+    import torch.nn as nn
+    from torchvision import models
+
+    model = models.resnet50(weights=None)
+    model.fc = nn.Linear(model.fc.in_features, 2)
+    torch.save(model.state_dict(), path)
+    return path
+
+
+def write_random_detector(path, arch):
+    """Randomly initialized YOLOv8 built from its architecture yaml (no download)."""
+    from ultralytics import YOLO
+
+    YOLO(arch).save(path)
+    return path
+
+
+def bench_classifier(images, image_paths, batch_sizes, iterations, workdir, cold_repeats):
+    import torch
+    from predict_api import load_model, get_transform, predict_image
+
+    device = torch.device('cpu')
+    model_path = write_random_classifier(os.path.join(workdir, 'classifier.pth'))
+    transform = get_transform()
+    results = {}
+
+    results['cold_start_import'] = summarize(time_subprocess(['-c', 'import predict_api'], cold_repeats))
+    results['cli_end_to_end'] = {
+        'predict_api.py': summarize(time_subprocess(
+            [os.path.join(SCRIPTS_DIR, 'predict_api.py'), image_paths['512x512'], '--model', model_path],
+            cold_repeats)),
+        'predict.py': summarize(time_subprocess(
+            [os.path.join(SCRIPTS_DIR, 'predict.py'), image_paths['512x512'], '--model', model_path],
+            cold_repeats, cwd=workdir)),
+    }
+    results['model_load'] = summarize(time_calls(lambda: load_model(model_path, device), 3, warmup=1))
+
+    model = load_model(model_path, device)
+    results['preprocess'] = {name: summarize(time_calls(lambda: transform(image), iterations))
+                             for name, image in images.items()}
+    results['end_to_end'] = {name: summarize(time_calls(lambda: predict_image(model, image, device, transform),
+                                                        iterations))
+                             for name, image in images.items()}
+
+    results['forward'] = {}
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            batch = torch.randn(batch_size, 3, 224, 224)
+            stats = summarize(time_calls(lambda: model(batch), max(3, iterations // batch_size)))
+            stats['images_per_sec'] = batch_size * 1000 / stats['p50_ms']
+            results['forward'][str(batch_size)] = stats
+    return results
+
+
+def bench_detector(images, image_paths, batch_sizes, iterations, workdir, cold_repeats, arch, imgsz=640):
+    import torch
+    from predict_yolo import load_yolo_model, detect_fractures
+    from yolo_utils import letterbox, to_rgb_array
+
+    model_path = write_random_detector(os.path.join(workdir, 'detector.pt'), arch)
+    results = {'arch': arch}
+
+    results['cold_start_import'] = summarize(time_subprocess(['-c', 'import predict_yolo'], cold_repeats))
+    results['cli_end_to_end'] = {
+        'predict_yolo.py': summarize(time_subprocess(
+            [os.path.join(SCRIPTS_DIR, 'predict_yolo.py'), image_paths['512x512'], '--model', model_path],
+            cold_repeats)),
+    }
+    results['model_load'] = summarize(time_calls(lambda: load_yolo_model(model_path, 'cpu'), 3, warmup=1))
+
+    model = load_yolo_model(model_path, 'cpu')
+    arrays = {name: to_rgb_array(image) for name, image in images.items()}
+    results['preprocess'] = {name: summarize(time_calls(lambda: letterbox(array, (imgsz, imgsz)), iterations))
+                             for name, array in arrays.items()}
+    results['end_to_end'] = {name: summarize(time_calls(lambda: detect_fractures(model, image, 'cpu'),
+                                                        iterations))
+                             for name, image in images.items()}
+
+    network = model.model.eval()
+    results['forward'] = {}
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            batch = torch.rand(batch_size, 3, imgsz, imgsz)
+            stats = summarize(time_calls(lambda: network(batch), max(3, iterations // batch_size)))
+            stats['images_per_sec'] = batch_size * 1000 / stats['p50_ms']
+            results['forward'][str(batch_size)] = stats
+    return results
+
+
+def bench_ensemble(images, iterations, workdir, with_detector=True):
+    """
+    Cost of the fused ResNet + YOLO prediction without TTA, with the default
+    TTA views, and of running both models one after the other
+    """
+    import torch
+    from ensemble import DEFAULT_TTA, ensemble_predict
+    from predict_api import load_model, get_transform, predict_image
+    from predict_yolo import load_yolo_model, detect_fractures
+
+    device = torch.device('cpu')
+    classifier = load_model(os.path.join(workdir, 'classifier.pth'), device)
+    detector = load_yolo_model(os.path.join(workdir, 'detector.pt'), 'cpu') if with_detector else None
+    transform = get_transform()
+    results = {'tta_views': list(DEFAULT_TTA)}
+
+    def sequential(image):
+        predict_image(classifier, image, device, transform)
+        if detector is not None:
+            detect_fractures(detector, image, 'cpu')
+
+    for name, image in images.items():
+        results[name] = {
+            'sequential': summarize(time_calls(lambda: sequential(image), iterations)),
+            'ensemble': summarize(time_calls(
+                lambda: ensemble_predict(image, classifier, device, detector, (), transform), iterations)),
+            'ensemble_tta': summarize(time_calls(
+                lambda: ensemble_predict(image, classifier, device, detector, DEFAULT_TTA, transform), iterations)),
+        }
+    return results
+
+
+def run_benchmarks(resolutions=DEFAULT_RESOLUTIONS, batch_sizes=DEFAULT_BATCH_SIZES, iterations=20,
+                   cold_repeats=3, yolo_arch='yolov8m.yaml', skip_yolo=False, num_threads=None):
+    """
+    Run the full benchmark suite
+
+    Returns:
+        dict: environment metadata plus per-model results
+    """
+    import torch
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    images = make_xrays(resolutions)
+    if '512x512' not in images:
+        images.update(make_xrays(((512, 512),), seed=len(images)))
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+        },
+        'config': {'resolutions': list(images), 'batch_sizes': list(batch_sizes), 'iterations': iterations},
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        image_paths = {}
+        for name, image in images.items():
+            image_paths[name] = os.path.join(workdir, f'xray_{name}.png')
+            image.save(image_paths[name])
+
+        print("Benchmarking ResNet classifier...", file=sys.stderr)
+        report['classifier'] = bench_classifier(images, image_paths, batch_sizes, iterations, workdir,
+                                                cold_repeats)
+        if not skip_yolo:
+            print("Benchmarking YOLO detector...", file=sys.stderr)
+            report['detector'] = bench_detector(images, image_paths, batch_sizes, iterations, workdir,
+                                                cold_repeats, yolo_arch)
+        print("Benchmarking ensemble and TTA...", file=sys.stderr)
+        report['ensemble'] = bench_ensemble(images, iterations, workdir, with_detector=not skip_yolo)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the fracture prediction entry points')
+    parser.add_argument('--output', type=str, default='bench_results.json', help='Where to write the JSON report')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(DEFAULT_BATCH_SIZES),
+                        help='Batch sizes for the forward-pass benchmark')
+    parser.add_argument('--resolutions', type=str, nargs='+',
+                        default=[f'{w}x{h}' for w, h in DEFAULT_RESOLUTIONS],
+                        help='Synthetic image sizes as WIDTHxHEIGHT')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed iterations per measurement')
+    parser.add_argument('--cold-repeats', type=int, default=3, help='Fresh processes per cold-start measurement')
+    parser.add_argument('--yolo-arch', type=str, default='yolov8m.yaml', help='YOLO architecture to benchmark')
+    parser.add_argument('--skip-yolo', action='store_true', help='Only benchmark the classifier')
+    parser.add_argument('--threads', type=int, help='torch intra-op threads')
+
+    args = parser.parse_args()
+
+    resolutions = [tuple(int(v) for v in r.lower().split('x')) for r in args.resolutions]
+    report = run_benchmarks(resolutions, args.batch_sizes, args.iterations, args.cold_repeats,
+                            args.yolo_arch, args.skip_yolo, args.threads)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
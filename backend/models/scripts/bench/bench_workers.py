@@ -0,0 +1,88 @@
+"""
+Memory and throughput of the multi-process classifier workers
+Starts an InferencePool with 1, 2, 4... workers on a randomly initialized
+ResNet-50, measures the total proportional set size (PSS) of the parent and
+its workers, so shared weight pages are only counted once, and the
+images/sec reached by concurrent requests
+
+Run from backend/models/scripts (Linux, reads /proc/<pid>/smaps_rollup):
+    python -m bench.bench_workers --workers 1 2 4
+"""
+
+import io
+import json
+import os
+import tempfile
+import time
+
+from bench.bench_inference import write_random_classifier
+from bench.synthetic import make_xray
+
+
+def pss_mb(pid):
+    """Proportional set size of one process: shared pages are split between their users."""
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def encoded_xray(width=1024, height=1024):
+    buffer = io.BytesIO()
+    make_xray(width, height).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def bench_pool(model_path, num_workers, data, requests):
+    """Memory and throughput of one pool size."""
+    from worker_pool import InferencePool
+
+    pool = InferencePool(model_path, num_workers=num_workers)
+    try:
+        # Warm-up: every worker has received the weights and run a forward pass
+        for future in [pool.submit(data) for _ in range(num_workers * 2)]:
+            future.result()
+        start = time.perf_counter()
+        for future in [pool.submit(data) for _ in range(requests)]:
+            future.result()
+        seconds = time.perf_counter() - start
+        worker_pids = pool.stats()['pids']
+        return {
+            'workers': num_workers,
+            'parent_pss_mb': pss_mb(os.getpid()),
+            'workers_pss_mb': [pss_mb(pid) for pid in worker_pids],
+            'total_pss_mb': pss_mb(os.getpid()) + sum(pss_mb(pid) for pid in worker_pids),
+            'images_per_sec': requests / seconds,
+        }
+    finally:
+        pool.close()
+
+
+def run(worker_counts, requests):
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = write_random_classifier(os.path.join(workdir, 'resnet50.pth'))
+        model_mb = os.path.getsize(model_path) / (1024 * 1024)
+        data = encoded_xray()
+        results = [bench_pool(model_path, n, data, requests) for n in worker_counts]
+    return {'model_mb': model_mb, 'cpu_count': len(os.sched_getaffinity(0)), 'pools': results}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the shared-weight inference worker pool')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Pool sizes to measure')
+    parser.add_argument('--requests', type=int, default=64, help='Concurrent requests per pool size')
+    parser.add_argument('--output', type=str, help='Also write the JSON report here')
+
+    args = parser.parse_args()
+
+    report = run(args.workers, args.requests)
+    print(f"ResNet-50 weights: {report['model_mb']:.0f} MB, {report['cpu_count']} usable cores")
+    for pool in report['pools']:
+        print(f"{pool['workers']} workers: total PSS {pool['total_pss_mb']:7.0f} MB, "
+              f"{pool['images_per_sec']:6.1f} images/sec")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,120 @@
+"""
+Peak-memory check for image decoding
+Decodes large synthetic radiographs (RGB JPEG, 8-bit PNG, 16-bit PNG) the way
+a /predict request does, each in a fresh process, and reports how much the
+peak RSS grew. Compares image_io.decode_image against the old
+open-convert-resize path and exits non-zero when image_io exceeds the budget
+
+Run from backend/models/scripts:
+    python -m bench.decode_memory
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from bench.synthetic import make_xray
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process; prints the peak RSS growth (MB) caused by one decode
+_CHILD = """
+import resource, sys
+from PIL import Image
+import numpy as np
+from image_io import decode_image
+
+def peak_mb():
+    # ru_maxrss survives exec and would report the parent's peak; VmHWM does not
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM')) / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+path, method = sys.argv[1], sys.argv[2]
+with open(path, 'rb') as f:
+    data = f.read()
+before = peak_mb()
+if method == 'image_io':
+    image, _ = decode_image(data, size=(224, 224))
+else:
+    import io
+    image = Image.open(io.BytesIO(data)).convert('RGB').resize((224, 224), Image.BILINEAR)
+print(peak_mb() - before)
+"""
+
+METHODS = ('naive', 'image_io')
+
+
+def write_images(directory, width, height):
+    """The test radiographs in the formats the upload endpoints see, keyed by name."""
+    xray = make_xray(width, height)
+    paths = {
+        'jpeg_rgb': os.path.join(directory, 'xray.jpg'),
+        'png_8bit': os.path.join(directory, 'xray.png'),
+        'png_16bit': os.path.join(directory, 'xray16.png'),
+    }
+    xray.save(paths['jpeg_rgb'], quality=92)
+    xray.convert('L').save(paths['png_8bit'])
+    # 12-bit detector values stored in 16 bits, as exported by most X-ray systems
+    gray = np.asarray(xray.convert('L'), dtype=np.uint16) * 16
+    Image.fromarray(gray).save(paths['png_16bit'])
+    return paths
+
+
+def measure(path, method):
+    """Peak RSS growth (MB) of decoding `path` with `method` in a fresh process."""
+    completed = subprocess.run([sys.executable, '-c', _CHILD, path, method], cwd=SCRIPTS_DIR,
+                               capture_output=True, text=True, check=True)
+    return float(completed.stdout.strip())
+
+
+def check_decode_memory(width=4000, height=3000, budget_mb=40.0):
+    """
+    Measure every format with both decoders against the budget
+
+    Returns:
+        tuple: (report dict, list of failure messages)
+    """
+    report, failures = {}, []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in write_images(directory, width, height).items():
+            report[name] = {method: measure(path, method) for method in METHODS}
+            report[name]['file_mb'] = os.path.getsize(path) / (1024 * 1024)
+            if report[name]['image_io'] > budget_mb:
+                failures.append(f"{name}: decoding took {report[name]['image_io']:.0f} MB "
+                                f"(budget {budget_mb:.0f} MB)")
+    return report, failures
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fail when decoding an upload uses too much memory')
+    parser.add_argument('--width', type=int, default=4000, help='Width of the test radiographs')
+    parser.add_argument('--height', type=int, default=3000, help='Height of the test radiographs')
+    parser.add_argument('--budget-mb', type=float, default=40.0,
+                        help='Max peak RSS growth of one image_io decode')
+    parser.add_argument('--json', action='store_true', help='Print the measurements as JSON')
+
+    args = parser.parse_args()
+
+    report, failures = check_decode_memory(args.width, args.height, args.budget_mb)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Peak RSS growth per decode, {args.width}x{args.height} -> 224x224")
+        for name, stats in report.items():
+            print(f"{name:10s} naive {stats['naive']:7.1f} MB   image_io {stats['image_io']:7.1f} MB")
+    for failure in failures:
+        print(f"❌ {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("✅ Decode memory budget met")
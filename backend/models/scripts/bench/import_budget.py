@@ -0,0 +1,107 @@
+"""
+Import-time budget check for the prediction CLIs
+The Node bridge spawns predict.py / predict_api.py / predict_yolo.py once per
+request, so their cold start matters. Measures each module with
+`python -X importtime` and each CLI's `--help` wall time in a fresh process,
+and exits non-zero when a budget is exceeded or a heavy dependency (torch,
+matplotlib, ...) is imported at module level again
+
+Run from backend/models/scripts:
+    python -m bench.import_budget
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = ('predict', 'predict_api', 'predict_yolo')
+# Must only be imported by the code paths that actually run a model or draw a figure
+HEAVY_MODULES = ('torch', 'torchvision', 'matplotlib', 'ultralytics', 'onnxruntime', 'numpy', 'PIL')
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output
+
+    Returns:
+        dict: top-level package -> cumulative microseconds, for every module imported
+    """
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def measure_import(module):
+    """Cumulative import time (ms) of `module` and the heavy modules it pulled in."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+    cumulative = parse_importtime(completed.stderr)
+    heavy = sorted({name.split('.')[0] for name in cumulative} & set(HEAVY_MODULES))
+    return cumulative.get(module, 0) / 1000, heavy
+
+
+def measure_help(script, repeats):
+    """Median wall time (ms) of `python <script> --help` in a fresh process."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, f'{script}.py', '--help'], cwd=SCRIPTS_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def check_budgets(import_budget_ms=150.0, help_budget_ms=750.0, repeats=5):
+    """
+    Measure every entry point against the budgets
+
+    Returns:
+        tuple: (report dict, list of failure messages)
+    """
+    report, failures = {}, []
+    for module in ENTRY_POINTS:
+        import_ms, heavy = measure_import(module)
+        help_ms = measure_help(module, repeats)
+        report[module] = {'import_ms': import_ms, 'help_ms': help_ms, 'heavy_imports': heavy}
+
+        if heavy:
+            failures.append(f"{module} imports {', '.join(heavy)} at module level")
+        if import_ms > import_budget_ms:
+            failures.append(f"{module} import took {import_ms:.0f} ms (budget {import_budget_ms:.0f} ms)")
+        if help_ms > help_budget_ms:
+            failures.append(f"{module}.py --help took {help_ms:.0f} ms (budget {help_budget_ms:.0f} ms)")
+    return report, failures
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fail when the prediction CLIs get slow to start')
+    parser.add_argument('--import-budget-ms', type=float, default=150.0,
+                        help='Max cumulative import time per entry point module')
+    parser.add_argument('--help-budget-ms', type=float, default=750.0,
+                        help='Max median wall time of `<script>.py --help`, interpreter startup included')
+    parser.add_argument('--repeats', type=int, default=5, help='Fresh processes per --help measurement')
+    parser.add_argument('--json', action='store_true', help='Print the measurements as JSON')
+
+    args = parser.parse_args()
+
+    report, failures = check_budgets(args.import_budget_ms, args.help_budget_ms, args.repeats)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for module, stats in report.items():
+            print(f"{module:14s} import {stats['import_ms']:7.1f} ms   --help {stats['help_ms']:7.1f} ms")
+    for failure in failures:
+        print(f"❌ {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("✅ Import-time budgets met")
@@ -0,0 +1,41 @@
+"""
+Synthetic X-ray-like test images for benchmarks
+Grayscale radiograph look-alikes (dark background, bright bone shapes, film
+noise) generated deterministically, so benchmarks run offline and reproducibly
+"""
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_RESOLUTIONS = ((224, 224), (512, 512), (1024, 1024), (2048, 2048))
+
+
+def make_xray(width, height, seed=0):
+    """One synthetic radiograph as an RGB PIL image of size (width, height)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    x /= width
+    y /= height
+
+    # Soft-tissue glow towards the centre
+    image = 40 + 50 * np.exp(-((x - 0.5) ** 2 + (y - 0.5) ** 2) / 0.08)
+
+    # A few elongated "bones" with brighter cortical edges
+    for _ in range(3):
+        cx, cy = rng.uniform(0.3, 0.7, size=2)
+        angle = rng.uniform(0, np.pi)
+        length, thickness = rng.uniform(0.25, 0.45), rng.uniform(0.03, 0.07)
+        u = (x - cx) * np.cos(angle) + (y - cy) * np.sin(angle)
+        v = -(x - cx) * np.sin(angle) + (y - cy) * np.cos(angle)
+        dist = (u / length) ** 2 + (v / thickness) ** 2
+        image += 120 * (dist < 1) + 40 * ((dist > 0.6) & (dist < 1))
+
+    # Film grain
+    image += rng.normal(0, 6, size=image.shape)
+    gray = np.clip(image, 0, 255).astype(np.uint8)
+    return Image.fromarray(gray, mode='L').convert('RGB')
+
+
+def make_xrays(resolutions=DEFAULT_RESOLUTIONS, seed=0):
+    """Synthetic images keyed by 'WxH'."""
+    return {f'{w}x{h}': make_xray(w, h, seed + i) for i, (w, h) in enumerate(resolutions)}
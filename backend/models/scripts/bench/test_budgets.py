@@ -0,0 +1,22 @@
+"""
+Startup-time and decode-memory budgets as tests
+Wraps bench.import_budget and bench.decode_memory with their default budgets,
+so a heavy module-level import or a decoder that materializes full-size
+copies fails the test run instead of only the standalone scripts
+
+Run from backend/models/scripts:
+    python -m pytest bench
+"""
+
+from bench.decode_memory import check_decode_memory
+from bench.import_budget import check_budgets
+
+
+def test_prediction_clis_start_within_budget():
+    _, failures = check_budgets()
+    assert not failures, '\n'.join(failures)
+
+
+def test_image_decoding_stays_within_memory_budget():
+    _, failures = check_decode_memory()
+    assert not failures, '\n'.join(failures)
@@ -0,0 +1,33 @@
+"""
+Exported classifier graphs must match the eager model
+Exports a randomly initialized ResNet-50 to ONNX and TorchScript in a
+temporary directory and compares the backends' logits on the same batch
+
+Run from backend/models/scripts:
+    python -m pytest bench
+"""
+
+import torch
+
+from bench.bench_inference import write_random_classifier
+from export_model import export_model
+from inference_backends import load_backend
+from predict_api import load_model
+
+ATOL = 1e-3
+
+
+def test_exported_graphs_match_eager_model(tmp_path):
+    model_path = write_random_classifier(str(tmp_path / 'classifier.pth'))
+    report = export_model(model_path, atol=ATOL)
+    assert set(report['exports']) == {'onnx', 'torchscript'}
+
+    device = torch.device('cpu')
+    model = load_model(model_path, device)
+    batch = torch.randn(3, 3, 224, 224, generator=torch.Generator().manual_seed(1))
+    with torch.no_grad():
+        expected = model(batch)
+        for fmt, path in report['exports'].items():
+            assert path.startswith(str(tmp_path))
+            actual = load_backend(fmt, path, device)(batch).float().cpu()
+            torch.testing.assert_close(actual, expected, atol=ATOL, rtol=ATOL, msg=lambda m: f'{fmt}: {m}')
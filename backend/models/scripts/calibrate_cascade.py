@@ -0,0 +1,174 @@
+"""
+Calibration of the cascade's uncertainty band on the test split
+Runs the screener and the ResNet-50 over the test split once, measures the
+per-image latency of each model (and optionally of YOLOv8), then reports for
+the requested band, and a sweep of symmetric bands, how many images would be
+escalated, the accuracy lost against always running the ResNet-50 and the
+throughput gained
+"""
+
+import json
+import sys
+import time
+
+import numpy as np
+
+from cascade import DEFAULT_BAND
+
+SWEEP_HALF_WIDTHS = [0.0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.45, 0.5]
+
+
+def collect_probabilities(model, loader, device, positive_index):
+    """P(positive class) for every image of `loader`, with the labels."""
+    import torch
+    import torch.nn.functional as F
+
+    model.eval()
+    probabilities, labels = [], []
+    with torch.no_grad():
+        for images, targets in loader:
+            outputs = model(images.to(device))
+            probabilities.append(F.softmax(outputs, dim=1)[:, positive_index].cpu().numpy())
+            labels.append(targets.numpy())
+    return np.concatenate(probabilities), np.concatenate(labels)
+
+
+def measure_latency(model, device, iterations=20, warmup=3):
+    """Seconds per single-image forward pass, as the cascade runs it."""
+    import torch
+
+    image_tensor = torch.randn(1, 3, 224, 224, device=device)
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(image_tensor)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(image_tensor)
+    return (time.perf_counter() - start) / iterations
+
+
+def measure_detector_latency(yolo_path, image_path, iterations=5):
+    """Seconds per YOLOv8 detection of one test image."""
+    from predict_yolo import detect_fractures, load_yolo_model
+
+    model = load_yolo_model(yolo_path)
+    detect_fractures(model, image_path)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        detect_fractures(model, image_path)
+    return (time.perf_counter() - start) / iterations
+
+
+def evaluate_band(band, screener_probs, classifier_probs, labels, positive_index, latency):
+    """
+    Accuracy and cost of the cascade for one band
+
+    Images the screener scores inside `band` take the ResNet-50's verdict and
+    pay for every escalation stage; the rest keep the screener's verdict.
+    """
+    low, high = band
+    escalated = (screener_probs >= low) & (screener_probs <= high)
+    fracture_probs = np.where(escalated, classifier_probs, screener_probs)
+    # Binary task: the positive class wins above 0.5, like argmax over the softmax
+    predictions = np.where(fracture_probs > 0.5, positive_index, 1 - positive_index)
+
+    escalation_cost = latency['classifier'] + latency.get('detector', 0.0)
+    cascade_cost = latency['screener'] + escalated.mean() * escalation_cost
+    cascade_accuracy = 100 * float((predictions == labels).mean())
+    classifier_accuracy = 100 * float((np.where(classifier_probs > 0.5, positive_index, 1 - positive_index)
+                                       == labels).mean())
+    return {
+        'band': [float(low), float(high)],
+        'escalation_rate': float(escalated.mean()),
+        'accuracy': cascade_accuracy,
+        'accuracy_lost': classifier_accuracy - cascade_accuracy,
+        'ms_per_image': cascade_cost * 1000,
+        'speedup': escalation_cost / cascade_cost,
+    }
+
+
+def calibrate(data_dir, screener_path, model_path, band=DEFAULT_BAND, yolo_path=None, batch_size=32,
+              simulate=False, manifest_path=None):
+    """
+    Score the test split with both models and evaluate `band` plus the sweep
+
+    Uses the same split as train_model (build_datasets), so run it on the data
+    the models were trained with.
+
+    Returns:
+        dict: test split size, per-model accuracy and latency, the requested
+        band's result and the sweep
+    """
+    import torch
+    from torch.utils.data import DataLoader
+    from external_trainer import build_datasets, sample_paths
+    from predict_api import load_model
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    _, _, test_dataset, class_names = build_datasets(data_dir, simulate, manifest_path=manifest_path)
+    positive_index = class_names.index('fractured')
+    loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
+    print(f"Scoring {len(test_dataset)} test images with both models...", file=sys.stderr)
+
+    screener = load_model(screener_path, device)
+    classifier = load_model(model_path, device)
+    screener_probs, labels = collect_probabilities(screener, loader, device, positive_index)
+    classifier_probs, _ = collect_probabilities(classifier, loader, device, positive_index)
+
+    latency = {'screener': measure_latency(screener, device), 'classifier': measure_latency(classifier, device)}
+    if yolo_path:
+        latency['detector'] = measure_detector_latency(yolo_path, sample_paths(test_dataset)[0])
+
+    def accuracy(probs):
+        return 100 * float((np.where(probs > 0.5, positive_index, 1 - positive_index) == labels).mean())
+
+    sweep = [(0.5 - w, 0.5 + w) for w in SWEEP_HALF_WIDTHS]
+    return {
+        'test_images': int(len(labels)),
+        'accuracy': {'screener': accuracy(screener_probs), 'classifier': accuracy(classifier_probs)},
+        'latency_ms': {name: seconds * 1000 for name, seconds in latency.items()},
+        'band': evaluate_band(band, screener_probs, classifier_probs, labels, positive_index, latency),
+        'sweep': [evaluate_band(b, screener_probs, classifier_probs, labels, positive_index, latency)
+                  for b in sweep],
+    }
+
+
+def format_row(result):
+    low, high = result['band']
+    return (f"[{low:.2f}, {high:.2f}]  escalated {result['escalation_rate'] * 100:5.1f}%  "
+            f"accuracy {result['accuracy']:6.2f}% ({-result['accuracy_lost']:+.2f})  "
+            f"{result['ms_per_image']:7.1f} ms/image  {result['speedup']:5.2f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Throughput gained vs accuracy lost by a cascade band')
+    parser.add_argument('data_dir', type=str, help='Dataset the models were trained on (train_model layout)')
+    parser.add_argument('--screener', type=str, default='./pretrained_models/bone_fracture_screener.pth',
+                        help='Weights of the fast screener')
+    parser.add_argument('--model', type=str, default='./pretrained_models/bone_fracture_model.pth',
+                        help='ResNet-50 weights used on escalation')
+    parser.add_argument('--yolo-model', type=str, help='Also charge a YOLOv8 detection per escalated image')
+    parser.add_argument('--band', type=float, nargs=2, default=list(DEFAULT_BAND), metavar=('LOW', 'HIGH'),
+                        help='Screener P(fractured) range that is escalated')
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch size for scoring the test split')
+    parser.add_argument('--manifest', type=str, help='Dataset manifest to use (default: <data_dir>/manifest.json)')
+    parser.add_argument('--simulate', action='store_true', help='Use the small simulate-mode split')
+    parser.add_argument('--output', type=str, help='Also write the JSON report here')
+
+    args = parser.parse_args()
+
+    report = calibrate(args.data_dir, args.screener, args.model, tuple(args.band), args.yolo_model,
+                       args.batch_size, args.simulate, args.manifest)
+    print(f"{report['test_images']} test images; ResNet-50 alone: {report['accuracy']['classifier']:.2f}%, "
+          f"screener alone: {report['accuracy']['screener']:.2f}%")
+    print("Latency: " + ", ".join(f"{name} {ms:.1f} ms" for name, ms in report['latency_ms'].items()))
+    print("Requested band:")
+    print("  " + format_row(report['band']))
+    print("Sweep:")
+    for result in report['sweep']:
+        print("  " + format_row(result))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,147 @@
+"""
+Confidence cascade for bone fracture prediction
+A small screener (ResNet-18 trained with train_model(arch='resnet18')) scores
+every image first. Only images whose fracture probability falls inside an
+uncertainty band are escalated to the ResNet-50 classifier and/or the YOLOv8
+detector, and the result records which stages ran
+"""
+
+import json
+import os
+
+from instrumentation import start_trace, attach_timings
+from model_registry import get_default_registry
+
+DEFAULT_BAND = (0.2, 0.8)
+ESCALATION_STAGES = ('classifier', 'detector')
+DETECTION_KEYS = ('detections', 'num_detections', 'primary_class', 'class_summary', 'image_shape')
+
+
+def is_uncertain(fracture_probability, band=DEFAULT_BAND):
+    """Whether the screener's P(fractured) lies inside the band that triggers escalation."""
+    low, high = band
+    return low <= fracture_probability <= high
+
+
+def _classify(model, image_tensor):
+    import torch
+    import torch.nn.functional as F
+    from predict_api import format_result
+
+    with torch.no_grad():
+        return format_result(F.softmax(model(image_tensor), dim=1).cpu().numpy()[0])
+
+
+def predict_cascade(image_path, screener_path, model_path="./pretrained_models/bone_fracture_model.pth",
+                    yolo_path=None, band=DEFAULT_BAND, escalate=('classifier',), backend='torch',
+                    conf=0.25, iou=0.45, timings=False):
+    """
+    Screen an X-ray with the small model, escalating only uncertain ones
+
+    Args:
+        screener_path: Weights of the fast screener (any ResNet/MobileNet checkpoint)
+        model_path: Weights of the ResNet-50 run on escalation
+        yolo_path: YOLOv8 weights, needed when 'detector' is in `escalate`
+        band: (low, high) range of the screener's P(fractured) that is escalated
+        escalate: Which of 'classifier' and 'detector' run on escalated images
+        backend: Inference backend of the ResNet-50 (the screener runs eagerly)
+
+    Returns:
+        dict: the predict_fracture_json result of the last classifier that ran,
+        the detection fields when YOLO ran, and a 'cascade' block with the
+        stages that ran and the screener's own verdict. The label always comes
+        from a classifier: when only the detector is escalated it stays the
+        screener's, and the block adds the detector's verdict and whether the
+        two agree (as in ensemble.py).
+    """
+    trace = start_trace('predict_cascade', force=timings)
+    try:
+        unknown = set(escalate) - set(ESCALATION_STAGES)
+        if unknown:
+            raise ValueError(f"Unknown escalation stage(s) {sorted(unknown)}, expected {ESCALATION_STAGES}")
+        from image_io import decode_image
+        from predict_api import INPUT_SIZE, get_transform, load_shared_model
+
+        with trace.stage('model_load'):
+            screener, device = load_shared_model(screener_path)
+        with trace.stage('decode'):
+            image, original_size = decode_image(image_path, size=INPUT_SIZE)
+        trace.image(original_size)
+        # Preprocessed once, shared by both classifiers
+        with trace.stage('preprocess'):
+            image_tensor = get_transform()(image).unsqueeze(0).to(device)
+
+        with trace.stage('screener'):
+            screening = _classify(screener, image_tensor)
+        result = screening
+        stages = ['screener']
+        summary = {}
+        escalated = is_uncertain(screening['probabilities']['fractured'] / 100, band)
+
+        if escalated and 'classifier' in escalate:
+            with trace.stage('model_load'):
+                classifier, device = load_shared_model(model_path, backend)
+            with trace.stage('classifier'):
+                result = _classify(classifier, image_tensor.to(device))
+            stages.append('classifier')
+
+        if escalated and 'detector' in escalate:
+            from predict_yolo import detect_fractures, load_yolo_model
+
+            if not yolo_path or not os.path.exists(yolo_path):
+                raise FileNotFoundError(f'YOLOv8 model file not found at {yolo_path}')
+            with trace.stage('model_load'):
+                detector = get_default_registry().ensure(f'detector:{os.path.abspath(yolo_path)}',
+                                                         load_yolo_model, yolo_path, device=None)
+            with trace.stage('detector'):
+                detection = detect_fractures(detector, image_path, conf=conf, iou=iou)
+            result = dict(result, **{key: detection[key] for key in DETECTION_KEYS if key in detection})
+            stages.append('detector')
+            summary['detector'] = {key: detection[key] for key in ('prediction', 'confidence')}
+            summary['models_agree'] = detection['prediction'] == result['prediction']
+
+        result = dict(result, cascade={
+            'stages': stages,
+            'escalated': escalated,
+            'band': list(band),
+            'screener': screening,
+            **summary,
+        })
+        trace.finish(outcome='escalated' if escalated else 'screened')
+        return attach_timings(result, trace) if timings else result
+
+    except Exception as e:
+        trace.finish(error=e)
+        return {
+            'error': str(e),
+            'prediction': None,
+            'confidence': 0,
+            'probabilities': {}
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cascade fracture prediction: fast screener, heavy models '
+                                                 'only when it is uncertain (JSON output)')
+    parser.add_argument('image_path', type=str, help='Path to the X-ray image')
+    parser.add_argument('--screener', type=str, default='./pretrained_models/bone_fracture_screener.pth',
+                        help='Weights of the fast screener (train_model(arch="resnet18"))')
+    parser.add_argument('--model', type=str, default='./pretrained_models/bone_fracture_model.pth',
+                        help='ResNet-50 weights used on escalation')
+    parser.add_argument('--yolo-model', type=str, default='./runs/detect/bone_fracture_yolov8m/weights/best.pt',
+                        help='YOLOv8 weights used when escalating to the detector')
+    parser.add_argument('--band', type=float, nargs=2, default=list(DEFAULT_BAND), metavar=('LOW', 'HIGH'),
+                        help='Screener P(fractured) range that is escalated (see calibrate_cascade.py)')
+    parser.add_argument('--escalate', type=str, nargs='+', default=['classifier'], choices=ESCALATION_STAGES,
+                        help='Models run on uncertain images')
+    parser.add_argument('--backend', type=str, default='torch',
+                        choices=['torch', 'torchscript', 'onnx', 'quantized'], help='Backend of the ResNet-50')
+    parser.add_argument('--timings', action='store_true', help='Add per-stage timings to the JSON output')
+
+    args = parser.parse_args()
+
+    result = predict_cascade(args.image_path, args.screener, args.model, args.yolo_model, tuple(args.band),
+                             args.escalate, args.backend, timings=args.timings)
+    print(json.dumps(result))
@@ -0,0 +1,235 @@
+"""
+Memory-mapped checkpoint format for the classifier weights
+Writes the safetensors layout (8-byte header length, a JSON header with each
+tensor's dtype, shape and byte offsets plus a __metadata__ block, then the raw
+tensor data) without needing the safetensors package. Loading maps the file
+and wraps every tensor around the mapped pages: nothing is unpickled or
+copied, and processes loading the same file share its pages
+"""
+
+import json
+import os
+import struct
+import sys
+import time
+
+CHECKPOINT_EXTENSION = '.safetensors'
+# safetensors dtype -> (torch dtype name, NumPy dtype holding the same bytes)
+DTYPES = {
+    'F64': ('float64', 'float64'),
+    'F32': ('float32', 'float32'),
+    'F16': ('float16', 'float16'),
+    'BF16': ('bfloat16', 'uint16'),
+    'I64': ('int64', 'int64'),
+    'I32': ('int32', 'int32'),
+    'I16': ('int16', 'int16'),
+    'I8': ('int8', 'int8'),
+    'U8': ('uint8', 'uint8'),
+    'BOOL': ('bool', 'bool'),
+}
+HEADER_ALIGNMENT = 8
+
+
+def is_mmap_checkpoint(path):
+    """Whether `path` is in the memory-mapped format (rather than a torch.save pickle/zip)."""
+    with open(path, 'rb') as f:
+        start = f.read(9)
+    return len(start) == 9 and start[8:9] == b'{'
+
+
+def save_checkpoint(state_dict, path, metadata=None):
+    """
+    Write a state dict in the memory-mapped format
+
+    Args:
+        metadata: JSON-serializable values (architecture, class names,
+            normalization, metrics...) stored in the header
+
+    The file is written next to `path` and renamed into place, so readers
+    (and the model registry's reload-on-change) never see a partial file.
+    """
+    import torch
+
+    names = {dtype: code for code, (dtype, _) in DTYPES.items()}
+    tensors = {name: tensor.detach().cpu().contiguous() for name, tensor in state_dict.items()}
+    # Widest dtypes first keeps every tensor aligned to its element size
+    order = sorted(tensors, key=lambda name: (-tensors[name].element_size(), name))
+
+    header, offset = {}, 0
+    for name in order:
+        tensor = tensors[name]
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {'dtype': names[str(tensor.dtype).replace('torch.', '')],
+                        'shape': list(tensor.shape), 'data_offsets': [offset, offset + nbytes]}
+        offset += nbytes
+    if metadata:
+        # safetensors metadata values must be strings
+        header['__metadata__'] = {key: json.dumps(value) for key, value in metadata.items()}
+
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    encoded += b' ' * (-len(encoded) % HEADER_ALIGNMENT)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for name in order:
+            f.write(tensors[name].reshape(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_header(path):
+    """
+    Parsed header of a memory-mapped checkpoint
+
+    Returns:
+        tuple: (header dict, byte offset where the tensor data starts)
+    """
+    with open(path, 'rb') as f:
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+    return header, 8 + length
+
+
+def read_metadata(path):
+    """Metadata stored with a memory-mapped checkpoint (empty for legacy .pth files)."""
+    if not is_mmap_checkpoint(path):
+        return {}
+    header, _ = read_header(path)
+    return {key: json.loads(value) for key, value in header.get('__metadata__', {}).items()}
+
+
+def load_checkpoint(path):
+    """
+    Map a checkpoint written by save_checkpoint
+
+    The tensors are views of a copy-on-write mapping of the file: loading
+    costs a header parse, pages are read (and shared with other processes)
+    as the weights are used, and writing to a tensor never touches the file.
+
+    Returns:
+        tuple: (state dict, metadata dict)
+    """
+    import numpy as np
+    import torch
+
+    header, data_start = read_header(path)
+    metadata = {key: json.loads(value) for key, value in header.pop('__metadata__', {}).items()}
+    if not header:
+        return {}, metadata
+    data = np.memmap(path, dtype=np.uint8, mode='c', offset=data_start)
+
+    state_dict = {}
+    for name, info in header.items():
+        torch_dtype, numpy_dtype = DTYPES[info['dtype']]
+        begin, end = info['data_offsets']
+        array = data[begin:end].view(numpy_dtype).reshape(info['shape'])
+        tensor = torch.from_numpy(array)
+        if torch_dtype != numpy_dtype:
+            tensor = tensor.view(getattr(torch, torch_dtype))
+        state_dict[name] = tensor
+    return state_dict, metadata
+
+
+def load_weights(path, map_location='cpu'):
+    """
+    State dict and metadata from either checkpoint format
+
+    Accepts memory-mapped checkpoints and legacy torch.save files holding
+    either a raw state dict or a dict with 'model_state_dict' (its other
+    entries are returned as metadata).
+
+    Returns:
+        tuple: (state dict, metadata dict)
+    """
+    if is_mmap_checkpoint(path):
+        return load_checkpoint(path)
+    import torch
+
+    checkpoint = torch.load(path, map_location=map_location)
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        metadata = {key: value for key, value in checkpoint.items() if key != 'model_state_dict'}
+        return checkpoint['model_state_dict'], metadata
+    return checkpoint, {}
+
+
+def save_weights(state_dict, path, metadata=None):
+    """
+    Save a state dict in the format chosen by the file extension
+
+    `.safetensors` writes the memory-mapped format with `metadata` in its
+    header; any other path gets a legacy torch.save of the raw state dict
+    (metadata is not stored).
+    """
+    if path.endswith(CHECKPOINT_EXTENSION):
+        return save_checkpoint(state_dict, path, metadata)
+    import torch
+
+    torch.save(state_dict, path)
+    return path
+
+
+def convert_checkpoint(path, output_path=None, metadata=None):
+    """
+    Convert a legacy .pth checkpoint to the memory-mapped format
+
+    Metadata stored in the source (and `metadata`, which takes precedence)
+    is carried over; non-JSON values are stored as strings. Without an
+    'architecture' entry, the one the weights belong to is recorded.
+
+    Returns:
+        str: the written path (<path without .pth>.safetensors by default)
+    """
+    state_dict, stored = load_weights(path)
+    merged = {key: value if _is_json(value) else str(value) for key, value in stored.items()}
+    merged.update(metadata or {})
+    if 'architecture' not in merged:
+        from predict_api import infer_arch
+        merged['architecture'] = infer_arch(state_dict)
+    output_path = output_path or os.path.splitext(path)[0] + CHECKPOINT_EXTENSION
+    return save_checkpoint(state_dict, output_path, merged)
+
+
+def _is_json(value):
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert a .pth checkpoint to the memory-mapped format')
+    parser.add_argument('model_path', type=str, help='Legacy .pth checkpoint')
+    parser.add_argument('--output', type=str, help='Output path (default: <model>.safetensors)')
+    parser.add_argument('--arch', type=str,
+                        help='Architecture recorded in the metadata (default: inferred from the weights)')
+    parser.add_argument('--class-names', type=str, nargs='+', help='Class names recorded in the metadata')
+    parser.add_argument('--benchmark', action='store_true', help='Compare load_model times of both files')
+
+    args = parser.parse_args()
+
+    from predict_api import CLASS_NAMES, INPUT_SIZE, NORMALIZE_MEAN, NORMALIZE_STD, load_model
+
+    metadata = {
+        'class_names': args.class_names or CLASS_NAMES,
+        'input_size': list(INPUT_SIZE),
+        'normalization': {'mean': NORMALIZE_MEAN, 'std': NORMALIZE_STD},
+    }
+    if args.arch:
+        metadata['architecture'] = args.arch
+    output_path = convert_checkpoint(args.model_path, args.output, metadata)
+    print(f"✅ Wrote {output_path} ({os.path.getsize(output_path) / (1024 * 1024):.0f} MB)")
+
+    if args.benchmark:
+        import torch
+
+        load_model(args.model_path, torch.device('cpu'))  # warm-up: torch/torchvision lazy init
+        for path in (args.model_path, output_path):
+            start = time.perf_counter()
+            load_model(path, torch.device('cpu'))
+            print(f"load_model({os.path.basename(path)}): {(time.perf_counter() - start) * 1000:.0f} ms",
+                  file=sys.stderr)
@@ -0,0 +1,283 @@
+"""
+Dataset manifest for training
+Walks an ImageFolder tree once, verifies and hashes every image in a process
+pool, drops (or quarantines) corrupt files and duplicates, and writes a JSON
+manifest with a deterministic, stratified train/val/test split. Later runs
+load the manifest instead of rescanning the tree
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from multiprocessing import Pool
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+SPLITS = ('train', 'val', 'test')
+DEFAULT_RATIOS = (0.7, 0.15, 0.15)
+DEFAULT_SEED = 0
+# Same extensions torchvision's ImageFolder accepts
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+
+
+def manifest_path(root):
+    """
+    Default manifest location: <root>/manifest.json (ignored by ImageFolder, which only lists directories)
+
+    For a dataset directory that cannot be written to (a read-only or shared
+    mount), the manifest goes to the user's cache instead, keyed by the
+    dataset's absolute path.
+    """
+    if os.access(root, os.W_OK):
+        return os.path.join(root, MANIFEST_NAME)
+    return cached_manifest_path(root)
+
+
+def cached_manifest_path(root):
+    """~/.cache/meditrack/manifests/<hash of the dataset path>.json ($XDG_CACHE_HOME is honoured)."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    key = hashlib.sha256(os.path.abspath(root).encode()).hexdigest()[:16]
+    return os.path.join(cache_home, 'meditrack', 'manifests', f'{key}.json')
+
+
+def walk_tree(root):
+    """
+    Class directories of the tree, in sorted order
+
+    Handles both layouts used by train_model: root/<class>/... and
+    root/{train,val,test}/<class>/...
+
+    Yields:
+        tuple: (directory, class name, split or None, file names)
+    """
+    presplit = os.path.isdir(os.path.join(root, 'train'))
+    tops = [(os.path.join(root, split), split) for split in SPLITS] if presplit else [(root, None)]
+    for top, split in tops:
+        if not os.path.isdir(top):
+            continue
+        for entry in sorted(os.scandir(top), key=lambda e: e.name):
+            if not entry.is_dir():
+                continue
+            for dirpath, dirnames, filenames in os.walk(entry.path, followlinks=True):
+                dirnames.sort()
+                yield dirpath, entry.name, split, sorted(filenames)
+
+
+def list_files(root):
+    """
+    Image files of the tree
+
+    Returns:
+        tuple: (classes, [(path, class name, split or None)], directories to watch)
+    """
+    classes, files, directories = set(), [], []
+    for dirpath, label, split, filenames in walk_tree(root):
+        classes.add(label)
+        directories.append(dirpath)
+        files.extend((os.path.join(dirpath, name), label, split) for name in filenames
+                     if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(classes), files, directories
+
+
+def tree_fingerprint(root, directories, ratios, seed):
+    """
+    Hash of every directory's mtime plus the split settings
+
+    A directory's mtime changes when files are added, removed or renamed in
+    it, so this detects changes to the sample list without reading the files.
+    Files rewritten in place need a rebuild (`force`).
+    """
+    digest = hashlib.sha256(f'v{MANIFEST_VERSION}|{ratios}|{seed}'.encode())
+    for directory in directories:
+        digest.update(f'{os.path.relpath(directory, root)}|{os.stat(directory).st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def inspect_image(path):
+    """
+    Size, dimensions and SHA-256 of one file, or the reason it cannot be decoded
+
+    The header is verified, then the image is decoded in draft mode (reduced
+    scale for JPEGs) so truncated data is caught without a full decode.
+    """
+    from PIL import Image
+
+    record = {'path': path}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        record['bytes'] = len(data)
+        record['sha256'] = hashlib.sha256(data).hexdigest()
+        with Image.open(path) as image:
+            image.verify()
+        with Image.open(path) as image:
+            record['width'], record['height'] = image.size
+            image.draft('RGB', (224, 224))
+            image.load()
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    return record
+
+
+def stratified_split(samples, ratios=DEFAULT_RATIOS, seed=DEFAULT_SEED):
+    """
+    Assign a split to every sample without one, class by class
+
+    Samples are ordered by a hash of (seed, content hash), so the split only
+    depends on the images themselves, not on file names or scan order.
+    """
+    by_class = {}
+    for sample in samples:
+        if sample['split'] is None:
+            by_class.setdefault(sample['label'], []).append(sample)
+    for members in by_class.values():
+        members.sort(key=lambda s: hashlib.sha256(f"{seed}|{s['sha256']}".encode()).hexdigest())
+        train_end = int(ratios[0] * len(members))
+        val_end = train_end + int(ratios[1] * len(members))
+        for i, sample in enumerate(members):
+            sample['split'] = 'train' if i < train_end else 'val' if i < val_end else 'test'
+    return samples
+
+
+def build_manifest(root, output_path=None, ratios=DEFAULT_RATIOS, seed=DEFAULT_SEED, num_workers=None,
+                   quarantine_dir=None):
+    """
+    Scan `root` and write its manifest
+
+    Args:
+        root: Dataset root in either train_model layout
+        output_path: Manifest file (default: <root>/manifest.json)
+        ratios: train/val/test fractions for trees that are not pre-split
+        seed: Changes the (still deterministic) split
+        num_workers: Processes verifying and hashing images (default: all cores)
+        quarantine_dir: Move rejected files here instead of only leaving them out
+
+    Returns:
+        dict: the manifest
+    """
+    start = time.perf_counter()
+    output_path = output_path or manifest_path(root)
+    classes, files, directories = list_files(root)
+    print(f"Indexing {len(files)} images under {root}...", file=sys.stderr)
+    with Pool(num_workers) as pool:
+        records = pool.map(inspect_image, [path for path, _, _ in files], chunksize=32)
+
+    samples, rejected, seen = [], [], {}
+    for (path, label, split), record in zip(files, records):
+        relative = os.path.relpath(path, root)
+        if 'error' in record:
+            rejected.append({'path': relative, 'reason': 'corrupt', 'detail': record['error']})
+            continue
+        # Files are visited train -> val -> test, so leaked copies are dropped from the held-out splits
+        if record['sha256'] in seen:
+            rejected.append({'path': relative, 'reason': 'duplicate', 'detail': seen[record['sha256']]})
+            continue
+        seen[record['sha256']] = relative
+        samples.append({'path': relative, 'label': classes.index(label), 'split': split, 'bytes': record['bytes'],
+                        'width': record['width'], 'height': record['height'], 'sha256': record['sha256']})
+    stratified_split(samples, ratios, seed)
+
+    if quarantine_dir:
+        for item in rejected:
+            target = os.path.join(quarantine_dir, item['path'])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(os.path.join(root, item['path']), target)
+        # Moving files changed the directory mtimes the fingerprint is based on
+        directories = list_files(root)[2]
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'root': os.path.abspath(root),
+        'fingerprint': tree_fingerprint(root, directories, list(ratios), seed),
+        'classes': classes,
+        'ratios': list(ratios),
+        'seed': seed,
+        'counts': {split: sum(1 for s in samples if s['split'] == split) for split in SPLITS},
+        'samples': samples,
+        'rejected': rejected,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, output_path)
+
+    print(f"Manifest written to {output_path} in {time.perf_counter() - start:.1f}s: "
+          f"{manifest['counts']}, {len(rejected)} rejected", file=sys.stderr)
+    for item in rejected:
+        print(f"⚠️ Skipped {item['path']} ({item['reason']}: {item['detail']})", file=sys.stderr)
+    return manifest
+
+
+def read_manifest(path):
+    """Manifest stored at `path`, or None when it is missing or from another format version."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def load_manifest(root, path=None, ratios=None, seed=None, force=False, **build_options):
+    """
+    Manifest of `root`, rebuilt only when the tree or the split settings changed
+
+    Without `path`, both <root>/manifest.json and the cache location used for
+    read-only datasets are tried. `ratios` and `seed` default to the ones the
+    existing manifest was built with (DEFAULT_RATIOS and DEFAULT_SEED for a new
+    one), so a split made with the CLI survives training runs that do not
+    repeat its settings.
+
+    Returns:
+        dict: the manifest (see build_manifest)
+    """
+    candidates = [path] if path else [os.path.join(root, MANIFEST_NAME), cached_manifest_path(root)]
+    found = [manifest for manifest in map(read_manifest, candidates) if manifest is not None]
+    if not force:
+        directories = [d for d, _, _, _ in walk_tree(root)]
+        for manifest in found:
+            current = tree_fingerprint(root, directories, list(ratios or manifest['ratios']),
+                                       seed if seed is not None else manifest['seed'])
+            if manifest['fingerprint'] == current:
+                # Paths in the manifest are relative, so the tree can be moved
+                manifest['root'] = os.path.abspath(root)
+                return manifest
+
+    stored = found[0] if found else {}
+    ratios = tuple(ratios or stored.get('ratios') or DEFAULT_RATIOS)
+    seed = seed if seed is not None else stored.get('seed', DEFAULT_SEED)
+    path = path or manifest_path(root)
+    if found:
+        print(f"Dataset or split settings changed, rebuilding manifest: {path}", file=sys.stderr)
+    return build_manifest(root, path, ratios, seed, **build_options)
+
+
+def split_samples(manifest, split):
+    """(absolute path, label) pairs of one split, in manifest order."""
+    return [(os.path.join(manifest['root'], s['path']), s['label'])
+            for s in manifest['samples'] if s['split'] == split]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Index a dataset into a manifest with a deterministic split')
+    parser.add_argument('data_dir', type=str, help='Dataset root (same layout as for training)')
+    parser.add_argument('--output', type=str,
+                        help='Manifest path (default: <data_dir>/manifest.json, or the user cache when '
+                             'data_dir is read-only)')
+    parser.add_argument('--ratios', type=float, nargs=3, default=list(DEFAULT_RATIOS),
+                        metavar=('TRAIN', 'VAL', 'TEST'), help='Split fractions for trees that are not pre-split')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Split seed')
+    parser.add_argument('--num-workers', type=int, help='Indexing processes (default: all cores)')
+    parser.add_argument('--quarantine', type=str, help='Move corrupt and duplicate files to this directory')
+
+    args = parser.parse_args()
+
+    manifest = build_manifest(args.data_dir, args.output, tuple(args.ratios), args.seed, args.num_workers,
+                              args.quarantine)
+    print(json.dumps({'classes': manifest['classes'], 'counts': manifest['counts'],
+                      'rejected': manifest['rejected']}, indent=2))
@@ -0,0 +1,186 @@
+"""
+Multi-process DistributedDataParallel training for the fracture classifier
+Runs external_trainer's training loop in N CPU processes (gloo backend), each
+working on its own shard of the data, and writes the same
+bone_fracture_model.pth as train_model
+
+Launch with the built-in launcher:
+    python ddp_trainer.py <data_dir> --nproc 4
+or with torchrun:
+    torchrun --nproc_per_node 4 ddp_trainer.py <data_dir>
+"""
+
+import os
+import random
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+from torchvision import models
+
+from checkpoint_io import load_weights, save_weights
+from external_trainer import (build_datasets, checkpoint_metadata, evaluate_accuracy, make_loader,
+                              resolve_amp_dtype, train_one_epoch, validate)
+
+
+def all_reduce_metrics(loss_sum, correct, total, batches):
+    """Sum per-rank epoch metrics across all ranks in one collective."""
+    packed = torch.tensor([float(loss_sum), float(correct), float(total), float(batches)], dtype=torch.float64)
+    dist.all_reduce(packed, op=dist.ReduceOp.SUM)
+    loss_sum, correct, total, batches = packed.tolist()
+    return loss_sum / batches, 100 * correct / total
+
+
+def _train_worker(rank, world_size, config, results=None):
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        test_acc = _train(rank, world_size, **config)
+        if rank == 0 and results is not None:
+            results.put(test_acc)
+    finally:
+        dist.destroy_process_group()
+
+
+def _train(rank, world_size, data_dir, model_save_path, epochs, batch_size, simulate,
+           seed, num_workers, amp, tensor_cache_dir, manifest_path=None):
+    is_main = rank == 0
+    # Split the cores between ranks instead of oversubscribing them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    device = torch.device('cpu')
+
+    # Every rank must start from the same initial weights
+    random.seed(seed)
+    torch.manual_seed(seed)
+    if not is_main:
+        # Let rank 0 build the dataset manifest (and tensor cache) before the others read them
+        dist.barrier()
+    train_dataset, val_dataset, test_dataset, class_names = build_datasets(data_dir, simulate, tensor_cache_dir,
+                                                                           manifest_path)
+    if is_main:
+        dist.barrier()
+    if simulate:
+        epochs = 1
+
+    if is_main:
+        print(f"DDP training on {world_size} processes (gloo)")
+        print(f"Class names: {class_names}")
+        print(f"Training samples: {len(train_dataset)}")
+        print(f"Validation samples: {len(val_dataset)}")
+        print(f"Test samples: {len(test_dataset)}")
+
+    train_sampler = DistributedSampler(train_dataset, world_size, rank, shuffle=True, seed=seed)
+    val_sampler = DistributedSampler(val_dataset, world_size, rank, shuffle=False)
+    train_loader = make_loader(train_dataset, batch_size, True, device, num_workers, sampler=train_sampler)
+    val_loader = make_loader(val_dataset, batch_size, False, device, num_workers, sampler=val_sampler)
+
+    arch = 'resnet18' if simulate else 'resnet50'
+    model = models.resnet50(pretrained=True) if not simulate else models.resnet18(pretrained=True)
+    model.fc = nn.Linear(model.fc.in_features, 2)
+    ddp_model = DistributedDataParallel(model)
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(ddp_model.parameters(), lr=0.0001)
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=2, factor=0.5)
+    autocast_dtype = resolve_amp_dtype(device, amp)
+
+    if is_main:
+        print("Starting Training...")
+    best_val_loss = float('inf')
+    for epoch in range(epochs):
+        train_sampler.set_epoch(epoch)
+        running_loss, correct, total = train_one_epoch(ddp_model, train_loader, criterion, optimizer,
+                                                       device, autocast_dtype)
+        train_loss, train_acc = all_reduce_metrics(running_loss, correct, total, len(train_loader))
+
+        val_loss, val_correct, val_total = validate(ddp_model, val_loader, criterion, device, autocast_dtype)
+        # Every rank sees the same global val loss, so the LR schedule stays in lockstep
+        val_loss, val_acc = all_reduce_metrics(val_loss, val_correct, val_total, len(val_loader))
+        scheduler.step(val_loss)
+
+        if is_main:
+            print(f"Epoch {epoch+1}/{epochs}: Train Loss={train_loss:.4f}, Train Acc={train_acc:.2f}%, "
+                  f"Val Loss={val_loss:.4f}, Val Acc={val_acc:.2f}%")
+
+        if val_loss < best_val_loss:
+            best_val_loss = val_loss
+            if is_main:
+                os.makedirs(os.path.dirname(model_save_path), exist_ok=True)
+                # Save the unwrapped module so the file matches train_model's format
+                save_weights(model.state_dict(), model_save_path,
+                             checkpoint_metadata(arch, class_names, epoch=epoch + 1, train_acc=train_acc,
+                                                 val_loss=val_loss, val_acc=val_acc))
+                print(f"Model saved at epoch {epoch+1} with val loss {val_loss:.4f}")
+        dist.barrier()
+
+    if not is_main:
+        return None
+
+    print("Model Training Completed!")
+    test_loader = make_loader(test_dataset, batch_size, False, device, num_workers)
+    model.load_state_dict(load_weights(model_save_path)[0])
+    test_acc = evaluate_accuracy(model, test_loader, device)
+    print(f"Test Accuracy: {test_acc:.2f}%")
+    return test_acc
+
+
+def train_model_ddp(data_dir, model_save_path="./pretrained_models/bone_fracture_model.pth",
+                    epochs=5, batch_size=32, simulate=False, nproc=2, seed=42,
+                    num_workers=0, amp=False, tensor_cache_dir=None, master_port=29500,
+                    manifest_path=None):
+    """
+    Train with DistributedDataParallel on one machine
+
+    When started by torchrun (RANK/WORLD_SIZE set) the current process joins
+    the group directly; otherwise `nproc` processes are spawned. `batch_size`
+    is per process, so the effective batch is nproc * batch_size.
+
+    Returns:
+        float: test accuracy on rank 0 (None on other torchrun ranks)
+    """
+    config = dict(data_dir=data_dir, model_save_path=model_save_path, epochs=epochs,
+                  batch_size=batch_size, simulate=simulate, seed=seed, num_workers=num_workers,
+                  amp=amp, tensor_cache_dir=tensor_cache_dir, manifest_path=manifest_path)
+
+    if 'RANK' in os.environ and 'WORLD_SIZE' in os.environ:
+        rank, world_size = int(os.environ['RANK']), int(os.environ['WORLD_SIZE'])
+        dist.init_process_group('gloo')
+        try:
+            return _train(rank, world_size, **config)
+        finally:
+            dist.destroy_process_group()
+
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(master_port))
+    results = mp.get_context('spawn').SimpleQueue()
+    mp.spawn(_train_worker, args=(nproc, config, results), nprocs=nproc, join=True)
+    return results.get()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='DDP training of the bone fracture classifier')
+    parser.add_argument('data_dir', type=str, help='Dataset root (same layout as for train_model)')
+    parser.add_argument('--model-save-path', type=str, default='./pretrained_models/bone_fracture_model.pth',
+                        help='Where to save the best checkpoint')
+    parser.add_argument('--epochs', type=int, default=5, help='Number of epochs')
+    parser.add_argument('--batch-size', type=int, default=32, help='Per-process batch size')
+    parser.add_argument('--nproc', type=int, default=2, help='Processes to spawn (ignored under torchrun)')
+    parser.add_argument('--workers', type=int, default=0, help='DataLoader workers per process')
+    parser.add_argument('--seed', type=int, default=42, help='Seed shared by all ranks')
+    parser.add_argument('--amp', action='store_true', help='bf16 mixed precision')
+    parser.add_argument('--tensor-cache-dir', type=str, help='Use a preprocessed tensor cache')
+    parser.add_argument('--manifest', type=str, help='Dataset manifest to use (default: <data_dir>/manifest.json)')
+    parser.add_argument('--simulate', action='store_true', help='ResNet-18, one epoch, tiny subset')
+
+    args = parser.parse_args()
+
+    test_accuracy = train_model_ddp(args.data_dir, args.model_save_path, args.epochs, args.batch_size,
+                                    args.simulate, args.nproc, args.seed, args.workers, args.amp,
+                                    args.tensor_cache_dir, manifest_path=args.manifest)
+    if test_accuracy is not None:
+        print(f"✅ Training complete! Final test accuracy: {test_accuracy:.2f}%")
@@ -0,0 +1,309 @@
+"""
+Knowledge distillation of the fracture classifier into a small student
+The trained ResNet-50 is a frozen teacher: its logits for every training image
+are computed once and cached next to its weights, then a ResNet-18 or
+MobileNet student learns from those soft targets plus the hard labels. The
+report compares test accuracy and CPU latency of both models
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.utils.data import DataLoader, Dataset
+from torchvision import models
+
+from checkpoint_io import CHECKPOINT_EXTENSION, load_weights, save_weights
+from external_trainer import (autocast, build_datasets, checkpoint_metadata, evaluate_accuracy, make_loader,
+                              resolve_amp_dtype, sample_paths, validate)
+from predict_api import load_model, replace_head
+
+STUDENT_ARCHS = ['resnet18', 'mobilenet_v3_large', 'mobilenet_v3_small', 'mobilenet_v2']
+
+
+class TeacherInputs(Dataset):
+    """Images decoded and preprocessed exactly as at inference, for computing teacher logits."""
+
+    def __init__(self, paths):
+        from predict_api import get_transform
+
+        self.paths = paths
+        self.transform = get_transform()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        from image_io import load_image
+        from predict_api import INPUT_SIZE
+
+        return self.transform(load_image(self.paths[index], size=INPUT_SIZE))
+
+
+class DistillationDataset(Dataset):
+    """Wraps a training dataset so every sample also carries its cached teacher logits."""
+
+    def __init__(self, dataset, teacher_logits):
+        self.dataset = dataset
+        self.teacher_logits = torch.from_numpy(teacher_logits)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        image, label = self.dataset[index]
+        return image, label, self.teacher_logits[index]
+
+
+def logits_cache_path(teacher_path):
+    """Default teacher logit cache: <teacher without extension>.logits.npz"""
+    return os.path.splitext(teacher_path)[0] + '.logits.npz'
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def teacher_logits(teacher, teacher_path, paths, cache_path, device, batch_size=32, num_workers=0):
+    """
+    Teacher logits for every image in `paths`, computed once per image
+
+    Logits are cached in `cache_path` keyed by each image's path, size and
+    mtime, so later runs (and different splits of the same folder) only run
+    the teacher on images it has not seen. The cache is discarded when the
+    teacher's weights file changes.
+
+    Returns:
+        np.ndarray: float32 logits, one row per path
+    """
+    teacher_key = hashlib.sha256(_file_key(teacher_path).encode()).hexdigest()
+    keys = [_file_key(path) for path in paths]
+    cached = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            if str(data['teacher']) == teacher_key:
+                cached = dict(zip(data['keys'].tolist(), data['logits']))
+            else:
+                print("Teacher weights changed, discarding cached logits")
+
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    print(f"Teacher logits: {len(keys) - len(missing)} cached, computing {len(missing)}")
+    if missing:
+        loader = DataLoader(TeacherInputs([paths[i] for i in missing]), batch_size=batch_size,
+                            num_workers=num_workers)
+        outputs = []
+        teacher.eval()
+        with torch.no_grad():
+            for images in loader:
+                outputs.append(teacher(images.to(device)).float().cpu().numpy())
+        for i, row in zip(missing, np.concatenate(outputs)):
+            cached[keys[i]] = row
+
+        tmp_path = f'{cache_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, teacher=np.array(teacher_key), keys=np.array(list(cached)),
+                     logits=np.stack(list(cached.values())).astype(np.float32))
+        os.replace(tmp_path, cache_path)
+    return np.stack([cached[key] for key in keys]).astype(np.float32)
+
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature=4.0, alpha=0.7):
+    """
+    Hinton et al. distillation loss
+
+    `alpha` weighs the KL divergence between the temperature-softened teacher
+    and student distributions (scaled by T^2 to keep its gradients comparable)
+    against the cross-entropy with the hard labels.
+    """
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                    F.softmax(teacher_logits / temperature, dim=1), reduction='batchmean')
+    hard = F.cross_entropy(student_logits, labels)
+    return alpha * soft * temperature ** 2 + (1 - alpha) * hard
+
+
+def distill_one_epoch(model, loader, optimizer, device, temperature, alpha, autocast_dtype=None, scaler=None):
+    """
+    One pass over a DistillationDataset loader, accumulated on-device like train_one_epoch
+
+    Returns:
+        tuple: (summed batch losses, correct predictions, samples) as tensors/ints
+    """
+    model.train()
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+    for images, labels, soft_targets in loader:
+        images, labels = images.to(device, non_blocking=True), labels.to(device, non_blocking=True)
+        soft_targets = soft_targets.to(device, non_blocking=True)
+        optimizer.zero_grad(set_to_none=True)
+        with autocast(device, autocast_dtype):
+            outputs = model(images)
+        loss = distillation_loss(outputs.float(), soft_targets, labels, temperature, alpha)
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
+        running_loss += loss.detach().float()
+        _, predicted = torch.max(outputs.detach(), 1)
+        total += labels.size(0)
+        correct += (predicted == labels).sum()
+    return running_loss, correct, total
+
+
+def cpu_latency_ms(model, iterations=20, warmup=3):
+    """Median single-image forward latency on CPU."""
+    from export_model import benchmark
+
+    return benchmark(model.to('cpu').eval(), batch_size=1, iterations=iterations, warmup=warmup)['p50_ms']
+
+
+def distill_model(data_dir, teacher_path="./pretrained_models/bone_fracture_model.pth",
+                  student_save_path="./pretrained_models/bone_fracture_student.safetensors", arch='resnet18',
+                  epochs=10, batch_size=32, temperature=4.0, alpha=0.7, lr=0.001, max_accuracy_drop=2.0,
+                  simulate=False, tensor_cache_dir=None, num_workers=0, amp=False, logits_cache=None,
+                  manifest_path=None):
+    """
+    Train a small student classifier from the frozen ResNet-50 teacher
+
+    Args:
+        teacher_path: Trained teacher weights (train_model output)
+        student_save_path: Where the best student is saved; a .safetensors path
+            records the architecture so every prediction entry point can load it
+        arch: Student architecture (see STUDENT_ARCHS)
+        temperature, alpha: Softening of the teacher's logits and weight of the
+            soft targets in the loss (see distillation_loss)
+        max_accuracy_drop: Test accuracy points the student may lose against
+            the teacher before the report marks it as failing
+        logits_cache: Teacher logit cache (default: <teacher>.logits.npz)
+        manifest_path: Dataset manifest to use (see dataset_index.manifest_path)
+
+    Returns:
+        dict: teacher and student test accuracy, CPU latency and speedup
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+
+    train_dataset, val_dataset, test_dataset, class_names = build_datasets(data_dir, simulate, tensor_cache_dir,
+                                                                           manifest_path)
+    if simulate:
+        epochs = 1
+
+    teacher = load_model(teacher_path, device)
+    soft_targets = teacher_logits(teacher, teacher_path, sample_paths(train_dataset),
+                                  logits_cache or logits_cache_path(teacher_path), device, batch_size, num_workers)
+
+    loader_args = dict(num_workers=num_workers)
+    train_loader = make_loader(DistillationDataset(train_dataset, soft_targets), batch_size, True, device,
+                               **loader_args)
+    val_loader = make_loader(val_dataset, batch_size, False, device, **loader_args)
+    test_loader = make_loader(test_dataset, batch_size, False, device, **loader_args)
+
+    model = replace_head(getattr(models, arch)(pretrained=True), len(class_names)).to(device)
+    print(f"Distilling into {arch} (T={temperature}, alpha={alpha}).")
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=lr)
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=2, factor=0.5)
+    autocast_dtype = resolve_amp_dtype(device, amp)
+    scaler = torch.amp.GradScaler('cuda') if autocast_dtype == torch.float16 else None
+    distillation = dict(teacher=os.path.basename(teacher_path), temperature=temperature, alpha=alpha)
+
+    best_val_loss = float('inf')
+    best_metrics = {}
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        running_loss, correct, total = distill_one_epoch(model, train_loader, optimizer, device, temperature,
+                                                         alpha, autocast_dtype, scaler)
+        train_loss, train_acc = running_loss.item() / len(train_loader), 100 * correct.item() / total
+        samples_per_sec = total / (time.perf_counter() - start)
+
+        val_loss, val_correct, val_total = validate(model, val_loader, criterion, device, autocast_dtype)
+        val_loss = val_loss.item() / len(val_loader)
+        val_acc = 100 * val_correct.item() / val_total
+
+        scheduler.step(val_loss)
+        print(f"Epoch {epoch+1}/{epochs}: Distill Loss={train_loss:.4f}, Train Acc={train_acc:.2f}%, "
+              f"Val Loss={val_loss:.4f}, Val Acc={val_acc:.2f}%, {samples_per_sec:.1f} samples/sec")
+
+        if val_loss < best_val_loss:
+            best_val_loss = val_loss
+            best_metrics = dict(epoch=epoch + 1, train_acc=train_acc, val_loss=val_loss, val_acc=val_acc)
+            os.makedirs(os.path.dirname(student_save_path) or '.', exist_ok=True)
+            save_weights(model.state_dict(), student_save_path,
+                         checkpoint_metadata(arch, class_names, distillation=distillation, **best_metrics))
+            print(f"Student saved at epoch {epoch+1} with val loss {val_loss:.4f}")
+
+    model.load_state_dict(load_weights(student_save_path, map_location=device)[0])
+    teacher_acc = evaluate_accuracy(teacher, test_loader, device)
+    student_acc = evaluate_accuracy(model, test_loader, device)
+    if student_save_path.endswith(CHECKPOINT_EXTENSION):
+        save_weights(model.state_dict(), student_save_path,
+                     checkpoint_metadata(arch, class_names, distillation=distillation, test_acc=student_acc,
+                                         teacher_test_acc=teacher_acc, **best_metrics))
+
+    teacher_ms, student_ms = cpu_latency_ms(teacher), cpu_latency_ms(model)
+    report = {
+        'arch': arch,
+        'student_path': student_save_path,
+        'teacher_test_accuracy': teacher_acc,
+        'student_test_accuracy': student_acc,
+        'accuracy_drop': teacher_acc - student_acc,
+        'max_accuracy_drop': max_accuracy_drop,
+        'within_budget': teacher_acc - student_acc <= max_accuracy_drop,
+        'teacher_cpu_ms': teacher_ms,
+        'student_cpu_ms': student_ms,
+        'cpu_speedup': teacher_ms / student_ms,
+        'teacher_size_mb': os.path.getsize(teacher_path) / 1024 ** 2,
+        'student_size_mb': os.path.getsize(student_save_path) / 1024 ** 2,
+    }
+    print(f"Teacher: {teacher_acc:.2f}% at {teacher_ms:.1f} ms/image, "
+          f"student: {student_acc:.2f}% at {student_ms:.1f} ms/image ({report['cpu_speedup']:.1f}x faster)")
+    if not report['within_budget']:
+        print(f"❌ Student is {report['accuracy_drop']:.2f} points below the teacher "
+              f"(limit {max_accuracy_drop:.2f})")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Distill the ResNet-50 classifier into a small, fast student')
+    parser.add_argument('data_dir', type=str, help='Dataset root (same layout as for training)')
+    parser.add_argument('--teacher', type=str, default='./pretrained_models/bone_fracture_model.pth',
+                        help='Trained ResNet-50 weights')
+    parser.add_argument('--output', type=str, default='./pretrained_models/bone_fracture_student.safetensors',
+                        help='Where to save the student')
+    parser.add_argument('--arch', type=str, default='resnet18', choices=STUDENT_ARCHS, help='Student architecture')
+    parser.add_argument('--epochs', type=int, default=10, help='Training epochs')
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch size')
+    parser.add_argument('--temperature', type=float, default=4.0, help='Softmax temperature of the soft targets')
+    parser.add_argument('--alpha', type=float, default=0.7, help='Weight of the soft targets in the loss')
+    parser.add_argument('--lr', type=float, default=0.001, help='Learning rate')
+    parser.add_argument('--max-accuracy-drop', type=float, default=2.0,
+                        help='Exit with an error if the student trails the teacher by more points than this')
+    parser.add_argument('--logits-cache', type=str, help='Teacher logit cache (default: <teacher>.logits.npz)')
+    parser.add_argument('--tensor-cache', type=str, help='Decode the dataset once into this directory')
+    parser.add_argument('--num-workers', type=int, default=0, help='DataLoader worker processes')
+    parser.add_argument('--amp', action='store_true', help='Mixed precision training')
+    parser.add_argument('--manifest', type=str, help='Dataset manifest to use (default: <data_dir>/manifest.json)')
+    parser.add_argument('--simulate', action='store_true', help='Use a tiny subset of the data')
+
+    args = parser.parse_args()
+
+    report = distill_model(args.data_dir, args.teacher, args.output, args.arch, args.epochs, args.batch_size,
+                           args.temperature, args.alpha, args.lr, args.max_accuracy_drop, args.simulate,
+                           args.tensor_cache, args.num_workers, args.amp, args.logits_cache,
+                           args.manifest)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['within_budget'] else 1)
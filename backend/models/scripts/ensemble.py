@@ -0,0 +1,250 @@
+"""
+ResNet + YOLOv8 ensemble prediction with optional test-time augmentation
+Decodes each image once. The classifier scores the image and its TTA
+variants (flips, small rotations, scales) as one stacked batch while YOLOv8
+runs concurrently on the same decoded image, and both outputs are fused into
+one response: averaged class probabilities plus detections annotated with how
+consistently they were found
+"""
+
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from cascade import DETECTION_KEYS
+from instrumentation import NULL_TRACE, start_trace, attach_timings
+from model_registry import get_default_registry
+
+DEFAULT_TTA = ('hflip', 'rot-5', 'rot5', 'scale0.9', 'scale1.1')
+TTA_PATTERN = re.compile(r'^(hflip|vflip|rot(-?\d+(?:\.\d+)?)|scale(\d+(?:\.\d+)?))$')
+# IoU above which a box from a flipped view counts as the same finding
+AGREEMENT_IOU = 0.5
+
+# The detector runs on its own thread while the classifier's batch runs on the caller's
+_detector_thread = ThreadPoolExecutor(1, thread_name_prefix='ensemble-detector')
+
+
+def parse_tta(spec):
+    """
+    TTA variant names from a request parameter
+
+    Accepts None/'' /'none' (no TTA), '1'/'true'/'default' (DEFAULT_TTA), or a
+    comma-separated string / list of 'hflip', 'vflip', 'rot<degrees>' and
+    'scale<factor>' (e.g. 'hflip,rot-5,scale1.1').
+    """
+    if spec is None or spec is False:
+        return ()
+    if spec is True:
+        return DEFAULT_TTA
+    if isinstance(spec, str):
+        if spec.lower() in ('', '0', 'none', 'false', 'no'):
+            return ()
+        if spec.lower() in ('1', 'true', 'yes', 'default'):
+            return DEFAULT_TTA
+        spec = spec.split(',')
+    variants = tuple(name.strip() for name in spec if name.strip())
+    unknown = [name for name in variants if not TTA_PATTERN.match(name)]
+    if unknown:
+        raise ValueError(f"Unknown TTA variant(s) {unknown}, expected hflip, vflip, rot<degrees> or scale<factor>")
+    return variants
+
+
+def tta_batch(image_tensor, variants):
+    """Stack a preprocessed CHW tensor with its TTA variants: (1 + len(variants), C, H, W)."""
+    import torch
+    import torchvision.transforms.functional as TF
+
+    views = [image_tensor]
+    for name in variants:
+        if name == 'hflip':
+            views.append(TF.hflip(image_tensor))
+        elif name == 'vflip':
+            views.append(TF.vflip(image_tensor))
+        elif name.startswith('rot'):
+            # Normalized tensor: filling with 0 pads with the mean colour
+            views.append(TF.rotate(image_tensor, float(name[3:]), interpolation=TF.InterpolationMode.BILINEAR))
+        else:
+            views.append(TF.affine(image_tensor, angle=0.0, translate=[0, 0], scale=float(name[5:]), shear=[0.0],
+                                   interpolation=TF.InterpolationMode.BILINEAR))
+    return torch.stack(views)
+
+
+def classify_views(classifier, batch, device):
+    """
+    Softmax probabilities of every view, fused by averaging
+
+    Returns:
+        tuple: (fused probability row, per-view probabilities) as NumPy arrays
+    """
+    import torch
+    import torch.nn.functional as F
+
+    with torch.no_grad():
+        probabilities = F.softmax(classifier(batch.to(device)), dim=1).cpu().numpy()
+    return probabilities.mean(axis=0), probabilities
+
+
+def unflip_detections(result, width):
+    """Mirror the boxes of a result computed on the horizontally flipped image back."""
+    detections = []
+    for detection in result['detections']:
+        bbox = detection['bbox']
+        detections.append(dict(detection, bbox=dict(bbox, x1=width - bbox['x2'], x2=width - bbox['x1'])))
+    return detections
+
+
+def annotate_agreement(detections, other_views):
+    """
+    Add to every detection the fraction of views that found it
+
+    A detection counts as found in another view when a box of the same class
+    overlaps it by at least AGREEMENT_IOU.
+    """
+    import numpy as np
+    from yolo_utils import box_iou
+
+    def as_array(items):
+        return np.array([[d['bbox'][k] for k in ('x1', 'y1', 'x2', 'y2')] for d in items], dtype=np.float64)
+
+    annotated = []
+    for detection in detections:
+        box = as_array([detection])[0]
+        found = 1
+        for view in other_views:
+            same_class = [d for d in view if d['class'] == detection['class']]
+            if same_class and box_iou(box, as_array(same_class)).max() >= AGREEMENT_IOU:
+                found += 1
+        annotated.append(dict(detection, agreement=found / (1 + len(other_views))))
+    return annotated
+
+
+def detect_views(detector, image, variants, conf=0.25, iou=0.45, device=None, trace=NULL_TRACE):
+    """YOLO result on the decoded image; with 'hflip' in `variants` its boxes carry an agreement score."""
+    from PIL import Image
+    from predict_yolo import detect_fractures
+
+    result = detect_fractures(detector, image, device, conf=conf, iou=iou, trace=trace)
+    if 'hflip' in variants:
+        flipped = detect_fractures(detector, image.transpose(Image.FLIP_LEFT_RIGHT), device, conf=conf, iou=iou)
+        result = dict(result, detections=annotate_agreement(result['detections'],
+                                                            [unflip_detections(flipped, image.width)]))
+    return result
+
+
+def ensemble_predict(image, classifier, device, detector=None, tta=(), transform=None, conf=0.25, iou=0.45,
+                     detector_device=None, detector_lock=None, trace=NULL_TRACE):
+    """
+    Fused classifier + detector prediction for one decoded RGB PIL image
+
+    Args:
+        classifier: Loaded classifier (any backend taking an NCHW batch)
+        detector: Loaded YOLOv8 model, or None for a classifier-only ensemble
+        tta: TTA variant names (see parse_tta); () runs a single view
+        detector_lock: Held while the detector runs (ultralytics predictors are not thread-safe)
+
+    Returns:
+        dict: classifier prediction from the averaged probabilities, the
+        detection fields when a detector ran, and an 'ensemble' block
+        describing the views and whether the two models agree
+    """
+    from predict_api import CLASS_NAMES, format_result, get_transform
+
+    def run_detector():
+        if detector_lock is None:
+            return detect_views(detector, image, tta, conf, iou, detector_device)
+        with detector_lock:
+            return detect_views(detector, image, tta, conf, iou, detector_device)
+
+    detection = _detector_thread.submit(run_detector) if detector is not None else None
+
+    with trace.stage('preprocess'):
+        batch = tta_batch((transform or get_transform())(image), tta)
+    with trace.stage('forward'):
+        fused, per_view = classify_views(classifier, batch, device)
+    result = format_result(fused)
+    predicted = CLASS_NAMES.index(result['prediction'])
+    ensemble = {
+        'views': ['original', *tta],
+        # Share of the views whose own verdict matches the fused one
+        'view_agreement': float((per_view.argmax(axis=1) == predicted).mean()),
+    }
+
+    if detection is not None:
+        with trace.stage('detector_wait'):
+            detected = detection.result()
+        result.update({key: detected[key] for key in DETECTION_KEYS if key in detected})
+        ensemble['detector'] = {key: detected[key] for key in ('prediction', 'confidence')}
+        ensemble['models_agree'] = detected['prediction'] == result['prediction']
+    return dict(result, ensemble=ensemble)
+
+
+def predict_ensemble_json(image_path, model_path="./pretrained_models/bone_fracture_model.pth",
+                          yolo_path="./runs/detect/bone_fracture_yolov8m/weights/best.pt", tta=(),
+                          backend='torch', conf=0.25, iou=0.45, timings=False):
+    """
+    Ensemble prediction for an image file, JSON-ready
+
+    The detector is skipped (classifier-only ensemble) when `yolo_path` is
+    None; a path that does not exist is an error.
+    """
+    trace = start_trace('predict_ensemble', force=timings)
+    try:
+        from image_io import decode_image
+        from predict_api import load_shared_model
+        from predict_yolo import load_yolo_model
+
+        tta = parse_tta(tta)
+        if yolo_path and not os.path.exists(yolo_path):
+            raise FileNotFoundError(f'YOLOv8 model file not found at {yolo_path}')
+        with trace.stage('model_load'):
+            classifier, device = load_shared_model(model_path, backend)
+            detector = None
+            if yolo_path:
+                detector = get_default_registry().ensure(f'detector:{os.path.abspath(yolo_path)}',
+                                                         load_yolo_model, yolo_path, device=None)
+        # Full resolution: the detector reports boxes in original pixels, the
+        # classifier's transform resizes to its input size
+        with trace.stage('decode'):
+            image, original_size = decode_image(image_path)
+        trace.image(original_size)
+
+        result = ensemble_predict(image, classifier, device, detector, tta, conf=conf, iou=iou, trace=trace)
+        trace.finish()
+        return attach_timings(result, trace) if timings else result
+
+    except Exception as e:
+        trace.finish(error=e)
+        return {
+            'error': str(e),
+            'prediction': None,
+            'confidence': 0,
+            'probabilities': {},
+            'detections': []
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='ResNet + YOLOv8 ensemble prediction with optional TTA '
+                                                 '(JSON output)')
+    parser.add_argument('image_path', type=str, help='Path to the X-ray image')
+    parser.add_argument('--model', type=str, default='./pretrained_models/bone_fracture_model.pth',
+                        help='Path to the trained classifier')
+    parser.add_argument('--yolo-model', type=str, default='./runs/detect/bone_fracture_yolov8m/weights/best.pt',
+                        help='Path to the trained YOLOv8 model')
+    parser.add_argument('--no-detector', action='store_true', help='Classifier-only ensemble (TTA only)')
+    parser.add_argument('--tta', type=str, default='none',
+                        help="TTA views: 'none', 'default' or a list like 'hflip,rot-5,rot5,scale1.1'")
+    parser.add_argument('--backend', type=str, default='torch',
+                        choices=['torch', 'torchscript', 'onnx', 'quantized'], help='Classifier backend')
+    parser.add_argument('--conf', type=float, default=0.25, help='Detector confidence threshold')
+    parser.add_argument('--iou', type=float, default=0.45, help='Detector NMS IoU threshold')
+    parser.add_argument('--timings', action='store_true', help='Add per-stage timings to the JSON output')
+
+    args = parser.parse_args()
+
+    result = predict_ensemble_json(args.image_path, args.model, None if args.no_detector else args.yolo_model,
+                                   args.tta, args.backend, args.conf, args.iou, args.timings)
+    print(json.dumps(result))
@@ -0,0 +1,376 @@
+"""
+Parallel evaluation of every checkpoint of a YOLOv8 training run
+Decodes and letterboxes the validation images once into shared memory, then
+worker processes (one checkpoint at a time each) compute mAP50, mAP50-95,
+precision, recall and per-image inference latency for every .pt file under
+runs/detect/<run>/weights, and the results are written as a comparison table
+"""
+
+import csv
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from worker_pool import core_slices
+from yolo_utils import letterbox, postprocess, scale_boxes
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+TABLE_COLUMNS = ('checkpoint', 'epoch', 'map50', 'map50_95', 'precision', 'recall', 'latency_p50_ms',
+                 'latency_p95_ms', 'size_mb')
+
+
+def list_checkpoints(run_dir):
+    """best.pt, last.pt and the epoch<N>.pt files saved every `save_period` epochs, by epoch."""
+    paths = glob.glob(os.path.join(run_dir, 'weights', '*.pt'))
+
+    def order(path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return (0, int(name[5:])) if name.startswith('epoch') and name[5:].isdigit() else (1, name)
+    return sorted(paths, key=order)
+
+
+def resolve_val_images(data_yaml, split='val'):
+    """
+    Validation image paths of an ultralytics data.yaml
+
+    Relative entries are resolved against its `path` key, or the yaml's own
+    directory, like ultralytics does; entries may be directories, lists of
+    directories or .txt files listing images.
+
+    Returns:
+        tuple: (image paths, class names dict)
+    """
+    import yaml
+
+    with open(data_yaml, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    base = os.path.dirname(os.path.abspath(data_yaml))
+    root = os.path.join(base, data['path']) if data.get('path') else base
+    entries = data[split] if isinstance(data[split], list) else [data[split]]
+
+    images = []
+    for entry in entries:
+        path = os.path.normpath(os.path.join(root, entry))
+        if not os.path.exists(path) and entry.startswith('../'):
+            # Roboflow exports write '../valid/images' for <root>/valid/images
+            path = os.path.normpath(os.path.join(root, entry[3:]))
+        if path.endswith('.txt'):
+            with open(path, 'r', encoding='utf-8') as f:
+                images.extend(os.path.join(os.path.dirname(path), line.strip()) for line in f if line.strip())
+        else:
+            images.extend(sorted(p for p in glob.glob(os.path.join(path, '**', '*'), recursive=True)
+                                 if p.lower().endswith(IMAGE_SUFFIXES)))
+    if not images:
+        raise FileNotFoundError(f"No {split} images found for {data_yaml} ({entries})")
+    names = data.get('names', {})
+    return images, dict(enumerate(names)) if isinstance(names, list) else names
+
+
+def label_path(image_path):
+    """YOLO label file of an image: /images/ -> /labels/, extension -> .txt"""
+    head, _, tail = image_path.rpartition(f'{os.sep}images{os.sep}')
+    return os.path.splitext(os.path.join(head, 'labels', tail) if head else image_path)[0] + '.txt'
+
+
+def read_labels(image_path, width, height):
+    """Ground truth of one image: (xyxy boxes in original pixels, class ids)."""
+    path = label_path(image_path)
+    rows = []
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [line.split() for line in f if line.strip()]
+    # Segment labels: the box is the polygon's extent
+    boxes, classes = [], []
+    for row in rows:
+        values = np.array(row[1:], dtype=np.float64)
+        if len(values) == 4:
+            cx, cy, w, h = values
+            x1, y1, x2, y2 = cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2
+        else:
+            xs, ys = values[0::2], values[1::2]
+            x1, y1, x2, y2 = xs.min(), ys.min(), xs.max(), ys.max()
+        boxes.append([x1 * width, y1 * height, x2 * width, y2 * height])
+        classes.append(int(row[0]))
+    return np.array(boxes, dtype=np.float64).reshape(-1, 4), np.array(classes, dtype=np.int64)
+
+
+def prepare_images(image_paths, imgsz=640, num_workers=None):
+    """
+    Decode and letterbox every validation image into one shared-memory array
+
+    Returns:
+        tuple: (SharedMemory holding (N, imgsz, imgsz, 3) uint8, per-image
+        [ratio, pad_x, pad_y, height, width] as an (N, 5) array, ground truths)
+    """
+    from multiprocessing import shared_memory
+
+    shape = (len(image_paths), imgsz, imgsz, 3)
+    memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))))
+    images = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+    geometry = np.zeros((len(image_paths), 5), dtype=np.float64)
+    truths = []
+    with multiprocessing.Pool(num_workers) as pool:
+        for i, (padded, ratio, pad, size) in enumerate(pool.imap(_letterbox_file, [(p, imgsz) for p in image_paths],
+                                                                chunksize=8)):
+            images[i] = padded
+            geometry[i] = [ratio, pad[0], pad[1], size[0], size[1]]
+            truths.append(read_labels(image_paths[i], size[1], size[0]))
+    del images
+    return memory, geometry, truths
+
+
+def _letterbox_file(args):
+    from yolo_utils import to_rgb_array
+
+    path, imgsz = args
+    image = to_rgb_array(path)
+    padded, ratio, pad = letterbox(image, (imgsz, imgsz))
+    return padded, ratio, pad, image.shape[:2]
+
+
+def box_iou_matrix(boxes1, boxes2):
+    """Pairwise IoU of (N, 4) and (M, 4) xyxy boxes: (N, M)."""
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area1 = (boxes1[:, 2:] - boxes1[:, :2]).prod(axis=1)
+    area2 = (boxes2[:, 2:] - boxes2[:, :2]).prod(axis=1)
+    return intersection / (area1[:, None] + area2[None, :] - intersection + 1e-9)
+
+
+def match_predictions(pred_boxes, pred_classes, true_boxes, true_classes):
+    """
+    True-positive matrix (predictions, IoU thresholds), matching like ultralytics
+
+    At every threshold each ground-truth box is matched at most once, to the
+    same-class prediction overlapping it most.
+    """
+    correct = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if len(pred_boxes) == 0 or len(true_boxes) == 0:
+        return correct
+    iou = box_iou_matrix(true_boxes, pred_boxes) * (true_classes[:, None] == pred_classes[None, :])
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        pairs = np.argwhere(iou >= threshold)
+        if not len(pairs):
+            continue
+        pairs = pairs[iou[pairs[:, 0], pairs[:, 1]].argsort()[::-1]]
+        pairs = pairs[np.unique(pairs[:, 1], return_index=True)[1]]
+        pairs = pairs[np.unique(pairs[:, 0], return_index=True)[1]]
+        correct[pairs[:, 1], t] = True
+    return correct
+
+
+def average_precision(recall, precision):
+    """COCO 101-point interpolated AP of one precision/recall curve."""
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([1.0], precision, [0.0]))
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    points = np.linspace(0, 1, 101)
+    trapezoid = getattr(np, 'trapezoid', None) or np.trapz  # renamed in NumPy 2.0
+    return float(trapezoid(np.interp(points, recall, precision), points))
+
+
+def detection_metrics(correct, scores, pred_classes, true_classes):
+    """
+    mAP50, mAP50-95, precision and recall over a whole validation set
+
+    Precision and recall are taken at the confidence that maximizes the
+    class-averaged F1, as ultralytics reports them.
+    """
+    order = np.argsort(-scores)
+    correct, scores, pred_classes = correct[order], scores[order], pred_classes[order]
+    classes = np.unique(true_classes)
+    grid = np.linspace(0, 1, 1000)
+    ap = np.zeros((len(classes), len(IOU_THRESHOLDS)))
+    p_curve, r_curve = np.zeros((len(classes), len(grid))), np.zeros((len(classes), len(grid)))
+    for c_index, c in enumerate(classes):
+        selected = pred_classes == c
+        num_true = int((true_classes == c).sum())
+        if not selected.any():
+            continue
+        tp = correct[selected].cumsum(axis=0)
+        fp = (~correct[selected]).cumsum(axis=0)
+        recall = tp / (num_true + 1e-16)
+        precision = tp / (tp + fp)
+        # Curves at IoU 0.5 against a confidence grid (scores are descending, np.interp needs ascending x)
+        r_curve[c_index] = np.interp(-grid, -scores[selected], recall[:, 0], left=0)
+        p_curve[c_index] = np.interp(-grid, -scores[selected], precision[:, 0], left=1)
+        for t in range(len(IOU_THRESHOLDS)):
+            ap[c_index, t] = average_precision(recall[:, t], precision[:, t])
+
+    f1 = 2 * p_curve * r_curve / (p_curve + r_curve + 1e-16)
+    best = int(f1.mean(axis=0).argmax()) if len(classes) else 0
+    return {
+        'map50': float(ap[:, 0].mean()) if len(classes) else 0.0,
+        'map50_95': float(ap.mean()) if len(classes) else 0.0,
+        'precision': float(p_curve[:, best].mean()) if len(classes) else 0.0,
+        'recall': float(r_curve[:, best].mean()) if len(classes) else 0.0,
+    }
+
+
+_shared = {}
+
+
+def _init_worker(memory_name, shape, geometry, truths, slices, counter):
+    """Pin the worker to its own core slice and attach the shared validation images."""
+    from multiprocessing import shared_memory
+
+    import torch
+
+    with counter.get_lock():
+        cores = slices[counter.value % len(slices)]
+        counter.value += 1
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    # Attaching must not register the block with this process's resource tracker: the parent owns it
+    memory = shared_memory.SharedMemory(name=memory_name, track=False) if sys.version_info >= (3, 13) \
+        else shared_memory.SharedMemory(name=memory_name)
+    _shared.update(memory=memory, images=np.ndarray(shape, dtype=np.uint8, buffer=memory.buf),
+                   geometry=geometry, truths=truths)
+
+
+def evaluate_checkpoint(args):
+    """
+    Metrics and latency of one checkpoint on the shared validation images
+
+    Every image is run on its own (batch of 1), so the latency is what a
+    serving request pays for the forward pass and NMS.
+    """
+    import torch
+    from ultralytics import YOLO
+
+    path, conf, iou, warmup = args
+    checkpoint = YOLO(path)
+    model = checkpoint.model.float().fuse(verbose=False).eval()
+    images, geometry, truths = _shared['images'], _shared['geometry'], _shared['truths']
+
+    all_correct, all_scores, all_classes, latencies = [], [], [], []
+    with torch.no_grad():
+        for i in range(-min(warmup, len(images)), len(images)):
+            start = time.perf_counter()
+            batch = torch.from_numpy(images[max(i, 0)][None].transpose(0, 3, 1, 2).astype(np.float32) / 255.0)
+            output = model(batch)
+            output = output[0] if isinstance(output, (list, tuple)) else output
+            boxes, scores, classes = postprocess(output[0].numpy(), conf, iou)
+            elapsed = time.perf_counter() - start
+            if i < 0:
+                continue
+            latencies.append(elapsed * 1000)
+            ratio, pad_x, pad_y, height, width = geometry[i]
+            boxes = scale_boxes(boxes, ratio, (pad_x, pad_y), (height, width))
+            true_boxes, true_classes = truths[i]
+            all_correct.append(match_predictions(boxes, classes, true_boxes, true_classes))
+            all_scores.append(scores)
+            all_classes.append(classes)
+
+    metrics = detection_metrics(np.concatenate(all_correct), np.concatenate(all_scores),
+                                np.concatenate(all_classes), np.concatenate([t[1] for t in truths]))
+    name = os.path.basename(path)
+    stem = os.path.splitext(name)[0]
+    return dict(checkpoint=name, epoch=int(stem[5:]) if stem.startswith('epoch') and stem[5:].isdigit() else None,
+                latency_p50_ms=float(np.percentile(latencies, 50)), latency_p95_ms=float(np.percentile(latencies, 95)),
+                size_mb=os.path.getsize(path) / 1024 ** 2, **metrics)
+
+
+def evaluate_run(run_dir, data_yaml=None, split='val', imgsz=None, num_workers=None, conf=0.001, iou=0.7,
+                 warmup=2, checkpoints=None):
+    """
+    Evaluate every checkpoint of a training run in parallel
+
+    Args:
+        run_dir: runs/detect/<name> directory written by train_yolo.py
+        data_yaml: Dataset yaml (default: the one recorded in <run_dir>/args.yaml)
+        imgsz: Letterbox size (default: the training image size)
+        num_workers: Checkpoints evaluated at once (default: one per 4 usable cores)
+        conf, iou: Detection thresholds; the defaults match ultralytics' validation
+        checkpoints: Explicit .pt paths instead of <run_dir>/weights/*.pt
+
+    Returns:
+        list: one dict per checkpoint (see TABLE_COLUMNS)
+    """
+    import yaml
+
+    train_args = {}
+    if os.path.exists(os.path.join(run_dir, 'args.yaml')):
+        with open(os.path.join(run_dir, 'args.yaml'), 'r', encoding='utf-8') as f:
+            train_args = yaml.safe_load(f) or {}
+    data_yaml = data_yaml or train_args.get('data')
+    if not data_yaml:
+        raise ValueError(f'No dataset yaml given and none recorded in {run_dir}/args.yaml')
+    imgsz = imgsz or int(train_args.get('imgsz', 640))
+    checkpoints = checkpoints or list_checkpoints(run_dir)
+    if not checkpoints:
+        raise FileNotFoundError(f'No checkpoints under {run_dir}/weights')
+
+    image_paths, _ = resolve_val_images(data_yaml, split)
+    start = time.perf_counter()
+    memory, geometry, truths = prepare_images(image_paths, imgsz)
+    print(f"Letterboxed {len(image_paths)} {split} images to {imgsz}px in shared memory "
+          f"({memory.size / 1024 ** 2:.0f} MB, {time.perf_counter() - start:.1f}s)", file=sys.stderr)
+
+    cores = core_slices(1)[0]
+    num_workers = min(len(checkpoints), num_workers or max(1, len(cores) // 4))
+    slices = core_slices(num_workers, cores)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    try:
+        results = []
+        # Each worker claims the next core slice; checkpoints go to whichever worker is free
+        with context.Pool(num_workers, initializer=_init_worker,
+                          initargs=(memory.name, (len(image_paths), imgsz, imgsz, 3), geometry, truths,
+                                    slices, context.Value('i', 0))) as pool:
+            jobs = [(path, conf, iou, warmup) for path in checkpoints]
+            for result in pool.imap_unordered(evaluate_checkpoint, jobs):
+                print(f"Evaluated {result['checkpoint']}: mAP50-95 {result['map50_95']:.4f}", file=sys.stderr)
+                results.append(result)
+    finally:
+        memory.close()
+        memory.unlink()
+    order = {os.path.basename(path): i for i, path in enumerate(checkpoints)}
+    return sorted(results, key=lambda r: order[r['checkpoint']])
+
+
+def write_table(results, output_path):
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+    return output_path
+
+
+def format_table(results):
+    header = f"{'checkpoint':<14}{'mAP50':>8}{'mAP50-95':>10}{'P':>8}{'R':>8}{'p50 ms':>9}{'p95 ms':>9}{'MB':>7}"
+    rows = [f"{r['checkpoint']:<14}{r['map50']:>8.4f}{r['map50_95']:>10.4f}{r['precision']:>8.4f}"
+            f"{r['recall']:>8.4f}{r['latency_p50_ms']:>9.1f}{r['latency_p95_ms']:>9.1f}{r['size_mb']:>7.1f}"
+            for r in results]
+    return '\n'.join([header] + rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Evaluate all checkpoints of a YOLOv8 run in parallel')
+    parser.add_argument('run_dir', type=str, nargs='?', default='./runs/detect/bone_fracture_yolov8m',
+                        help='Training run directory (with weights/*.pt)')
+    parser.add_argument('--data', type=str, help='Dataset yaml (default: the one used for training)')
+    parser.add_argument('--split', type=str, default='val', help='Dataset split to evaluate on')
+    parser.add_argument('--imgsz', type=int, help='Inference size (default: the training size)')
+    parser.add_argument('--workers', type=int, help='Checkpoints evaluated in parallel')
+    parser.add_argument('--conf', type=float, default=0.001, help='Confidence threshold for mAP')
+    parser.add_argument('--iou', type=float, default=0.7, help='NMS IoU threshold')
+    parser.add_argument('--output', type=str, help='CSV table (default: <run_dir>/checkpoint_eval.csv)')
+
+    args = parser.parse_args()
+
+    results = evaluate_run(args.run_dir, args.data, args.split, args.imgsz, args.workers, args.conf, args.iou)
+    output_path = write_table(results, args.output or os.path.join(args.run_dir, 'checkpoint_eval.csv'))
+    print(format_table(results))
+    best = max(results, key=lambda r: r['map50_95'])
+    print(f"Best mAP50-95: {best['checkpoint']} ({best['map50_95']:.4f}, {best['latency_p50_ms']:.1f} ms/image)")
+    print(f"Table written to {output_path}", file=sys.stderr)
@@ -0,0 +1,146 @@
+"""
+Export the ResNet-50 fracture classifier for optimized CPU inference
+Writes ONNX and/or frozen TorchScript graphs next to the .pth checkpoint,
+checks that their outputs match the eager model and benchmarks every backend
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+from predict_api import load_model
+from inference_backends import ARTIFACT_EXTENSIONS, load_backend
+
+
+def export_onnx(model, output_path, opset_version=17):
+    """Export with a dynamic batch axis so the server can micro-batch."""
+    dummy = torch.randn(1, 3, 224, 224)
+    kwargs = dict(
+        input_names=['input'],
+        output_names=['logits'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=opset_version,
+    )
+    try:
+        # Newer PyTorch defaults to the dynamo exporter, which needs onnxscript
+        torch.onnx.export(model, dummy, output_path, dynamo=False, **kwargs)
+    except TypeError:
+        torch.onnx.export(model, dummy, output_path, **kwargs)
+    return output_path
+
+
+def export_torchscript(model, output_path):
+    """Trace and freeze the model (weights folded into the graph as constants)."""
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn(1, 3, 224, 224))
+        frozen = torch.jit.freeze(traced)
+    frozen.save(output_path)
+    return output_path
+
+
+def check_outputs(reference, candidate, batch_size=4, atol=1e-3, seed=0):
+    """
+    Compare softmax probabilities of two backends on the same random batch
+
+    Returns:
+        float: maximum absolute difference between the probability tensors
+    """
+    generator = torch.Generator().manual_seed(seed)
+    batch = torch.randn(batch_size, 3, 224, 224, generator=generator)
+    with torch.no_grad():
+        expected = torch.softmax(reference(batch), dim=1)
+        actual = torch.softmax(candidate(batch).float().cpu(), dim=1)
+    max_diff = float((expected - actual).abs().max())
+    if max_diff > atol:
+        raise AssertionError(f'outputs differ by {max_diff:.2e} (tolerance {atol:.0e})')
+    return max_diff
+
+
+def benchmark(model, batch_size=1, iterations=20, warmup=3):
+    """Median and p95 latency (ms) of a forward pass at `batch_size`."""
+    batch = torch.randn(batch_size, 3, 224, 224)
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(batch)
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            model(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'batch_size': batch_size,
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'images_per_sec': batch_size * 1000 / float(np.percentile(timings, 50)),
+    }
+
+
+def export_model(model_path, formats=('onnx', 'torchscript'), atol=1e-3, run_benchmark=False,
+                 batch_sizes=(1, 8), num_threads=None):
+    """
+    Export, verify and optionally benchmark the classifier
+
+    Returns:
+        dict: exported paths, max output difference per backend and benchmark numbers
+    """
+    device = torch.device('cpu')
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    model = load_model(model_path, device)
+
+    report = {'model': model_path, 'exports': {}, 'max_abs_diff': {}, 'benchmark': {}}
+    for fmt in formats:
+        path = os.path.splitext(model_path)[0] + ARTIFACT_EXTENSIONS[fmt]
+        print(f"Exporting {fmt} to {path}...", file=sys.stderr)
+        if fmt == 'onnx':
+            export_onnx(model, path)
+        else:
+            export_torchscript(model, path)
+        report['exports'][fmt] = path
+        backend = load_backend(fmt, path, device, num_threads)
+        report['max_abs_diff'][fmt] = check_outputs(model, backend, atol=atol)
+        print(f"✅ {fmt} matches eager model (max diff {report['max_abs_diff'][fmt]:.2e})", file=sys.stderr)
+
+    if run_benchmark:
+        backends = {'torch': model}
+        backends.update({fmt: load_backend(fmt, path, device, num_threads)
+                         for fmt, path in report['exports'].items()})
+        for name, backend in backends.items():
+            report['benchmark'][name] = [benchmark(backend, bs) for bs in batch_sizes]
+        for bs_index, bs in enumerate(batch_sizes):
+            eager = report['benchmark']['torch'][bs_index]['p50_ms']
+            for name in backends:
+                result = report['benchmark'][name][bs_index]
+                result['speedup_vs_torch'] = eager / result['p50_ms']
+                print(f"batch {bs:>3} {name:<12} p50 {result['p50_ms']:8.2f} ms "
+                      f"({result['speedup_vs_torch']:.2f}x)", file=sys.stderr)
+
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export the fracture classifier to ONNX / TorchScript')
+    parser.add_argument('--model', type=str, default='./pretrained_models/bone_fracture_model.pth',
+                        help='Path to the trained model')
+    parser.add_argument('--format', type=str, nargs='+', default=['onnx', 'torchscript'],
+                        choices=['onnx', 'torchscript'], help='Formats to export')
+    parser.add_argument('--atol', type=float, default=1e-3,
+                        help='Allowed max absolute difference in probabilities vs. the eager model')
+    parser.add_argument('--benchmark', action='store_true', help='Time every backend after exporting')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8], help='Batch sizes to benchmark')
+    parser.add_argument('--threads', type=int, help='Intra-op threads for all backends')
+
+    args = parser.parse_args()
+
+    try:
+        report = export_model(args.model, args.format, args.atol, args.benchmark, args.batch_sizes, args.threads)
+    except AssertionError as e:
+        print(f"❌ Exported model does not match: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(report, indent=2))
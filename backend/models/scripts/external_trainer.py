@@ -1,23 +1,57 @@
 import os
+import sys
+import time
+import contextlib
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import models, transforms, datasets
-from torch.utils.data import DataLoader, Subset
-import random
-from PIL import ImageFile
-ImageFile.LOAD_TRUNCATED_IMAGES = True
+from torchvision import models, transforms
+from torch.utils.data import DataLoader, Dataset, Subset
 
+from checkpoint_io import CHECKPOINT_EXTENSION, load_weights, save_weights
+from dataset_index import load_manifest, split_samples
+from image_io import load_image
 
-def train_model(data_dir, model_save_path="./pretrained_models/bone_fracture_model.pth", 
-                epochs=5, batch_size=32, simulate=False):
+
+class ManifestDataset(Dataset):
     """
-    If simulate=True, then training will use a lighter model (ResNet-18), only run 1 epoch,
-    and use a small subset of the data.
+    ImageFolder-compatible dataset over the (path, label) pairs of one manifest split
+
+    Images are decoded by image_io like at inference time (16-bit radiographs
+    are windowed, not clipped), straight to `image_size` when it is given.
     """
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Using device: {device}")
 
+    def __init__(self, samples, classes, transform=None, image_size=None):
+        self.samples = samples
+        self.targets = [label for _, label in samples]
+        self.classes = classes
+        self.transform = transform
+        self.image_size = image_size
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        path, label = self.samples[index]
+        image = load_image(path, size=self.image_size)
+        return (self.transform(image) if self.transform is not None else image), label
+
+
+def build_datasets(data_dir, simulate=False, tensor_cache_dir=None, manifest_path=None):
+    """
+    Build the train/val/test datasets used by train_model
+
+    The splits come from the dataset manifest (see dataset_index.py), built on
+    the first run and reused while the tree is unchanged: data_dir/{train,val,test}
+    when present, otherwise a deterministic, stratified 70/15/15 split. Corrupt
+    and duplicate images are left out. In simulate mode every split is cut down to
+    a handful of images. With `tensor_cache_dir`, images are decoded and
+    resized once into a memory-mapped cache (see tensor_cache.py) and only the
+    random augmentations and normalization run per epoch.
+
+    Returns:
+        tuple: (train_dataset, val_dataset, test_dataset, class_names)
+    """
     # Define transforms
     train_transform = transforms.Compose([
         transforms.Resize((224, 224)),
@@ -33,106 +67,248 @@ def train_model(data_dir, model_save_path="./pretrained_models/bone_fracture_mod
     ])
     test_transform = val_transform
 
-    train_folder = os.path.join(data_dir, 'train')
-    if os.path.isdir(train_folder):
-        print("Using pre-split dataset directories.")
-        train_dataset = datasets.ImageFolder(root=train_folder, transform=train_transform)
-        val_dataset = datasets.ImageFolder(root=os.path.join(data_dir, 'val'), transform=val_transform)
-        test_dataset = datasets.ImageFolder(root=os.path.join(data_dir, 'test'), transform=test_transform)
-    else:
-        print("No pre-split directories found. Performing automatic split on the full dataset.")
-        full_dataset = datasets.ImageFolder(root=data_dir, transform=train_transform)
-        num_samples = len(full_dataset)
-        indices = list(range(num_samples))
-        random.shuffle(indices)
-        train_size = int(0.7 * num_samples)
-        val_size = int(0.15 * num_samples)
-        test_size = num_samples - train_size - val_size
-        train_dataset = Subset(full_dataset, indices[:train_size])
-        val_dataset = Subset(full_dataset, indices[train_size:train_size + val_size])
-        test_dataset = Subset(full_dataset, indices[train_size + val_size:])
+    manifest = load_manifest(data_dir, manifest_path)
+    class_names = manifest['classes']
+    print(f"Dataset manifest: {manifest['counts']}, {len(manifest['rejected'])} images skipped.", file=sys.stderr)
+
+    def split_dataset(split, transform):
+        samples = split_samples(manifest, split)
+        if tensor_cache_dir:
+            from tensor_cache import cached_image_folder
+            return cached_image_folder(data_dir, os.path.join(tensor_cache_dir, split),
+                                       train=transform is train_transform, samples=samples, classes=class_names)
+        return ManifestDataset(samples, class_names, transform, image_size=(224, 224))
+
+    train_dataset = split_dataset('train', train_transform)
+    val_dataset = split_dataset('val', val_transform)
+    test_dataset = split_dataset('test', test_transform)
 
     if simulate:
-        print("Simulation mode enabled: reducing dataset size and epochs for faster testing.")
+        print("Simulation mode enabled: reducing dataset size and epochs for faster testing.", file=sys.stderr)
         train_dataset = Subset(train_dataset, list(range(min(10, len(train_dataset)))))
         val_dataset = Subset(val_dataset, list(range(min(5, len(val_dataset)))))
         test_dataset = Subset(test_dataset, list(range(min(5, len(test_dataset)))))
+
+    return train_dataset, val_dataset, test_dataset, class_names
+
+
+def sample_paths(dataset):
+    """Source image path of every sample of an ImageFolder or tensor cache dataset, through any Subsets."""
+    if isinstance(dataset, Subset):
+        paths = sample_paths(dataset.dataset)
+        return [paths[i] for i in dataset.indices]
+    if hasattr(dataset, 'samples'):
+        return [path for path, _ in dataset.samples]
+    return list(dataset.paths)
+
+
+def sample_targets(dataset):
+    """Class index of every sample of an ImageFolder-style or tensor cache dataset, through any Subsets."""
+    if isinstance(dataset, Subset):
+        targets = sample_targets(dataset.dataset)
+        return [targets[i] for i in dataset.indices]
+    return list(dataset.targets)
+
+
+def autocast(device, dtype):
+    """Autocast context for mixed precision, or a no-op when `dtype` is None."""
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+
+def resolve_amp_dtype(device, amp):
+    """
+    Mixed-precision dtype for `device`: bf16 on CPU and on GPUs that support
+    it, fp16 on older GPUs, None when AMP is off.
+    """
+    if not amp:
+        return None
+    if device.type == 'cuda':
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    return torch.bfloat16
+
+
+def evaluate_accuracy(model, loader, device, autocast_dtype=None):
+    """Top-1 accuracy (%) of `model` over `loader`, as reported for the test split."""
+    model.eval()
+    test_correct = torch.zeros((), dtype=torch.long, device=device)
+    test_total = 0
+    with torch.no_grad(), autocast(device, autocast_dtype):
+        for images, labels in loader:
+            images, labels = images.to(device, non_blocking=True), labels.to(device, non_blocking=True)
+            outputs = model(images)
+            _, predicted = torch.max(outputs, 1)
+            test_total += labels.size(0)
+            test_correct += (predicted == labels).sum()
+    return 100 * test_correct.item() / test_total
+
+
+def make_loader(dataset, batch_size, shuffle, device, num_workers=0, prefetch_factor=2,
+                persistent_workers=False, sampler=None):
+    """DataLoader with worker, prefetching and pinned-memory settings applied consistently."""
+    kwargs = {}
+    if num_workers > 0:
+        kwargs.update(prefetch_factor=prefetch_factor, persistent_workers=persistent_workers)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle if sampler is None else False,
+                      sampler=sampler, num_workers=num_workers, pin_memory=device.type == 'cuda', **kwargs)
+
+
+def train_one_epoch(model, loader, criterion, optimizer, device, autocast_dtype=None, scaler=None):
+    """
+    One pass over `loader`; loss and accuracy are accumulated on-device and
+    synchronized once at the end of the epoch.
+
+    Returns:
+        tuple: (summed batch losses, correct predictions, samples) as tensors/ints
+    """
+    model.train()
+    running_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+    for images, labels in loader:
+        images, labels = images.to(device, non_blocking=True), labels.to(device, non_blocking=True)
+        optimizer.zero_grad(set_to_none=True)
+        with autocast(device, autocast_dtype):
+            outputs = model(images)
+            loss = criterion(outputs, labels)
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
+        running_loss += loss.detach().float()
+        _, predicted = torch.max(outputs.detach(), 1)
+        total += labels.size(0)
+        correct += (predicted == labels).sum()
+    return running_loss, correct, total
+
+
+def validate(model, loader, criterion, device, autocast_dtype=None):
+    """
+    Validation pass with on-device accumulation
+
+    Returns:
+        tuple: (summed batch losses, correct predictions, samples) as tensors/ints
+    """
+    model.eval()
+    val_loss = torch.zeros((), device=device)
+    val_correct = torch.zeros((), dtype=torch.long, device=device)
+    val_total = 0
+    with torch.no_grad(), autocast(device, autocast_dtype):
+        for images, labels in loader:
+            images, labels = images.to(device, non_blocking=True), labels.to(device, non_blocking=True)
+            outputs = model(images)
+            val_loss += criterion(outputs, labels).float()
+            _, predicted = torch.max(outputs, 1)
+            val_total += labels.size(0)
+            val_correct += (predicted == labels).sum()
+    return val_loss, val_correct, val_total
+
+
+def checkpoint_metadata(arch, class_names, **metrics):
+    """Header stored with memory-mapped (.safetensors) checkpoints."""
+    return {
+        'architecture': arch,
+        'class_names': list(class_names),
+        'input_size': [224, 224],
+        'normalization': {'mean': [0.485, 0.456, 0.406], 'std': [0.229, 0.224, 0.225]},
+        'metrics': metrics,
+    }
+
+
+def train_model(data_dir, model_save_path="./pretrained_models/bone_fracture_model.pth", 
+                epochs=5, batch_size=32, simulate=False, tensor_cache_dir=None,
+                num_workers=0, prefetch_factor=2, persistent_workers=False, amp=False, compile_model=False,
+                arch=None, manifest_path=None):
+    """
+    If simulate=True, then training will use a lighter model (ResNet-18), only run 1 epoch,
+    and use a small subset of the data.
+    If tensor_cache_dir is set, the dataset is decoded and resized once into a memory-mapped
+    cache there (rebuilt automatically when the source folder changes).
+    num_workers/prefetch_factor/persistent_workers configure the DataLoaders, amp enables
+    mixed precision (bf16 on CPU) and compile_model runs the network through torch.compile.
+    arch picks the torchvision ResNet to fine-tune (default: resnet50, resnet18 when
+    simulating); a fully trained resnet18 is the screener used by cascade.py.
+    manifest_path overrides where the dataset manifest is read and written (see
+    dataset_index.manifest_path for the default).
+    A model_save_path ending in .safetensors writes the memory-mapped checkpoint format
+    (checkpoint_io) with the architecture, class names and metrics in its header.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+
+    train_dataset, val_dataset, test_dataset, class_names = build_datasets(data_dir, simulate, tensor_cache_dir,
+                                                                           manifest_path)
+    if simulate:
         epochs = 1
 
-    class_names = datasets.ImageFolder(root=train_folder if os.path.isdir(train_folder) else data_dir).classes
     print(f"Class names: {class_names}")
     print(f"Training samples: {len(train_dataset)}")
     print(f"Validation samples: {len(val_dataset)}")
     print(f"Test samples: {len(test_dataset)}")
 
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
+    loader_args = dict(num_workers=num_workers, prefetch_factor=prefetch_factor,
+                       persistent_workers=persistent_workers)
+    train_loader = make_loader(train_dataset, batch_size, True, device, **loader_args)
+    val_loader = make_loader(val_dataset, batch_size, False, device, **loader_args)
     
-    model = models.resnet50(pretrained=True) if not simulate else models.resnet18(pretrained=True)
-    print("Using ResNet-50 for full training." if not simulate else "Using ResNet-18 for simulation.")
+    arch = arch or ('resnet18' if simulate else 'resnet50')
+    model = getattr(models, arch)(pretrained=True)
+    print(f"Using {arch} ({'simulation' if simulate else 'full training'}).")
     model.fc = nn.Linear(model.fc.in_features, 2)
     model = model.to(device)
+    # The compiled wrapper shares parameters with `model`, which is what gets saved
+    train_net = torch.compile(model) if compile_model else model
 
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(model.parameters(), lr=0.0001)
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=2, factor=0.5)
 
+    autocast_dtype = resolve_amp_dtype(device, amp)
+    scaler = torch.amp.GradScaler('cuda') if autocast_dtype == torch.float16 else None
+    if autocast_dtype is not None:
+        print(f"Mixed precision enabled ({autocast_dtype}).")
+
     print("Starting Training...")
     best_val_loss = float('inf')
+    best_metrics = {}
     for epoch in range(epochs):
-        model.train()
-        running_loss, correct, total = 0.0, 0, 0
-        for images, labels in train_loader:
-            images, labels = images.to(device), labels.to(device)
-            optimizer.zero_grad()
-            outputs = model(images)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-            running_loss += loss.item()
-            _, predicted = torch.max(outputs, 1)
-            total += labels.size(0)
-            correct += (predicted == labels).sum().item()
-        train_loss, train_acc = running_loss / len(train_loader), 100 * correct / total
-
-        model.eval()
-        val_loss, val_correct, val_total = 0.0, 0, 0
-        with torch.no_grad():
-            for images, labels in val_loader:
-                images, labels = images.to(device), labels.to(device)
-                outputs = model(images)
-                loss = criterion(outputs, labels)
-                val_loss += loss.item()
-                _, predicted = torch.max(outputs, 1)
-                val_total += labels.size(0)
-                val_correct += (predicted == labels).sum().item()
-        val_loss /= len(val_loader)
-        val_acc = 100 * val_correct / val_total
+        start = time.perf_counter()
+        running_loss, correct, total = train_one_epoch(train_net, train_loader, criterion, optimizer,
+                                                       device, autocast_dtype, scaler)
+        # Single host sync per epoch for the training metrics
+        train_loss, train_acc = running_loss.item() / len(train_loader), 100 * correct.item() / total
+        samples_per_sec = total / (time.perf_counter() - start)
+
+        val_loss, val_correct, val_total = validate(train_net, val_loader, criterion, device, autocast_dtype)
+        val_loss = val_loss.item() / len(val_loader)
+        val_acc = 100 * val_correct.item() / val_total
 
         scheduler.step(val_loss)
         print(f"Epoch {epoch+1}/{epochs}: Train Loss={train_loss:.4f}, Train Acc={train_acc:.2f}%, "
-              f"Val Loss={val_loss:.4f}, Val Acc={val_acc:.2f}%")
+              f"Val Loss={val_loss:.4f}, Val Acc={val_acc:.2f}%, {samples_per_sec:.1f} samples/sec")
         
         if val_loss < best_val_loss:
             best_val_loss = val_loss
+            best_metrics = dict(epoch=epoch + 1, train_acc=train_acc, val_loss=val_loss, val_acc=val_acc)
             os.makedirs(os.path.dirname(model_save_path), exist_ok=True)
-            torch.save(model.state_dict(), model_save_path)
+            save_weights(model.state_dict(), model_save_path,
+                         checkpoint_metadata(arch, class_names, **best_metrics))
             print(f"Model saved at epoch {epoch+1} with val loss {val_loss:.4f}")
 
     print("Model Training Completed!")
 
-    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
-    model.load_state_dict(torch.load(model_save_path))
-    model.eval()
-    test_correct, test_total = 0, 0
-    with torch.no_grad():
-        for images, labels in test_loader:
-            images, labels = images.to(device), labels.to(device)
-            outputs = model(images)
-            _, predicted = torch.max(outputs, 1)
-            test_total += labels.size(0)
-            test_correct += (predicted == labels).sum().item()
-    test_acc = 100 * test_correct / test_total
+    test_loader = make_loader(test_dataset, batch_size, False, device, num_workers=num_workers,
+                              prefetch_factor=prefetch_factor)
+    model.load_state_dict(load_weights(model_save_path, map_location=device)[0])
+    test_acc = evaluate_accuracy(model, test_loader, device)
     print(f"Test Accuracy: {test_acc:.2f}%")
+    if model_save_path.endswith(CHECKPOINT_EXTENSION):
+        # Record the test accuracy alongside the best epoch's metrics
+        save_weights(model.state_dict(), model_save_path,
+                     checkpoint_metadata(arch, class_names, test_acc=test_acc, **best_metrics))
 
     return model, test_acc
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+Memory-bounded image decoding for the prediction paths
+Accepts file paths, raw bytes or binary streams, so uploads are decoded
+straight from memory. When only a small image is needed, JPEGs are decoded at
+a reduced DCT scale and other formats are shrunk right after decoding; 16-bit
+grayscale radiographs stay single-channel until they are windowed to 8 bits,
+so the full-size RGB copy is never built
+"""
+
+import io
+import os
+
+# Modes with more than 8 bits per pixel (16-bit PNG/TIFF radiographs, DICOM exports)
+HIGH_BIT_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I', 'F')
+# Modes whose resize gives the same pixels as converting to RGB first
+RESIZE_BEFORE_CONVERT = ('L', 'RGB') + HIGH_BIT_MODES
+
+
+def open_image(source):
+    """
+    Path, bytes, binary stream or PIL image -> PIL image
+
+    Only the header is read here; pixels are decoded on first access.
+    """
+    from PIL import Image
+
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif hasattr(source, 'read') and not (hasattr(source, 'seekable') and source.seekable()):
+        # PIL seeks while identifying the format
+        source = io.BytesIO(source.read())
+    elif isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    return Image.open(source)
+
+
+def target_size(original_size, size=None, max_side=None):
+    """Output (width, height): `size` exactly, else fit in `max_side` keeping the aspect ratio."""
+    if size is not None:
+        return tuple(size)
+    width, height = original_size
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return None
+
+
+def to_8bit(image, extrema=None):
+    """
+    Window a 16/32-bit grayscale image to 8-bit 'L' by its pixel range
+
+    Args:
+        extrema: (min, max) to scale by; defaults to the image's own, pass the
+            full-size image's when `image` has already been downscaled
+    """
+    import numpy as np
+    from PIL import Image
+
+    low, high = extrema or image.getextrema()
+    pixels = np.asarray(image).astype(np.float32)
+    pixels -= low
+    pixels *= 255.0 / (high - low) if high > low else 0.0
+    np.rint(pixels, out=pixels)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def decode_image(source, size=None, max_side=None):
+    """
+    Decode an image to RGB, downscaling as early as the format allows
+
+    Args:
+        source: Path, encoded bytes, binary stream or PIL image
+        size: Exact (width, height) to resize to, e.g. the classifier's 224x224
+            (bilinear, the same pixels as torchvision's Resize on the full image)
+        max_side: Otherwise, shrink so the longer side is at most this many pixels
+
+    Returns:
+        tuple: (RGB PIL image, (width, height) of the original image)
+    """
+    from PIL import Image
+
+    image = open_image(source)
+    original_size = image.size
+    output_size = target_size(original_size, size, max_side)
+
+    if output_size is not None:
+        # JPEG only: decode at 1/2, 1/4 or 1/8 scale, never below output_size
+        image.draft(None, output_size)
+
+    extrema = image.getextrema() if image.mode in HIGH_BIT_MODES else None
+    if image.mode not in RESIZE_BEFORE_CONVERT:
+        # Palette, alpha and CMYK images are converted first, as before
+        image = image.convert('RGB')
+    if output_size is not None and image.size != output_size:
+        image = image.resize(output_size, Image.BILINEAR)
+    if extrema is not None:
+        image = to_8bit(image, extrema)
+    return image.convert('RGB'), original_size
+
+
+def load_image(source, size=None, max_side=None):
+    """decode_image without the original size."""
+    return decode_image(source, size, max_side)[0]
@@ -0,0 +1,107 @@
+"""
+Alternative CPU inference backends for the fracture classifier
+Runs graphs produced by export_model.py (or the INT8 model written by
+quantize_model.py) through TorchScript or ONNX Runtime.
+Every backend is a callable taking a (N, 3, 224, 224) float tensor and
+returning (N, 2) logits, so it drops in wherever the eager model is used
+"""
+
+import os
+
+from checkpoint_io import CHECKPOINT_EXTENSION
+
+BACKENDS = ('torch', 'torchscript', 'onnx', 'quantized')
+ARTIFACT_EXTENSIONS = {'torchscript': '.ts', 'onnx': '.onnx', 'quantized': '.int8.ts'}
+# Checkpoints the exports are written next to by export_model.py / quantize_model.py
+WEIGHTS_EXTENSIONS = ('.pth', '.pt', CHECKPOINT_EXTENSION)
+
+
+def artifact_path(model_path, backend):
+    """
+    Path of the exported graph for `backend`
+
+    A checkpoint path (.pth, .pt or .safetensors) is mapped to its sibling
+    export (bone_fracture_model.pth -> bone_fracture_model.onnx), any other
+    path is assumed to already point at the exported file.
+    """
+    root, ext = os.path.splitext(model_path)
+    if ext in WEIGHTS_EXTENSIONS and backend in ARTIFACT_EXTENSIONS:
+        return root + ARTIFACT_EXTENSIONS[backend]
+    return model_path
+
+
+class TorchScriptBackend:
+    """Frozen TorchScript module, optimized for inference at load time."""
+
+    def __init__(self, path, device, num_threads=None):
+        import torch
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.device = device
+        module = torch.jit.load(path, map_location=device)
+        module.eval()
+        self.module = torch.jit.optimize_for_inference(module) if device.type == 'cpu' else module
+
+    def __call__(self, batch):
+        import torch
+
+        with torch.no_grad():
+            return self.module(batch.to(self.device))
+
+
+class OnnxBackend:
+    """ONNX Runtime session with all graph optimizations and tuned thread pools."""
+
+    def __init__(self, path, device, num_threads=None, inter_op_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Inter-op threads only run independent graph branches in parallel mode
+        parallel = inter_op_threads is not None and inter_op_threads > 1
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if parallel else ort.ExecutionMode.ORT_SEQUENTIAL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda' and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        import torch
+
+        inputs = batch.detach().cpu().numpy()
+        return torch.from_numpy(self.session.run(None, {self.input_name: inputs})[0])
+
+
+def load_backend(backend, model_path, device, num_threads=None, inter_op_threads=None):
+    """
+    Load the exported classifier for a non-eager backend
+
+    Args:
+        backend: 'torchscript', 'onnx' or 'quantized'
+        model_path: Exported graph, or the .pth it was exported from
+        device: torch.device to run on
+        num_threads: Intra-op threads (None keeps the library default)
+        inter_op_threads: Inter-op threads for ONNX Runtime
+    """
+    path = artifact_path(model_path, backend)
+    if not os.path.exists(path):
+        tool = 'quantize_model.py' if backend == 'quantized' else 'export_model.py'
+        raise FileNotFoundError(f'{backend} model not found at {path}; run {tool} first')
+    if backend == 'torchscript':
+        return TorchScriptBackend(path, device, num_threads)
+    if backend == 'quantized':
+        import torch
+
+        # INT8 kernels are CPU-only
+        return TorchScriptBackend(path, torch.device('cpu'), num_threads)
+    if backend == 'onnx':
+        return OnnxBackend(path, device, num_threads, inter_op_threads)
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
@@ -0,0 +1,208 @@
+"""
+Per-stage latency instrumentation for the prediction entry points
+Records stage timings (decode, preprocess, model load, forward, plotting...),
+image sizes, batch sizes and errors into Prometheus-style counters and
+histograms. Disabled by default: start_trace then hands out a shared no-op
+trace, so instrumented code only pays for a few empty method calls
+"""
+
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MEGAPIXEL_BUCKETS = (0.05, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# name -> (type, help text, histogram buckets)
+METRICS = {
+    'requests_total': ('counter', 'Prediction requests by endpoint and outcome', None),
+    'errors_total': ('counter', 'Failed predictions by endpoint and exception type', None),
+    'request_seconds': ('histogram', 'End-to-end prediction latency', LATENCY_BUCKETS),
+    'stage_seconds': ('histogram', 'Prediction latency per stage', LATENCY_BUCKETS),
+    'image_megapixels': ('histogram', 'Size of the decoded input images', MEGAPIXEL_BUCKETS),
+    'batch_size': ('histogram', 'Images per forward pass', BATCH_SIZE_BUCKETS),
+}
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store for the counters and histograms in METRICS
+
+    Args:
+        prefix: Prepended to every metric name in the exposition output
+    """
+
+    def __init__(self, prefix='meditrack_'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # name -> {sorted label items: value} for counters,
+        #         {sorted label items: [bucket counts..., sum, count]} for histograms
+        self._series = {name: {} for name in METRICS}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in METRICS.items():
+                full_name = self.prefix + name
+                lines.append(f'# HELP {full_name} {help_text}')
+                lines.append(f'# TYPE {full_name} {kind}')
+                for labels, state in sorted(self._series[name].items()):
+                    if kind == 'counter':
+                        lines.append(f'{full_name}{_format_labels(labels)} {state}')
+                        continue
+                    for bound, count in zip(buckets, state):
+                        lines.append(f'{full_name}_bucket{_format_labels(labels, le=bound)} {count}')
+                    lines.append(f'{full_name}_bucket{_format_labels(labels, le="+Inf")} {state[-1]}')
+                    lines.append(f'{full_name}_sum{_format_labels(labels)} {state[-2]}')
+                    lines.append(f'{full_name}_count{_format_labels(labels)} {state[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """
+    Stage timer for one prediction
+
+    Args:
+        endpoint: Label identifying the entry point (e.g. 'predict_fracture_json')
+        registry: MetricsRegistry to record into on finish (None only collects timings)
+    """
+
+    def __init__(self, endpoint, registry=None):
+        self.endpoint = endpoint
+        self.registry = registry
+        self.stages = {}
+        self.megapixels = None
+        self.total = None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        """Record a stage measured elsewhere (e.g. ultralytics' own speed dict)."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def image(self, size):
+        """Record the (width, height) of the decoded input image."""
+        self.megapixels = size[0] * size[1] / 1e6
+
+    def finish(self, error=None, outcome=None):
+        """Stop the clock and record the prediction into the registry."""
+        self.total = time.perf_counter() - self._start
+        if self.registry is None:
+            return
+        endpoint = self.endpoint
+        if error is not None:
+            outcome = 'error'
+            self.registry.inc('errors_total', endpoint=endpoint, type=type(error).__name__)
+        self.registry.inc('requests_total', endpoint=endpoint, outcome=outcome or 'ok')
+        self.registry.observe('request_seconds', self.total, endpoint=endpoint)
+        for name, seconds in self.stages.items():
+            self.registry.observe('stage_seconds', seconds, endpoint=endpoint, stage=name)
+        if self.megapixels is not None:
+            self.registry.observe('image_megapixels', self.megapixels, endpoint=endpoint)
+
+    def timings(self):
+        """Stage durations in milliseconds, for the optional `timings` response block."""
+        timings = {f'{name}_ms': seconds * 1000 for name, seconds in self.stages.items()}
+        total = self.total if self.total is not None else time.perf_counter() - self._start
+        timings['total_ms'] = total * 1000
+        return timings
+
+
+class _NullTrace:
+    """Trace stand-in used while instrumentation is disabled."""
+
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def add_stage(self, name, seconds):
+        pass
+
+    def image(self, size):
+        pass
+
+    def finish(self, error=None, outcome=None):
+        pass
+
+    def timings(self):
+        return {}
+
+
+NULL_TRACE = _NullTrace()
+_registry = None
+
+
+def enable(registry=None):
+    """Start recording metrics process-wide; returns the active registry."""
+    global _registry
+    _registry = registry or _registry or MetricsRegistry()
+    return _registry
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def get_registry():
+    return _registry
+
+
+def start_trace(endpoint, force=False):
+    """
+    Trace for one prediction
+
+    Returns NULL_TRACE when instrumentation is disabled, unless `force` is set
+    (used when the caller asked for a `timings` block in the response).
+    """
+    if _registry is None and not force:
+        return NULL_TRACE
+    return Trace(endpoint, _registry)
+
+
+def observe(name, value, **labels):
+    """Record a histogram sample directly (no-op while disabled)."""
+    if _registry is not None:
+        _registry.observe(name, value, **labels)
+
+
+def attach_timings(result, trace):
+    """Copy of `result` with the trace's stage timings under 'timings'."""
+    return dict(result, timings=trace.timings())
@@ -0,0 +1,301 @@
+"""
+Asynchronous prediction jobs
+An upload is queued and answered with a job ID straight away. A bounded pool
+of worker threads runs the jobs, and clients either poll the job or get it
+POSTed to a callback URL when it finishes. The queue is bounded (submit raises
+QueueFull), every job has a timeout, and with a SQLite file the queued jobs
+survive a restart. Callbacks only go to allowed hosts, or to public addresses
+"""
+
+import ipaddress
+import json
+import queue
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+FINISHED_STATES = ('done', 'failed', 'timeout')
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when the queue already holds `max_queued` jobs."""
+
+
+def check_callback_url(url, allowed_hosts=None):
+    """
+    Refuse callback URLs the server must not POST results (patient data) to
+
+    With `allowed_hosts`, only those host names are accepted. Without, the host
+    is resolved and every address it resolves to must be public: loopback,
+    private, link-local (cloud metadata endpoints), multicast and reserved
+    addresses are refused.
+
+    Raises:
+        ValueError: the URL is not an http(s) URL or its host is not allowed
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError('callback_url must be an http(s) URL')
+    host = parsed.hostname.lower()
+    if allowed_hosts is not None:
+        if host not in {allowed.lower() for allowed in allowed_hosts}:
+            raise ValueError(f"callback_url host '{host}' is not in the allowed callback hosts")
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as e:
+        raise ValueError(f"callback_url host '{host}' cannot be resolved: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        ip = getattr(ip, 'ipv4_mapped', None) or ip
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"callback_url host '{host}' resolves to a non-public address ({ip})")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Callbacks are not redirected: a redirect could point at an address check_callback_url refuses."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class JobQueue:
+    """
+    Bounded queue of prediction jobs run by a fixed pool of worker threads
+
+    Args:
+        runner: `runner(task, data, params)` returning the result dict; a
+            result with an 'error' key (or an exception) fails the job
+        max_workers: Jobs running at the same time
+        max_queued: Jobs waiting or running before submit raises QueueFull
+        timeout_s: Default per-job time limit
+        db_path: SQLite file persisting the jobs (None keeps them in memory only)
+        retention_s: How long finished jobs can still be fetched
+        callback_retries: Attempts to deliver a callback before giving up
+        callback_hosts: Hosts callbacks may be POSTed to (None: any host
+            resolving to public addresses only)
+    """
+
+    def __init__(self, runner, max_workers=2, max_queued=64, timeout_s=120.0, db_path=None,
+                 retention_s=24 * 3600, callback_retries=3, callback_hosts=None):
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.timeout_s = timeout_s
+        self.retention_s = retention_s
+        self.callback_retries = callback_retries
+        self.callback_hosts = callback_hosts
+        self._opener = urllib.request.build_opener(_NoRedirect)
+
+        self._jobs = {}
+        self._images = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._callbacks = ThreadPoolExecutor(2, thread_name_prefix='job-callback')
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.executescript('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    job TEXT NOT NULL,
+                    image BLOB
+                );
+            ''')
+            self._db.commit()
+            self._restore()
+
+        self._workers = [threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, task, data, params=None, callback_url=None, timeout_s=None):
+        """
+        Queue one image for `task`
+
+        Returns:
+            dict: the new job (see `get`)
+
+        Raises:
+            QueueFull: when `max_queued` jobs are already waiting or running
+            ValueError: when `callback_url` is refused (see check_callback_url)
+        """
+        if callback_url:
+            check_callback_url(callback_url, self.callback_hosts)
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'task': task,
+            'status': 'queued',
+            'params': params or {},
+            'timeout_s': timeout_s or self.timeout_s,
+            'callback_url': callback_url,
+            'callback_status': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+        }
+        with self._lock:
+            self._prune()
+            if self._pending() >= self.max_queued:
+                raise QueueFull(f'{self.max_queued} jobs are already queued')
+            self._jobs[job['job_id']] = job
+            self._images[job['job_id']] = data
+            self._save(job, data)
+        self._queue.put(job['job_id'])
+        return dict(job)
+
+    def get(self, job_id):
+        """Snapshot of a job, or None when it is unknown or expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return {
+                'workers': self.max_workers,
+                'max_queued': self.max_queued,
+                'pending': self._pending(),
+                'jobs': counts,
+            }
+
+    def close(self):
+        """Stop the workers once their current job is done; queued jobs stay persisted."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._callbacks.shutdown(wait=True)
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _pending(self):
+        return sum(1 for job in self._jobs.values() if job['status'] not in FINISHED_STATES)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_s
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['status'] in FINISHED_STATES and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if expired and self._db is not None:
+            self._db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+            self._db.commit()
+
+    def _save(self, job, data=None):
+        if self._db is None:
+            return
+        if data is not None:
+            self._db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)',
+                             (job['job_id'], json.dumps(job), sqlite3.Binary(data)))
+        elif job['status'] in FINISHED_STATES:
+            # Finished jobs no longer need their image
+            self._db.execute('UPDATE jobs SET job = ?, image = NULL WHERE id = ?',
+                             (json.dumps(job), job['job_id']))
+        else:
+            self._db.execute('UPDATE jobs SET job = ? WHERE id = ?', (json.dumps(job), job['job_id']))
+        self._db.commit()
+
+    def _restore(self):
+        requeued = 0
+        for job_id, value, image in self._db.execute('SELECT id, job, image FROM jobs ORDER BY rowid').fetchall():
+            job = json.loads(value)
+            self._jobs[job_id] = job
+            if job['status'] in FINISHED_STATES:
+                continue
+            # Jobs interrupted mid-run are started again from scratch
+            job['status'], job['started_at'] = 'queued', None
+            self._images[job_id] = bytes(image)
+            self._queue.put(job_id)
+            requeued += 1
+        if requeued:
+            print(f"Requeued {requeued} unfinished jobs from the previous run", file=sys.stderr)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                data = self._images.get(job_id)
+                if job is None or data is None:
+                    continue
+                job['status'], job['started_at'] = 'running', time.time()
+                self._save(job)
+            self._run(job, data)
+
+    def _run(self, job, data):
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = self.runner(job['task'], data, job['params'])
+            except Exception as e:
+                outcome['error'] = str(e)
+
+        run = threading.Thread(target=target, name=f"job-{job['job_id'][:8]}", daemon=True)
+        run.start()
+        run.join(job['timeout_s'])
+        if run.is_alive():
+            self._finish(job, 'timeout', error=f"Job did not finish within {job['timeout_s']:g}s")
+            # A running prediction cannot be interrupted: keep this worker busy until it
+            # returns so no more than max_workers predictions ever run at once
+            run.join()
+            return
+        result = outcome.get('result')
+        error = outcome.get('error') or (result or {}).get('error')
+        self._finish(job, 'failed' if error else 'done', result, error)
+
+    def _finish(self, job, status, result=None, error=None):
+        with self._lock:
+            job.update(status=status, result=result, error=error, finished_at=time.time())
+            self._images.pop(job['job_id'], None)
+            self._save(job)
+            snapshot = dict(job)
+        if job['callback_url']:
+            self._callbacks.submit(self._deliver, snapshot)
+
+    def _deliver(self, job):
+        """POST the finished job to its callback URL, retrying with backoff."""
+        body = json.dumps(job).encode('utf-8')
+        status = None
+        try:
+            # Checked again at delivery: DNS may have changed, and restored jobs predate the settings
+            check_callback_url(job['callback_url'], self.callback_hosts)
+            attempts = self.callback_retries
+        except ValueError as e:
+            status, attempts = f'refused: {e}', 0
+        for attempt in range(attempts):
+            request = urllib.request.Request(job['callback_url'], data=body, method='POST',
+                                             headers={'Content-Type': 'application/json'})
+            try:
+                with self._opener.open(request, timeout=5) as response:
+                    status = response.status
+                break
+            except Exception as e:
+                status = f'error: {e}'
+                if attempt + 1 < self.callback_retries:
+                    time.sleep(2 ** attempt)
+        if not isinstance(status, int):
+            print(f"⚠️ Callback for job {job['job_id']} failed: {status}", file=sys.stderr)
+        with self._lock:
+            stored = self._jobs.get(job['job_id'])
+            if stored is not None:
+                stored['callback_status'] = status
+                self._save(stored)
@@ -0,0 +1,236 @@
+"""
+Registry owning the lifetime of the loaded prediction models
+Models are loaded lazily on first use and shared by every caller. A model is
+hot-swapped when its weights file changes (or on request) without disturbing
+requests still running on the old one. When the loaded models exceed a memory
+budget, the least recently used idle ones are evicted
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def model_nbytes(model, model_path=None):
+    """Approximate resident size: parameters and buffers of torch modules, file size otherwise."""
+    # Ultralytics' YOLO wraps the network in `.model`
+    module = getattr(model, 'model', model)
+    nbytes = 0
+    if hasattr(module, 'parameters') and hasattr(module, 'buffers'):
+        tensors = list(module.parameters()) + list(module.buffers())
+        nbytes = sum(t.numel() * t.element_size() for t in tensors)
+    if not nbytes and model_path and os.path.exists(model_path):
+        # ONNX sessions and quantized graphs keep their weights outside parameters()
+        nbytes = os.path.getsize(model_path)
+    return nbytes
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ModelEntry:
+    """One registered model: how to load it and, once used, the loaded instance."""
+
+    def __init__(self, name, loader, path, options):
+        self.name = name
+        self.loader = loader
+        self.path = path
+        self.options = options
+        self.model = None
+        self.nbytes = 0
+        self.mtime = None
+        self.version = 0
+        self.in_use = 0
+        self.loads = 0
+        self.last_used = None
+        self.load_lock = threading.Lock()
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'loaded': self.model is not None,
+            'version': self.version,
+            'loads': self.loads,
+            'in_use': self.in_use,
+            'size_mb': self.nbytes / (1024 * 1024),
+            'idle_s': time.monotonic() - self.last_used if self.last_used is not None else None,
+        }
+
+
+class ModelRegistry:
+    """
+    Lazily loaded, hot-swappable, memory-budgeted set of models
+
+    Args:
+        memory_budget_mb: Evict least recently used idle models once the loaded
+            ones exceed this many MB (None disables eviction)
+        watch_files: Reload a model on next use when its weights file changed
+    """
+
+    def __init__(self, memory_budget_mb=None, watch_files=True):
+        self.memory_budget = memory_budget_mb * 1024 * 1024 if memory_budget_mb else None
+        self.watch_files = watch_files
+        self._entries = {}
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def register(self, name, loader, path, **options):
+        """
+        Declare a model without loading it
+
+        `loader(path, **options)` is called on first use (and on every reload).
+        """
+        with self._lock:
+            if name in self._entries:
+                raise ValueError(f"Model '{name}' is already registered")
+            self._entries[name] = ModelEntry(name, loader, path, options)
+
+    def ensure(self, name, loader, path, **options):
+        """Register `name` if needed and return its loaded model."""
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = ModelEntry(name, loader, path, options)
+        return self.get(name)
+
+    def path(self, name):
+        return self._entries[name].path
+
+    def get(self, name):
+        """The current model for `name`, loading or reloading it first if needed."""
+        entry = self._entries[name]
+        with self._lock:
+            if entry.model is not None and not self._is_stale(entry):
+                self._touch(entry)
+                return entry.model
+        # Only one thread loads a given model; the others wait for it here
+        with entry.load_lock:
+            with self._lock:
+                if entry.model is not None and not self._is_stale(entry):
+                    self._touch(entry)
+                    return entry.model
+            if entry.model is None:
+                return self._load(entry, entry.path)
+            try:
+                print(f"Weights of '{name}' changed on disk, reloading {entry.path}", file=sys.stderr)
+                return self._load(entry, entry.path)
+            except Exception as e:
+                # Likely caught mid-write: keep serving the old weights until the file changes again
+                print(f"⚠️ Reloading '{name}' failed, keeping version {entry.version}: {e}", file=sys.stderr)
+                with self._lock:
+                    entry.mtime = _mtime(entry.path)
+                    self._touch(entry)
+                    return entry.model
+
+    @contextmanager
+    def acquire(self, name):
+        """
+        Use a model for one request
+
+        The model stays valid for the whole block even if it is swapped or
+        evicted meanwhile; in-use models are never chosen for eviction.
+        """
+        model = self.get(name)
+        entry = self._entries[name]
+        with self._lock:
+            entry.in_use += 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+
+    def swap(self, name, path=None):
+        """
+        Load new weights for `name` and switch to them atomically
+
+        Requests already running keep the previous model until they finish.
+        The new weights are fully loaded before the switch, so a failed load
+        leaves the old model in place and raises.
+
+        Returns:
+            dict: the entry's stats after the swap
+        """
+        entry = self._entries[name]
+        with entry.load_lock:
+            self._load(entry, path or entry.path)
+        return entry.stats()
+
+    def unload(self, name):
+        """Drop the loaded model; it is loaded again on next use."""
+        with self._lock:
+            self._drop(self._entries[name])
+
+    def stats(self):
+        with self._lock:
+            loaded = sum(e.nbytes for e in self._entries.values() if e.model is not None)
+            return {
+                'memory_budget_mb': self.memory_budget / (1024 * 1024) if self.memory_budget else None,
+                'loaded_mb': loaded / (1024 * 1024),
+                'evictions': self._evictions,
+                'models': {name: entry.stats() for name, entry in self._entries.items()},
+            }
+
+    def _is_stale(self, entry):
+        return self.watch_files and _mtime(entry.path) != entry.mtime
+
+    def _touch(self, entry):
+        entry.last_used = time.monotonic()
+        self._lru[entry.name] = None
+        self._lru.move_to_end(entry.name)
+
+    def _load(self, entry, path):
+        mtime = _mtime(path)
+        start = time.perf_counter()
+        model = entry.loader(path, **entry.options)
+        nbytes = model_nbytes(model, path)
+        with self._lock:
+            entry.model, entry.path, entry.mtime, entry.nbytes = model, path, mtime, nbytes
+            entry.version += 1
+            entry.loads += 1
+            self._touch(entry)
+            self._evict(keep=entry.name)
+        print(f"Loaded '{entry.name}' v{entry.version} from {path} "
+              f"({nbytes / (1024 * 1024):.0f} MB, {time.perf_counter() - start:.2f}s)", file=sys.stderr)
+        return model
+
+    def _drop(self, entry):
+        entry.model = None
+        entry.nbytes = 0
+        self._lru.pop(entry.name, None)
+
+    def _evict(self, keep):
+        if self.memory_budget is None:
+            return
+        loaded = sum(e.nbytes for e in self._entries.values() if e.model is not None)
+        for name in list(self._lru):
+            if loaded <= self.memory_budget:
+                break
+            entry = self._entries[name]
+            if name == keep or entry.in_use:
+                continue
+            print(f"Memory budget exceeded, evicting '{name}' ({entry.nbytes / (1024 * 1024):.0f} MB)",
+                  file=sys.stderr)
+            loaded -= entry.nbytes
+            self._drop(entry)
+            self._evictions += 1
+
+
+_default_registry = None
+_default_lock = threading.Lock()
+
+
+def get_default_registry():
+    """Process-wide registry used by the one-shot prediction functions."""
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = ModelRegistry()
+        return _default_registry
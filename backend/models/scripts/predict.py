@@ -1,91 +1,56 @@
-import torch
-from torchvision import transforms, models
-from PIL import Image
-import os
-import torch.nn as nn
-import torch.nn.functional as F
-import matplotlib.pyplot as plt
+from instrumentation import start_trace, attach_timings
+from predict_api import INPUT_SIZE, load_shared_model, predict_image
+from visualization import DEFAULT_OUTPUT_DIR, visualization_path, visualize
 
-def predict_fracture(image_path, model_path="./pretrained_models/bone_fracture_model.pth"):
-    # Load the trained model
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    # Define the model architecture
-    model = models.resnet50(pretrained=False)
-    num_ftrs = model.fc.in_features
-    model.fc = nn.Linear(num_ftrs, 2)  # Ensure this matches your training setup
-
-    # Load model weights
-    checkpoint = torch.load(model_path, map_location=device)
-    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
-        model.load_state_dict(checkpoint['model_state_dict'])
-    else:
-        model.load_state_dict(checkpoint)  # If you saved only state_dict
+def predict_fracture(image_path, model_path="./pretrained_models/bone_fracture_model.pth", timings=False,
+                     visualize_mode='async', output_dir=DEFAULT_OUTPUT_DIR):
+    """
+    Classify an X-ray and render the confidence chart to <output_dir>/<image>_prediction.png
 
-    model = model.to(device)
-    model.eval()
+    visualize_mode is 'async' (render in a background thread, the default),
+    'sync', 'lazy' (render on visualization.get_renderer().ensure(path)) or 'off'.
+    """
+    trace = start_trace('predict_fracture', force=timings)
+    try:
+        result = _predict_fracture(image_path, model_path, trace, visualize_mode, output_dir)
+    except Exception as e:
+        trace.finish(error=e)
+        raise
+    trace.finish()
+    return attach_timings(result, trace) if timings else result
 
-    # Image preprocessing
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    
-    # Load and preprocess the image
-    image = Image.open(image_path).convert('RGB')
-    image_tensor = transform(image).unsqueeze(0).to(device)
-    
-    # Get prediction
-    with torch.no_grad():
-        outputs = model(image_tensor)
-        probabilities = F.softmax(outputs, dim=1).cpu().numpy()[0]
-        predicted_class = torch.argmax(outputs, dim=1).item()
-    
-    class_names = ['fractured', 'not fractured']  # Ensure this order matches your training dataset
-    result = {
-        'prediction': class_names[predicted_class],
-        'confidence': float(probabilities[predicted_class] * 100),
-        'probabilities': {class_names[i]: float(probabilities[i] * 100) for i in range(len(class_names))}
-    }
-    
-    # Visualize the results
-    plt.figure(figsize=(10, 5))
+def _predict_fracture(image_path, model_path, trace, visualize_mode, output_dir):
+    # Load the trained model (shared with predict_api through the model registry)
+    with trace.stage('model_load'):
+        model, device = load_shared_model(model_path)
     
-    # Display the image
-    plt.subplot(1, 2, 1)
-    plt.imshow(image)
-    plt.title('Input Image')
-    plt.axis('off')
+    # Decode straight to the classifier's input size and classify the image
+    from image_io import decode_image
+    with trace.stage('decode'):
+        image, original_size = decode_image(image_path, size=INPUT_SIZE)
+    trace.image(original_size)
+    result = predict_image(model, image, device, trace=trace)
     
-    # Display the probabilities
-    plt.subplot(1, 2, 2)
-    bars = plt.bar(class_names, [result['probabilities'][c] for c in class_names])
-    plt.title('Prediction Confidence')
-    plt.ylabel('Confidence (%)')
-    plt.ylim(0, 100)
-    
-    # Color the bars based on prediction
-    for i, bar in enumerate(bars):
-        bar.set_color('green' if i == predicted_class else 'red')
-    
-    for i, v in enumerate([result['probabilities'][c] for c in class_names]):
-        plt.text(i, v + 2, f"{v:.1f}%", ha='center')
-    
-    plt.tight_layout()
-    
-    # Save the visualization
-    output_dir = "./predictions"
-    os.makedirs(output_dir, exist_ok=True)
-    image_name = os.path.splitext(os.path.basename(image_path))[0]
-    plot_path = os.path.join(output_dir, f"{image_name}_prediction.png")
-    plt.savefig(plot_path)
+    # Visualize the results off the hot path (Agg canvas, background thread by default);
+    # the renderer decodes its own display-sized copy of the original
+    plot_path = visualization_path(image_path, output_dir)
+    with trace.stage('plot'):
+        future = visualize('classify', image_path, result, plot_path, visualize_mode)
+    if visualize_mode != 'off':
+        result['visualization'] = plot_path
     
     print(f"Prediction: {result['prediction']} (Confidence: {result['confidence']:.2f}%)")
-    print(f"Visualization saved to {plot_path}")
+    if future is not None:
+        future.add_done_callback(_report_visualization)
     
     return result
 
+def _report_visualization(future):
+    if future.exception() is not None:
+        print(f"⚠️ Visualization failed: {future.exception()}")
+    else:
+        print(f"Visualization saved to {future.result()}")
+
 if __name__ == "__main__":
     import argparse
     
@@ -93,6 +58,13 @@ if __name__ == "__main__":
     parser.add_argument('image_path', type=str, help='Path to the X-ray image')
     parser.add_argument('--model', type=str, default='./pretrained_models/bone_fracture_model.pth', 
                         help='Path to the trained model')
+    parser.add_argument('--timings', action='store_true', help='Print per-stage timings')
+    parser.add_argument('--visualize', type=str, default='async', choices=['async', 'sync', 'off'],
+                        help='Render the confidence chart in the background (async), inline (sync) or not at all')
+    parser.add_argument('--output-dir', type=str, default=DEFAULT_OUTPUT_DIR, help='Where to write the chart')
     
     args = parser.parse_args()
-    predict_fracture(args.image_path, args.model)
+    result = predict_fracture(args.image_path, args.model, timings=args.timings,
+                              visualize_mode=args.visualize, output_dir=args.output_dir)
+    if args.timings:
+        print("Timings: " + ', '.join(f"{name}={ms:.1f}" for name, ms in result['timings'].items()))
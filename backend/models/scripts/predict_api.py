@@ -3,65 +3,201 @@ Simple API wrapper for bone fracture prediction
 This script provides a JSON-based interface for the prediction model
 """
 
-import torch
-from torchvision import transforms, models
-from PIL import Image
 import json
 import sys
 import os
-import torch.nn as nn
-import torch.nn.functional as F
 
-def predict_fracture_json(image_path, model_path="./pretrained_models/bone_fracture_model.pth"):
-    try:
-        # Load the trained model
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        
-        # Define the model architecture
-        model = models.resnet50(pretrained=False)
-        num_ftrs = model.fc.in_features
-        model.fc = nn.Linear(num_ftrs, 2)
-
-        # Load model weights
-        checkpoint = torch.load(model_path, map_location=device)
-        if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
-            model.load_state_dict(checkpoint['model_state_dict'])
-        else:
-            model.load_state_dict(checkpoint)
-
-        model = model.to(device)
-        model.eval()
-
-        # Image preprocessing
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        
-        # Load and preprocess the image
-        image = Image.open(image_path).convert('RGB')
-        image_tensor = transform(image).unsqueeze(0).to(device)
-        
-        # Get prediction
-        with torch.no_grad():
-            outputs = model(image_tensor)
-            probabilities = F.softmax(outputs, dim=1).cpu().numpy()[0]
-            predicted_class = torch.argmax(outputs, dim=1).item()
-        
-        class_names = ['fractured', 'not fractured']
-        result = {
-            'prediction': class_names[predicted_class],
-            'confidence': float(probabilities[predicted_class] * 100),
-            'probabilities': {
-                class_names[i]: float(probabilities[i] * 100) 
-                for i in range(len(class_names))
-            }
+# torch, torchvision and PIL are imported inside the functions that need them:
+# this script is spawned per request, and --help, argument errors and cache
+# hits should not pay seconds of import time for them
+from instrumentation import NULL_TRACE, start_trace, attach_timings
+from model_registry import get_default_registry
+
+CLASS_NAMES = ['fractured', 'not fractured']
+INPUT_SIZE = (224, 224)
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+
+
+def build_classifier(arch='resnet50', num_classes=len(CLASS_NAMES)):
+    """Untrained torchvision ResNet/MobileNet with a `num_classes` head (weights not initialized meaningfully)."""
+    from torchvision import models
+
+    return replace_head(getattr(models, arch)(weights=None), num_classes)
+
+
+def replace_head(model, num_classes):
+    """Swap the ImageNet classification layer of a torchvision ResNet/MobileNet for a `num_classes` one."""
+    import torch.nn as nn
+
+    if hasattr(model, 'fc'):
+        model.fc = nn.Linear(model.fc.in_features, num_classes)
+    else:
+        model.classifier[-1] = nn.Linear(model.classifier[-1].in_features, num_classes)
+    return model
+
+
+def head_classes(state_dict):
+    """Number of classes of the final layer in a ResNet/MobileNet state dict."""
+    if 'fc.weight' in state_dict:
+        return state_dict['fc.weight'].shape[0]
+    layers = [int(key.split('.')[1]) for key in state_dict
+              if key.startswith('classifier.') and key.endswith('.weight')]
+    return state_dict[f'classifier.{max(layers)}.weight'].shape[0]
+
+
+def infer_arch(state_dict):
+    """torchvision ResNet/MobileNet variant a state dict belongs to, for checkpoints without metadata."""
+    features = len({key.split('.')[1] for key in state_dict if key.startswith('features.')})
+    if 'classifier.3.weight' in state_dict:
+        return 'mobilenet_v3_small' if features == 13 else 'mobilenet_v3_large'
+    if 'classifier.1.weight' in state_dict:
+        return 'mobilenet_v2'
+    bottleneck = 'layer1.0.conv3.weight' in state_dict
+    layer3_blocks = len({key.split('.')[1] for key in state_dict if key.startswith('layer3.')})
+    depths = {(False, 2): 'resnet18', (False, 6): 'resnet34', (True, 6): 'resnet50',
+              (True, 23): 'resnet101', (True, 36): 'resnet152'}
+    return depths.get((bottleneck, layer3_blocks), 'resnet50')
+
+
+def load_model(model_path, device, backend='torch', num_threads=None, inter_op_threads=None):
+    """
+    Build the classifier and load its trained weights onto `device`
+
+    Accepts memory-mapped checkpoints (checkpoint_io, the architecture is read
+    from their metadata) and legacy .pth files with a raw or
+    'model_state_dict' layout (the ResNet depth is inferred from the weights). With backend='torchscript', 'onnx'
+    or 'quantized' the exported graph is loaded instead; the returned object
+    is called the same way either way. `inter_op_threads` applies to the ONNX
+    Runtime backend.
+    """
+    if backend != 'torch':
+        from inference_backends import load_backend
+        return load_backend(backend, model_path, device, num_threads, inter_op_threads)
+    import torch
+    from checkpoint_io import load_weights
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    state_dict, metadata = load_weights(model_path, map_location=device)
+
+    # Built without allocating or initializing weights; load_state_dict(assign=True)
+    # then adopts the loaded tensors (the mapped file pages for mmap checkpoints)
+    with torch.device('meta'):
+        arch = metadata.get('architecture') or infer_arch(state_dict)
+        model = build_classifier(arch, head_classes(state_dict))
+    model.load_state_dict(state_dict, assign=True)
+
+    model = model.to(device)
+    model.eval()
+    return model
+
+
+def load_shared_model(model_path, backend='torch', num_threads=None, inter_op_threads=None):
+    """
+    Classifier for `model_path` from the process-wide model registry
+
+    Loaded on first use and reused by later calls; reloaded when the file the
+    backend runs (the checkpoint, or its exported graph) changes.
+
+    Returns:
+        tuple: (model, device)
+    """
+    import torch
+    from inference_backends import artifact_path
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = get_default_registry().ensure(f'classifier:{backend}:{os.path.abspath(model_path)}', load_model,
+                                          artifact_path(model_path, backend), device=device, backend=backend,
+                                          num_threads=num_threads, inter_op_threads=inter_op_threads)
+    return model, device
+
+
+def get_transform():
+    """Preprocessing applied to every image before it reaches the classifier."""
+    from torchvision import transforms
+
+    return transforms.Compose([
+        transforms.Resize(INPUT_SIZE),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=NORMALIZE_MEAN, std=NORMALIZE_STD)
+    ])
+
+
+def format_result(probabilities):
+    """Turn one row of softmax probabilities into the JSON result dict."""
+    predicted_class = int(probabilities.argmax())
+    return {
+        'prediction': CLASS_NAMES[predicted_class],
+        'confidence': float(probabilities[predicted_class] * 100),
+        'probabilities': {
+            CLASS_NAMES[i]: float(probabilities[i] * 100)
+            for i in range(len(CLASS_NAMES))
         }
-        
-        return result
+    }
+
+
+def predict_image(model, image, device, transform=None, trace=NULL_TRACE):
+    """
+    Classify an already decoded RGB PIL image with a loaded model
+
+    Args:
+        trace: Optional instrumentation trace timing the preprocess/forward stages
+
+    Returns:
+        dict: prediction, confidence and per-class probabilities
+    """
+    import torch
+    import torch.nn.functional as F
+
+    transform = transform or get_transform()
+    with trace.stage('preprocess'):
+        image_tensor = transform(image).unsqueeze(0).to(device)
+
+    # Get prediction
+    with trace.stage('forward'), torch.no_grad():
+        outputs = model(image_tensor)
+        probabilities = F.softmax(outputs, dim=1).cpu().numpy()[0]
+
+    return format_result(probabilities)
+
+
+def predict_fracture_json(image_path, model_path="./pretrained_models/bone_fracture_model.pth", cache=None,
+                          backend='torch', num_threads=None, timings=False, inter_op_threads=None):
+    trace = start_trace('predict_fracture_json', force=timings)
+    try:
+        # Serve repeat uploads of the same image from the cache
+        key = None
+        if cache is not None:
+            from inference_backends import artifact_path
+            with trace.stage('cache_lookup'):
+                # Keyed on the file the backend runs: re-exporting a graph leaves the .pth unchanged
+                with open(image_path, 'rb') as f:
+                    key = cache.make_key(f.read(), artifact_path(model_path, backend), task='classify',
+                                         backend=backend)
+                cached = cache.get(key)
+            if cached is not None:
+                trace.finish(outcome='cache_hit')
+                return attach_timings(cached, trace) if timings else cached
+
+        # Load the trained model (once per process, shared through the registry)
+        with trace.stage('model_load'):
+            model, device = load_shared_model(model_path, backend, num_threads, inter_op_threads)
+
+        # Decode straight to the classifier's input size and classify the image
+        from image_io import decode_image
+        with trace.stage('decode'):
+            image, original_size = decode_image(image_path, size=INPUT_SIZE)
+        trace.image(original_size)
+        result = predict_image(model, image, device, trace=trace)
+        if cache is not None:
+            cache.put(key, result)
+        trace.finish()
+        return attach_timings(result, trace) if timings else result
         
     except Exception as e:
+        trace.finish(error=e)
         return {
             'error': str(e),
             'prediction': None,
@@ -73,11 +209,41 @@ if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='Predict bone fracture from X-ray image (JSON output)')
-    parser.add_argument('image_path', type=str, help='Path to the X-ray image')
+    parser.add_argument('image_path', type=str, nargs='?', help='Path to the X-ray image')
     parser.add_argument('--model', type=str, default='./pretrained_models/bone_fracture_model.pth', 
                         help='Path to the trained model')
+    parser.add_argument('--backend', type=str, default='torch',
+                        choices=['torch', 'torchscript', 'onnx', 'quantized'],
+                        help='Inference backend '
+                             '(torchscript/onnx need export_model.py, quantized needs quantize_model.py)')
+    parser.add_argument('--threads', type=int, help='Intra-op threads for inference')
+    parser.add_argument('--inter-op-threads', type=int, help='Inter-op threads (onnx backend)')
+    parser.add_argument('--cache-db', type=str,
+                        help='SQLite prediction cache; repeat images skip the model entirely')
+    parser.add_argument('--input-dir', type=str,
+                        help='Score every image under this directory instead of a single image')
+    parser.add_argument('--output', type=str, default='results.jsonl',
+                        help='JSONL results file for --input-dir (appended to, resumable)')
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch size for --input-dir')
+    parser.add_argument('--workers', type=int, default=4, help='DataLoader workers for --input-dir')
+    parser.add_argument('--timings', action='store_true', help='Add per-stage timings to the JSON output')
     
     args = parser.parse_args()
     
-    result = predict_fracture_json(args.image_path, args.model)
+    if args.input_dir:
+        from batch_predict import predict_directory
+        result = predict_directory(args.input_dir, args.output, args.model,
+                                   batch_size=args.batch_size, num_workers=args.workers,
+                                   backend=args.backend, num_threads=args.threads,
+                                   inter_op_threads=args.inter_op_threads)
+    elif args.image_path:
+        cache = None
+        if args.cache_db:
+            from prediction_cache import PredictionCache
+            cache = PredictionCache(db_path=args.cache_db)
+        result = predict_fracture_json(args.image_path, args.model, cache=cache,
+                                       backend=args.backend, num_threads=args.threads, timings=args.timings,
+                                       inter_op_threads=args.inter_op_threads)
+    else:
+        parser.error('either image_path or --input-dir is required')
     print(json.dumps(result))
@@ -6,24 +6,120 @@ Provides JSON-based interface for YOLOv8 fracture detection and classification
 import json
 import sys
 import os
-from ultralytics import YOLO
-from PIL import Image
-import torch
 
-def predict_fracture_yolo(image_path, model_path="./runs/detect/bone_fracture_yolov8m/weights/best.pt"):
+# NumPy, ONNX Runtime, torch and ultralytics are imported lazily by the code
+# paths that need them, so spawning this script stays cheap
+from instrumentation import NULL_TRACE, start_trace, attach_timings
+from model_registry import get_default_registry
+from visualization import DEFAULT_OUTPUT_DIR, visualization_path, visualize
+
+
+def default_device():
+    """'cuda' when torch sees a GPU, otherwise 'cpu' (also when torch is not installed)."""
+    try:
+        import torch
+    except ImportError:
+        return 'cpu'
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def load_yolo_model(model_path, device=None):
+    """
+    Load a trained YOLOv8 model
+
+    `.onnx` files (as exported by train_yolo.py) run through ONNX Runtime with
+    NumPy pre/post-processing and do not need ultralytics; anything else is
+    loaded with ultralytics and moved to `device` (CUDA when available).
+    """
+    if model_path.endswith('.onnx'):
+        from yolo_onnx import OnnxYoloDetector
+        return OnnxYoloDetector(model_path)
+
+    from ultralytics import YOLO
+    device = device or default_device()
+    model = YOLO(model_path)
+    model.to(device)
+    return model
+
+
+def detect_fractures(model, source, device=None, conf=0.25, iou=0.45, trace=NULL_TRACE):
+    """
+    Run a loaded YOLOv8 model on a single image
+    
+    Args:
+        model: Model returned by load_yolo_model
+        source: Image path, PIL image or numpy array
+        conf: Confidence threshold
+        iou: NMS IoU threshold
+        trace: Optional instrumentation trace for per-stage timings
+        
+    Returns:
+        dict: Prediction results with detections and classifications
+    """
+    from yolo_onnx import OnnxYoloDetector
+    from yolo_utils import format_detections
+
+    if isinstance(model, OnnxYoloDetector):
+        # ONNX Runtime detector: letterbox, NMS and formatting happen in NumPy
+        return model.predict(source, conf=conf, iou=iou, trace=trace)
+
+    device = device or default_device()
+    
+    # Run inference
+    results = model.predict(
+        source=source,
+        conf=conf,  # Confidence threshold
+        iou=iou,    # NMS IoU threshold
+        device=device,
+        verbose=False
+    )
+    
+    # Process results
+    result = results[0]
+    boxes = result.boxes
+    # Ultralytics times its own stages (ms); image loading is the remainder of the call
+    for stage, name in (('preprocess', 'preprocess'), ('inference', 'forward'), ('postprocess', 'postprocess')):
+        if result.speed.get(stage) is not None:
+            trace.add_stage(name, result.speed[stage] / 1000)
+    trace.image((result.orig_shape[1], result.orig_shape[0]))
+    
+    return format_detections(
+        boxes.xyxy.cpu().numpy(),
+        boxes.conf.cpu().numpy(),
+        boxes.cls.cpu().numpy().astype(int),
+        result.names,  # Dictionary of class IDs to names
+        result.orig_shape
+    )
+
+
+def predict_fracture_yolo(image_path, model_path="./runs/detect/bone_fracture_yolov8m/weights/best.pt",
+                          conf=0.25, iou=0.45, cache=None, timings=False, visualize_mode='off',
+                          output_dir=DEFAULT_OUTPUT_DIR, tile_size=None, tile_overlap=0.2, tile_batch_size=8):
     """
     Predict bone fractures using YOLOv8 model
     
     Args:
         image_path: Path to the X-ray image
         model_path: Path to the trained YOLOv8 model
+        conf: Confidence threshold
+        iou: NMS IoU threshold
+        cache: Optional PredictionCache for repeat images
+        timings: Add a per-stage `timings` block to the result
+        visualize_mode: Draw the boxes to <output_dir>/<image>_detection.png
+            ('async', 'sync', 'lazy' or 'off'); the path is returned as 'visualization'
+        tile_size: Run tiled inference with tiles of this many pixels (None
+            sends the whole image to YOLO at its input size)
+        tile_overlap: Fraction of each tile shared with its neighbours
+        tile_batch_size: Tiles per forward pass; bounds peak memory
         
     Returns:
         dict: Prediction results with detections and classifications
     """
+    trace = start_trace('predict_fracture_yolo', force=timings)
     try:
         # Check if model exists
         if not os.path.exists(model_path):
+            trace.finish(error=FileNotFoundError(model_path))
             return {
                 'error': f'Model file not found at {model_path}',
                 'prediction': None,
@@ -31,82 +127,40 @@ def predict_fracture_yolo(image_path, model_path="./runs/detect/bone_fracture_yo
                 'detections': []
             }
         
-        # Load YOLOv8 model
-        model = YOLO(model_path)
-        
-        # Check if CUDA is available
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        model.to(device)
-        
-        # Run inference
-        results = model.predict(
-            source=image_path,
-            conf=0.25,  # Confidence threshold
-            iou=0.45,   # NMS IoU threshold
-            device=device,
-            verbose=False
-        )
+        # Serve repeat uploads of the same image from the cache
+        key = None
+        if cache is not None:
+            with trace.stage('cache_lookup'):
+                with open(image_path, 'rb') as f:
+                    tiling = {'tile_size': tile_size, 'tile_overlap': tile_overlap} if tile_size else {}
+                    key = cache.make_key(f.read(), model_path, task='detect', conf=conf, iou=iou, **tiling)
+                cached = cache.get(key)
+            if cached is not None:
+                cached = _visualize_detections(image_path, cached, visualize_mode, output_dir)
+                trace.finish(outcome='cache_hit')
+                return attach_timings(cached, trace) if timings else cached
         
-        # Process results
-        result = results[0]
-        boxes = result.boxes
+        # Load YOLOv8 model (.pt via ultralytics, .onnx via ONNX Runtime), once per process
+        with trace.stage('model_load'):
+            # Resolved by the ultralytics path only; the ONNX path never imports torch
+            device = None
+            model = get_default_registry().ensure(f'detector:{os.path.abspath(model_path)}', load_yolo_model,
+                                                  model_path, device=device)
         
-        # Class names from the model
-        class_names = result.names  # Dictionary of class IDs to names
-        
-        detections = []
-        max_confidence = 0.0
-        primary_class = "Healthy"
-        
-        # Process each detection
-        for box in boxes:
-            cls_id = int(box.cls[0])
-            confidence = float(box.conf[0])
-            bbox = box.xyxy[0].tolist()  # [x1, y1, x2, y2]
-            
-            class_name = class_names[cls_id]
-            
-            detections.append({
-                'class': class_name,
-                'confidence': confidence * 100,
-                'bbox': {
-                    'x1': bbox[0],
-                    'y1': bbox[1],
-                    'x2': bbox[2],
-                    'y2': bbox[3]
-                }
-            })
-            
-            # Track highest confidence detection
-            if confidence > max_confidence:
-                max_confidence = confidence
-                primary_class = class_name
-        
-        # Determine if fractured
-        is_fractured = len(detections) > 0 and primary_class != "Healthy"
-        
-        # Calculate class probabilities
-        class_counts = {}
-        for detection in detections:
-            cls = detection['class']
-            class_counts[cls] = class_counts.get(cls, 0) + 1
-        
-        result_data = {
-            'prediction': 'fractured' if is_fractured else 'not fractured',
-            'confidence': float(max_confidence * 100) if detections else 0.0,
-            'primary_class': primary_class,
-            'num_detections': len(detections),
-            'detections': detections,
-            'class_summary': class_counts,
-            'image_shape': {
-                'width': int(result.orig_shape[1]),
-                'height': int(result.orig_shape[0])
-            }
-        }
-        
-        return result_data
+        if tile_size:
+            from yolo_tiling import detect_tiled
+            result = detect_tiled(model, image_path, device, conf, iou, tile_size, tile_overlap,
+                                  tile_batch_size, trace=trace)
+        else:
+            result = detect_fractures(model, image_path, device, conf=conf, iou=iou, trace=trace)
+        if cache is not None:
+            cache.put(key, result)
+        result = _visualize_detections(image_path, result, visualize_mode, output_dir)
+        trace.finish()
+        return attach_timings(result, trace) if timings else result
         
     except Exception as e:
+        trace.finish(error=e)
         return {
             'error': str(e),
             'prediction': None,
@@ -114,15 +168,41 @@ def predict_fracture_yolo(image_path, model_path="./runs/detect/bone_fracture_yo
             'detections': []
         }
 
+def _visualize_detections(image_path, result, visualize_mode, output_dir):
+    if visualize_mode == 'off':
+        return result
+    plot_path = visualization_path(image_path, output_dir, suffix='detection')
+    visualize('detect', image_path, result, plot_path, visualize_mode)
+    return dict(result, visualization=plot_path)
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='YOLOv8 Bone Fracture Detection (JSON output)')
     parser.add_argument('image_path', type=str, help='Path to the X-ray image')
     parser.add_argument('--model', type=str, default='./runs/detect/bone_fracture_yolov8m/weights/best.pt',
-                        help='Path to the trained YOLOv8 model')
+                        help='Path to the trained YOLOv8 model (.pt, or the exported .onnx)')
+    parser.add_argument('--conf', type=float, default=0.25, help='Confidence threshold')
+    parser.add_argument('--iou', type=float, default=0.45, help='NMS IoU threshold')
+    parser.add_argument('--cache-db', type=str,
+                        help='SQLite prediction cache; repeat images skip the model entirely')
+    parser.add_argument('--tile-size', type=int,
+                        help='Tiled inference for large radiographs: tile side in pixels (e.g. 640)')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='Fraction of overlap between tiles')
+    parser.add_argument('--tile-batch', type=int, default=8, help='Tiles per forward pass')
+    parser.add_argument('--timings', action='store_true', help='Add per-stage timings to the JSON output')
+    parser.add_argument('--visualize', type=str, default='off', choices=['off', 'async', 'sync'],
+                        help='Also draw the boxes to <output-dir>/<image>_detection.png')
+    parser.add_argument('--output-dir', type=str, default=DEFAULT_OUTPUT_DIR, help='Where to write the drawing')
     
     args = parser.parse_args()
     
-    result = predict_fracture_yolo(args.image_path, args.model)
+    cache = None
+    if args.cache_db:
+        from prediction_cache import PredictionCache
+        cache = PredictionCache(db_path=args.cache_db)
+    result = predict_fracture_yolo(args.image_path, args.model, args.conf, args.iou, cache=cache,
+                                   timings=args.timings, visualize_mode=args.visualize, output_dir=args.output_dir,
+                                   tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                                   tile_batch_size=args.tile_batch)
     print(json.dumps(result))
@@ -0,0 +1,177 @@
+"""
+Content-addressed cache for prediction results
+Keys combine the SHA-256 of the image bytes, the hash of the model weights and
+the inference parameters, so re-uploads of the same X-ray skip the forward pass
+and replacing the weights file invalidates every old entry automatically
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier prediction cache: in-memory LRU backed by an optional SQLite file
+
+    Args:
+        max_entries: Capacity of the in-memory LRU tier
+        db_path: SQLite file for the on-disk tier (None keeps the cache in memory only)
+        max_db_bytes: Size budget of the on-disk tier; least recently used rows
+            are evicted once the stored results exceed it
+    """
+
+    def __init__(self, max_entries=1024, db_path=None, max_db_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_db_bytes = max_db_bytes
+        self._memory = OrderedDict()
+        self._weight_digests = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.executescript('''
+                CREATE TABLE IF NOT EXISTS predictions (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS predictions_last_access ON predictions (last_access);
+                CREATE TABLE IF NOT EXISTS weights (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    digest TEXT NOT NULL
+                );
+            ''')
+            self._db.commit()
+
+    def weights_digest(self, model_path):
+        """
+        SHA-256 of a weights file, recomputed only when its size or mtime changes
+
+        The digest is remembered in memory and, with a database, on disk so that
+        short-lived CLI processes do not rehash a 100 MB checkpoint every run.
+        """
+        path = os.path.abspath(model_path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            known = self._weight_digests.get(path)
+            if known and known[0] == signature:
+                return known[1]
+            if self._db is not None:
+                row = self._db.execute('SELECT mtime_ns, size, digest FROM weights WHERE path = ?',
+                                       (path,)).fetchone()
+                if row and (row[0], row[1]) == signature:
+                    self._weight_digests[path] = (signature, row[2])
+                    return row[2]
+
+        digest = sha256_file(path)
+        with self._lock:
+            self._weight_digests[path] = (signature, digest)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO weights VALUES (?, ?, ?, ?)',
+                                 (path, signature[0], signature[1], digest))
+                self._db.commit()
+        return digest
+
+    def make_key(self, image_bytes, model_path, **params):
+        """Cache key for one image, one weights file and one set of inference parameters."""
+        parts = [sha256_bytes(image_bytes), self.weights_digest(model_path),
+                 json.dumps(params, sort_keys=True)]
+        return sha256_bytes('|'.join(parts).encode('utf-8'))
+
+    def get(self, key):
+        """Cached result dict (marked `cached: True`) or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return dict(self._memory[key], cached=True)
+
+            if self._db is not None:
+                row = self._db.execute('SELECT value FROM predictions WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE predictions SET last_access = ? WHERE key = ?',
+                                     (time.time(), key))
+                    self._db.commit()
+                    result = json.loads(row[0])
+                    self._remember(key, result)
+                    self.hits += 1
+                    return dict(result, cached=True)
+
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """Store a successful result; error results are never cached."""
+        if result.get('error'):
+            return
+        result = {k: v for k, v in result.items() if k != 'cached'}
+        with self._lock:
+            self._remember(key, result)
+            if self._db is not None:
+                value = json.dumps(result)
+                self._db.execute('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)',
+                                 (key, value, len(value), time.time()))
+                self._evict_db()
+                self._db.commit()
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_db(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM predictions').fetchone()[0]
+        while total > self.max_db_bytes:
+            row = self._db.execute(
+                'SELECT key, size FROM predictions ORDER BY last_access LIMIT 1').fetchone()
+            if row is None:
+                break
+            self._db.execute('DELETE FROM predictions WHERE key = ?', (row[0],))
+            total -= row[1]
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries,
+            }
+            if self._db is not None:
+                count, size = self._db.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM predictions').fetchone()
+                stats.update({'db_entries': count, 'db_bytes': size, 'max_db_bytes': self.max_db_bytes})
+            return stats
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,163 @@
+"""
+Post-training INT8 quantization of the fracture classifier
+Quantizes the ResNet-50 produced by external_trainer.train_model, evaluates it
+on the test split exactly like train_model does and only writes the INT8
+artifact when the accuracy drop stays within a configurable threshold
+"""
+
+import copy
+import itertools
+import json
+import os
+import random
+import sys
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+
+from external_trainer import build_datasets, evaluate_accuracy, sample_targets
+from predict_api import load_model
+from inference_backends import artifact_path
+
+
+def quantize_dynamic(model):
+    """Dynamic INT8: weights of Linear layers quantized ahead of time, activations on the fly."""
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_loader, num_batches=10, engine='x86'):
+    """
+    Static INT8 via FX graph mode: convolutions and activations are quantized
+    using ranges observed while running `num_batches` calibration batches
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    if engine in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = engine
+    example = torch.randn(1, 3, 224, 224)
+    prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(engine), (example,))
+    with torch.no_grad():
+        for images, _ in itertools.islice(calibration_loader, num_batches):
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def calibration_subset(dataset, num_samples, seed=0):
+    """
+    Seeded, class-stratified sample of `dataset` for static calibration
+
+    Manifest splits are ordered by class, so the first batches of the split
+    would hold a single class and bias the observed activation ranges. Each
+    class is shuffled and the classes are interleaved in proportion to their
+    size, so every calibration batch has roughly the split's class mix.
+    """
+    rng = random.Random(seed)
+    by_class = {}
+    for index, target in enumerate(sample_targets(dataset)):
+        by_class.setdefault(target, []).append(index)
+    ranked = []
+    for indices in by_class.values():
+        rng.shuffle(indices)
+        ranked.extend(((rank + 0.5) / len(indices), index) for rank, index in enumerate(indices))
+    return Subset(dataset, [index for _, index in sorted(ranked)[:num_samples]])
+
+
+def save_quantized(model, output_path):
+    """Save as frozen TorchScript so predictors can load it without the quantization code."""
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn(1, 3, 224, 224))
+        frozen = torch.jit.freeze(traced)
+    frozen.save(output_path)
+    return output_path
+
+
+def quantize_model(data_dir, model_path="./pretrained_models/bone_fracture_model.pth", output_path=None,
+                   mode='static', max_accuracy_drop=1.0, calibration_batches=10, batch_size=32,
+                   simulate=False, manifest_path=None):
+    """
+    Quantize the trained classifier and gate it on test accuracy
+
+    Args:
+        data_dir: Dataset root, laid out as for train_model
+        model_path: fp32 weights written by train_model
+        output_path: Where to write the INT8 model (defaults next to model_path)
+        mode: 'static' (calibrated on the val split) or 'dynamic'
+        max_accuracy_drop: Largest allowed test accuracy loss in percentage points
+        calibration_batches: Batches of a class-stratified validation sample used
+            to calibrate static quantization
+        manifest_path: Dataset manifest to use (see dataset_index.manifest_path)
+
+    Returns:
+        dict: fp32 and INT8 test accuracy, model sizes and whether the artifact was written
+    """
+    # Quantized kernels only run on CPU
+    device = torch.device('cpu')
+    output_path = output_path or artifact_path(model_path, 'quantized')
+
+    _, val_dataset, test_dataset, class_names = build_datasets(data_dir, simulate, manifest_path=manifest_path)
+    calibration = calibration_subset(val_dataset, calibration_batches * batch_size)
+    val_loader = DataLoader(calibration, batch_size=batch_size, shuffle=False)
+    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
+
+    model = load_model(model_path, device)
+    fp32_acc = evaluate_accuracy(model, test_loader, device)
+    print(f"FP32 Test Accuracy: {fp32_acc:.2f}%", file=sys.stderr)
+
+    print(f"Quantizing ({mode})...", file=sys.stderr)
+    if mode == 'static':
+        quantized = quantize_static(model, val_loader, calibration_batches)
+    elif mode == 'dynamic':
+        quantized = quantize_dynamic(model)
+    else:
+        raise ValueError(f"Unknown quantization mode '{mode}', expected 'static' or 'dynamic'")
+    int8_acc = evaluate_accuracy(quantized, test_loader, device)
+    print(f"INT8 Test Accuracy: {int8_acc:.2f}%", file=sys.stderr)
+
+    report = {
+        'mode': mode,
+        'class_names': class_names,
+        'fp32_test_accuracy': fp32_acc,
+        'int8_test_accuracy': int8_acc,
+        'accuracy_drop': fp32_acc - int8_acc,
+        'max_accuracy_drop': max_accuracy_drop,
+        'fp32_size_mb': os.path.getsize(model_path) / 1024 ** 2,
+        'output_path': None,
+    }
+    if report['accuracy_drop'] > max_accuracy_drop:
+        print(f"❌ Accuracy dropped by {report['accuracy_drop']:.2f} points "
+              f"(limit {max_accuracy_drop:.2f}), INT8 model not written", file=sys.stderr)
+        return report
+
+    save_quantized(quantized, output_path)
+    report['output_path'] = output_path
+    report['int8_size_mb'] = os.path.getsize(output_path) / 1024 ** 2
+    print(f"✅ INT8 model saved to {output_path} ({report['int8_size_mb']:.1f} MB)", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='INT8 post-training quantization with an accuracy gate')
+    parser.add_argument('data_dir', type=str, help='Dataset root (same layout as for training)')
+    parser.add_argument('--model', type=str, default='./pretrained_models/bone_fracture_model.pth',
+                        help='Path to the trained fp32 model')
+    parser.add_argument('--output', type=str, help='Output path (default: <model>.int8.ts)')
+    parser.add_argument('--mode', type=str, default='static', choices=['static', 'dynamic'],
+                        help='Quantization mode')
+    parser.add_argument('--max-accuracy-drop', type=float, default=1.0,
+                        help='Refuse to write the model if test accuracy drops by more points than this')
+    parser.add_argument('--calibration-batches', type=int, default=10,
+                        help='Batches of a class-stratified validation sample used for static calibration')
+    parser.add_argument('--batch-size', type=int, default=32, help='Evaluation batch size')
+    parser.add_argument('--manifest', type=str, help='Dataset manifest to use (default: <data_dir>/manifest.json)')
+    parser.add_argument('--simulate', action='store_true', help='Use a tiny subset of the data')
+
+    args = parser.parse_args()
+
+    report = quantize_model(args.data_dir, args.model, args.output, args.mode, args.max_accuracy_drop,
+                            args.calibration_batches, args.batch_size, args.simulate, args.manifest)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['output_path'] else 1)
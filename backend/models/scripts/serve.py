@@ -0,0 +1,485 @@
+"""
+Persistent inference server for bone fracture prediction
+Loads the ResNet-50 classifier and the YOLOv8 detector once at startup and
+serves them over HTTP, so each request only pays for the forward pass
+"""
+
+import contextlib
+import os
+import threading
+
+import torch
+from flask import Flask, Response, jsonify, request, send_file
+from PIL import Image
+
+import instrumentation
+from batching import MicroBatcher
+from ensemble import ensemble_predict, parse_tta
+from image_io import decode_image
+from inference_backends import artifact_path
+from job_queue import JobQueue, QueueFull, check_callback_url
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache, sha256_bytes
+from predict_api import INPUT_SIZE, load_model, get_transform, predict_image, format_result
+from predict_yolo import load_yolo_model, detect_fractures
+from yolo_tiling import detect_tiled
+from visualization import DEFAULT_OUTPUT_DIR, VisualizationRenderer
+from worker_pool import InferencePool
+
+DEFAULT_CLASSIFIER_PATH = "./pretrained_models/bone_fracture_model.pth"
+DEFAULT_YOLO_PATH = "./runs/detect/bone_fracture_yolov8m/weights/best.pt"
+
+
+def error_response(message, status=500, **extra):
+    """JSON error body matching the shape returned by the prediction scripts."""
+    body = {
+        'error': message,
+        'message': message,
+        'prediction': None,
+        'confidence': 0,
+    }
+    body.update(extra)
+    return jsonify(body), status
+
+
+def read_upload():
+    """Raw bytes of the uploaded `image` form field, or None when missing."""
+    upload = request.files.get('image')
+    if upload is None:
+        return None
+    return upload.read()
+
+
+def query_flag(name):
+    """Whether a boolean query parameter such as ?timings=1 is set."""
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def respond(result, trace, timings, visualization=None):
+    if visualization is not None:
+        result = dict(result, visualization=visualization)
+    return jsonify(instrumentation.attach_timings(result, trace) if timings else result)
+
+
+def create_app(classifier_path=DEFAULT_CLASSIFIER_PATH, yolo_path=DEFAULT_YOLO_PATH,
+               max_batch_size=16, max_wait_ms=5.0, cache=None, backend='torch', num_threads=None,
+               metrics=True, visualization_dir=DEFAULT_OUTPUT_DIR, preload=False, memory_budget_mb=None,
+               tile_size=None, tile_overlap=0.2, tile_batch_size=8, job_workers=2, max_queued_jobs=64,
+               job_timeout_s=120.0, jobs_db=None, inference_workers=0, inter_op_threads=None,
+               callback_hosts=None):
+    """
+    Build the Flask app around a registry owning the classifier and detector
+
+    Models are loaded (and warmed up) on their first request unless `preload`
+    is set, reloaded when their weights file changes, and can be swapped via
+    POST /models/<name>/reload.
+
+    Args:
+        classifier_path: Path to the trained ResNet-50 weights
+        yolo_path: Path to the trained YOLOv8 weights (optional, /detect
+            answers 503 while the file does not exist)
+        max_batch_size: Largest micro-batch for /predict (1 disables batching)
+        max_wait_ms: How long a /predict request may wait for others to batch with
+        cache: Optional PredictionCache consulted before running either model
+        backend: Classifier backend ('torch', 'torchscript' or 'onnx')
+        num_threads: Intra-op threads for the classifier
+        metrics: Record per-stage latency metrics and expose them on /metrics
+        visualization_dir: Where figures requested with ?visualize=1 are rendered
+        preload: Load both models before serving instead of on first use
+        memory_budget_mb: Evict the least recently used idle model beyond this size
+        tile_size: Run /detect tile by tile (tiles of this many pixels) so large
+            radiographs are not downscaled to the YOLO input size
+        tile_overlap: Fraction of each tile shared with its neighbours
+        tile_batch_size: Tiles per forward pass
+        job_workers: Threads running jobs submitted to POST /jobs/<task>
+        max_queued_jobs: Waiting or running jobs beyond which POST /jobs answers 429
+        job_timeout_s: Default time limit of one job (?timeout= overrides it per job)
+        jobs_db: SQLite file keeping queued jobs across restarts (None: memory only)
+        inference_workers: Run /predict in this many worker processes sharing one
+            copy of the classifier weights (0 keeps it in the server process)
+        inter_op_threads: Inter-op threads for the classifier (onnx backend)
+        callback_hosts: Hosts job callbacks may be POSTed to; other hosts get a
+            400 (None: any host, as long as it resolves to public addresses)
+    """
+    app = Flask(__name__)
+    if metrics:
+        instrumentation.enable()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    transform = get_transform()
+
+    def load_classifier(path):
+        classifier = load_model(path, device, backend, num_threads, inter_op_threads)
+        # Warm-up pass so the first real request does not pay for lazy init
+        predict_image(classifier, Image.new('RGB', INPUT_SIZE), device, transform)
+        if cache is not None:
+            # Hash the weights now so requests do not pay for it
+            cache.weights_digest(path)
+        return classifier
+
+    def load_detector(path):
+        detector = load_yolo_model(path, device.type)
+        detect_fractures(detector, Image.new('RGB', (640, 640)), device.type)
+        if cache is not None:
+            cache.weights_digest(path)
+        return detector
+
+    registry = ModelRegistry(memory_budget_mb)
+    # The registry watches the file the backend runs, e.g. the .onnx rather than the .pth it came from
+    registry.register('classifier', load_classifier, artifact_path(classifier_path, backend))
+    registry.register('detector', load_detector, yolo_path)
+
+    def classify_batch(batch):
+        with registry.acquire('classifier') as classifier:
+            return classifier(batch)
+
+    pool = None
+    if inference_workers:
+        # Decode, preprocess and forward run in the workers, outside this process's GIL
+        pool = InferencePool(classifier_path, backend, inference_workers, num_threads,
+                             inter_op_threads=inter_op_threads)
+
+    def classifier_weights():
+        # The pool swaps weights itself, bypassing the registry
+        return artifact_path(pool.model_path if pool is not None else registry.path('classifier'), backend)
+
+    batcher = None
+    if max_batch_size > 1 and pool is None:
+        batcher = MicroBatcher(classify_batch, device, max_batch_size, max_wait_ms)
+    # Figures are only drawn when their URL is fetched, never on the request path
+    renderer = VisualizationRenderer()
+
+    def defer_visualization(kind, data, result):
+        if not query_flag('visualize'):
+            return None
+        suffix = 'prediction' if kind == 'classify' else 'detection'
+        filename = f"{sha256_bytes(data)[:32]}_{suffix}.png"
+        renderer.defer(kind, data, result, os.path.join(visualization_dir, filename))
+        return f"/visualizations/{filename}"
+
+    # Ultralytics predictors keep per-call state, so detection is serialized
+    detector_lock = threading.Lock()
+
+    if preload:
+        registry.get('classifier')
+        if os.path.exists(yolo_path):
+            registry.get('detector')
+    if not os.path.exists(yolo_path):
+        print(f"⚠️ YOLOv8 model not found at {yolo_path}, /detect answers 503 until it exists")
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        models = registry.stats()['models']
+        return jsonify({
+            'status': 'ok',
+            'device': str(device),
+            'classifier': classifier_weights(),
+            'backend': backend,
+            'detector': registry.path('detector') if os.path.exists(registry.path('detector')) else None,
+            'loaded': [name for name, entry in models.items() if entry['loaded']],
+        })
+
+    @app.route('/models', methods=['GET'])
+    def models():
+        return jsonify(registry.stats())
+
+    @app.route('/models/<name>/reload', methods=['POST'])
+    def reload_model(name):
+        if name not in ('classifier', 'detector'):
+            return error_response(f"Unknown model '{name}'", 404)
+        path = (request.get_json(silent=True) or {}).get('path')
+        try:
+            # In-flight requests finish on the old weights; new ones get the new weights
+            if name == 'classifier' and pool is not None:
+                return jsonify(pool.swap(path))
+            if name == 'classifier' and path:
+                path = artifact_path(path, backend)
+            return jsonify(registry.swap(name, path))
+        except Exception as e:
+            return error_response(f"Could not load {path or registry.path(name)}: {e}", 500)
+
+    @app.route('/stats', methods=['GET'])
+    def stats():
+        return jsonify({
+            'batching': batcher.stats() if batcher is not None else None,
+            'cache': cache.stats() if cache is not None else None,
+            'jobs': jobs.stats(),
+            'workers': pool.stats() if pool is not None else None,
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        registry = instrumentation.get_registry()
+        if registry is None:
+            return Response('metrics are disabled\n', status=404, mimetype='text/plain')
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/visualizations/<filename>', methods=['GET'])
+    def visualization(filename):
+        if os.path.basename(filename) != filename or not filename.endswith('.png'):
+            return error_response('Invalid visualization name', 400)
+        path = renderer.ensure(os.path.join(visualization_dir, filename))
+        if path is None:
+            return error_response('Visualization not found', 404)
+        return send_file(os.path.abspath(path), mimetype='image/png')
+
+    def classify(data, trace):
+        """Classifier result for uploaded image bytes, from the cache when possible; finishes `trace`."""
+        key = None
+        if cache is not None:
+            with trace.stage('cache_lookup'):
+                key = cache.make_key(data, classifier_weights(), task='classify', backend=backend)
+                cached = cache.get(key)
+            if cached is not None:
+                trace.finish(outcome='cache_hit')
+                return cached
+
+        if pool is not None:
+            result, stages = pool.predict(data)
+            for stage, seconds in stages.items():
+                trace.add_stage(stage, seconds)
+            trace.image(result.pop('original_size'))
+            if cache is not None:
+                cache.put(key, result)
+            trace.finish()
+            return result
+
+        # Decoded in memory straight to the classifier's input size (no temporary file)
+        with trace.stage('decode'):
+            image, original_size = decode_image(data, size=INPUT_SIZE)
+        trace.image(original_size)
+        if batcher is None:
+            with registry.acquire('classifier') as classifier:
+                result = predict_image(classifier, image, device, transform, trace=trace)
+        else:
+            # Preprocess in the request thread, run the forward pass batched
+            with trace.stage('preprocess'):
+                image_tensor = transform(image)
+            # Includes the time spent waiting for the batch to fill
+            with trace.stage('forward'):
+                probabilities = batcher.predict(image_tensor)
+            result = format_result(probabilities)
+        if cache is not None:
+            cache.put(key, result)
+        trace.finish()
+        return result
+
+    def detect_boxes(data, trace):
+        """Detector result for uploaded image bytes, from the cache when possible; finishes `trace`."""
+        yolo_path = registry.path('detector')
+        key = None
+        if cache is not None:
+            with trace.stage('cache_lookup'):
+                tiling = {'tile_size': tile_size, 'tile_overlap': tile_overlap} if tile_size else {}
+                key = cache.make_key(data, yolo_path, task='detect', conf=0.25, iou=0.45, **tiling)
+                cached = cache.get(key)
+            if cached is not None:
+                trace.finish(outcome='cache_hit')
+                return cached
+
+        with trace.stage('decode'):
+            image, _ = decode_image(data)
+        with trace.stage('lock_wait'):
+            detector_lock.acquire()
+        try:
+            with registry.acquire('detector') as detector:
+                if tile_size:
+                    result = detect_tiled(detector, image, device.type, 0.25, 0.45, tile_size, tile_overlap,
+                                          tile_batch_size, trace=trace)
+                else:
+                    result = detect_fractures(detector, image, device.type, conf=0.25, iou=0.45, trace=trace)
+        finally:
+            detector_lock.release()
+        if cache is not None:
+            cache.put(key, result)
+        trace.finish()
+        return result
+
+    def ensemble(data, tta, trace):
+        """Fused classifier + detector result (classifier only without YOLO weights); finishes `trace`."""
+        with_detector = os.path.exists(registry.path('detector'))
+        # Decoded once at full resolution for both models
+        with trace.stage('decode'):
+            image, original_size = decode_image(data)
+        trace.image(original_size)
+        with registry.acquire('classifier') as classifier, \
+                (registry.acquire('detector') if with_detector else contextlib.nullcontext()) as detector:
+            result = ensemble_predict(image, classifier, device, detector, tta, transform,
+                                      detector_device=device.type, detector_lock=detector_lock, trace=trace)
+        trace.finish()
+        return result
+
+    def run_job(task, data, params):
+        timings = params.get('timings', False)
+        trace = instrumentation.start_trace(f'{task}_job', force=timings)
+        if task == 'detect' and not os.path.exists(registry.path('detector')):
+            trace.finish(outcome='unavailable')
+            return {'error': f"Model file not found at {registry.path('detector')}"}
+        try:
+            if task == 'ensemble':
+                result = ensemble(data, parse_tta(params.get('tta')), trace)
+            else:
+                result = classify(data, trace) if task == 'predict' else detect_boxes(data, trace)
+        except Exception as e:
+            trace.finish(error=e)
+            raise
+        return instrumentation.attach_timings(result, trace) if timings else result
+
+    jobs = JobQueue(run_job, job_workers, max_queued_jobs, job_timeout_s, jobs_db, callback_hosts=callback_hosts)
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        timings = query_flag('timings')
+        trace = instrumentation.start_trace('predict', force=timings)
+        try:
+            data = read_upload()
+            if data is None:
+                trace.finish(outcome='bad_request')
+                return error_response("No image uploaded (expected form field 'image')", 400,
+                                      probabilities={})
+            result = classify(data, trace)
+            return respond(result, trace, timings, defer_visualization('classify', data, result))
+        except Exception as e:
+            trace.finish(error=e)
+            return error_response(str(e), probabilities={})
+
+    @app.route('/detect', methods=['POST'])
+    def detect():
+        yolo_path = registry.path('detector')
+        if not os.path.exists(yolo_path):
+            return error_response(f'Model file not found at {yolo_path}', 503, detections=[])
+        timings = query_flag('timings')
+        trace = instrumentation.start_trace('detect', force=timings)
+        try:
+            data = read_upload()
+            if data is None:
+                trace.finish(outcome='bad_request')
+                return error_response("No image uploaded (expected form field 'image')", 400,
+                                      detections=[])
+            result = detect_boxes(data, trace)
+            return respond(result, trace, timings, defer_visualization('detect', data, result))
+        except Exception as e:
+            trace.finish(error=e)
+            return error_response(str(e), detections=[])
+
+    @app.route('/ensemble', methods=['POST'])
+    def ensemble_endpoint():
+        timings = query_flag('timings')
+        trace = instrumentation.start_trace('ensemble', force=timings)
+        try:
+            tta = parse_tta(request.args.get('tta'))
+        except ValueError as e:
+            trace.finish(outcome='bad_request')
+            return error_response(str(e), 400, probabilities={}, detections=[])
+        try:
+            data = read_upload()
+            if data is None:
+                trace.finish(outcome='bad_request')
+                return error_response("No image uploaded (expected form field 'image')", 400,
+                                      probabilities={}, detections=[])
+            return respond(ensemble(data, tta, trace), trace, timings)
+        except Exception as e:
+            trace.finish(error=e)
+            return error_response(str(e), probabilities={}, detections=[])
+
+    @app.route('/jobs/<task>', methods=['POST'])
+    def submit_job(task):
+        if task not in ('predict', 'detect', 'ensemble'):
+            return error_response(f"Unknown task '{task}', expected 'predict', 'detect' or 'ensemble'", 404)
+        if task == 'detect' and not os.path.exists(registry.path('detector')):
+            return error_response(f"Model file not found at {registry.path('detector')}", 503)
+        data = read_upload()
+        if data is None:
+            return error_response("No image uploaded (expected form field 'image')", 400)
+        callback_url = request.form.get('callback_url') or request.args.get('callback_url')
+        if callback_url:
+            try:
+                check_callback_url(callback_url, callback_hosts)
+            except ValueError as e:
+                return error_response(str(e), 400)
+        timeout_s = request.args.get('timeout', type=float)
+        params = {'timings': query_flag('timings')}
+        if task == 'ensemble':
+            try:
+                params['tta'] = list(parse_tta(request.args.get('tta')))
+            except ValueError as e:
+                return error_response(str(e), 400)
+        try:
+            job = jobs.submit(task, data, params, callback_url, timeout_s)
+        except QueueFull as e:
+            # Backpressure: the client should retry later instead of piling up work
+            body, status = error_response(f'Job queue is full: {e}', 429)
+            return body, status, {'Retry-After': '5'}
+        status_url = f"/jobs/{job['job_id']}"
+        return jsonify({'job_id': job['job_id'], 'status': job['status'], 'status_url': status_url}), 202, \
+            {'Location': status_url}
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return error_response(f"Unknown job '{job_id}'", 404)
+        return jsonify(job)
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Persistent bone fracture inference server')
+    parser.add_argument('--model', type=str, default=DEFAULT_CLASSIFIER_PATH,
+                        help='Path to the trained ResNet-50 model')
+    parser.add_argument('--backend', type=str, default='torch',
+                        choices=['torch', 'torchscript', 'onnx', 'quantized'],
+                        help='Classifier backend '
+                             '(torchscript/onnx need export_model.py, quantized needs quantize_model.py)')
+    parser.add_argument('--threads', type=int, help='Intra-op threads for the classifier')
+    parser.add_argument('--inter-op-threads', type=int, help='Inter-op threads for the classifier (onnx backend)')
+    parser.add_argument('--yolo-model', type=str, default=DEFAULT_YOLO_PATH,
+                        help='Path to the trained YOLOv8 model')
+    parser.add_argument('--max-batch-size', type=int, default=16,
+                        help='Largest micro-batch for /predict (1 disables batching)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='Longest time a /predict request waits for a batch to fill')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='In-memory prediction cache entries (0 disables caching)')
+    parser.add_argument('--cache-db', type=str,
+                        help='SQLite file for the on-disk prediction cache tier')
+    parser.add_argument('--cache-db-mb', type=int, default=256,
+                        help='Size budget of the on-disk cache tier in MB')
+    parser.add_argument('--no-metrics', action='store_true',
+                        help='Disable per-stage latency metrics and the /metrics endpoint')
+    parser.add_argument('--visualization-dir', type=str, default=DEFAULT_OUTPUT_DIR,
+                        help='Where figures requested with ?visualize=1 are rendered')
+    parser.add_argument('--tile-size', type=int,
+                        help='Tiled /detect for large radiographs: tile side in pixels (e.g. 640)')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='Fraction of overlap between tiles')
+    parser.add_argument('--tile-batch', type=int, default=8, help='Tiles per forward pass')
+    parser.add_argument('--preload', action='store_true',
+                        help='Load both models at startup instead of on their first request')
+    parser.add_argument('--memory-budget-mb', type=int,
+                        help='Evict the least recently used idle model when loaded models exceed this')
+    parser.add_argument('--job-workers', type=int, default=2, help='Threads running queued /jobs')
+    parser.add_argument('--max-queued-jobs', type=int, default=64,
+                        help='Queued or running jobs beyond which POST /jobs answers 429')
+    parser.add_argument('--job-timeout', type=float, default=120.0, help='Default per-job time limit in seconds')
+    parser.add_argument('--jobs-db', type=str, help='SQLite file so queued jobs survive a restart')
+    parser.add_argument('--callback-hosts', type=str, nargs='+',
+                        help='Hosts job callbacks may be POSTed to (default: any host with public addresses only)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Run the classifier in N worker processes sharing one copy of the weights, '
+                             'each pinned to its own cores (--threads sets threads per worker)')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=5000, help='Port to listen on')
+
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache_size > 0:
+        cache = PredictionCache(args.cache_size, args.cache_db, args.cache_db_mb * 1024 * 1024)
+    app = create_app(args.model, args.yolo_model, args.max_batch_size, args.max_wait_ms, cache,
+                     args.backend, args.threads, not args.no_metrics, args.visualization_dir,
+                     args.preload, args.memory_budget_mb, args.tile_size, args.tile_overlap, args.tile_batch,
+                     args.job_workers, args.max_queued_jobs, args.job_timeout, args.jobs_db, args.workers,
+                     args.inter_op_threads, args.callback_hosts)
+    app.run(host=args.host, port=args.port, threaded=True)
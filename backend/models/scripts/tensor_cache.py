@@ -0,0 +1,153 @@
+"""
+Preprocessed tensor cache for training
+Decodes and resizes an ImageFolder tree once into a memory-mapped uint8 array,
+so later epochs only pay for the cheap random augmentations and normalization
+instead of re-decoding every JPEG/PNG
+"""
+
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from torchvision import datasets, transforms
+
+from image_io import load_image
+
+CACHE_VERSION = 2
+IMAGES_FILE = 'images.npy'
+LABELS_FILE = 'labels.npy'
+INDEX_FILE = 'index.json'
+
+
+def source_fingerprint(samples, image_size):
+    """Hash of every file's path, size and mtime plus the cache layout."""
+    digest = hashlib.sha256(f'v{CACHE_VERSION}|{image_size}'.encode())
+    for path, label in samples:
+        stat = os.stat(path)
+        digest.update(f'{path}|{label}|{stat.st_size}|{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def _decode(args):
+    path, image_size = args
+    # Same decoding as inference: JPEGs are downscaled by the decoder, 16-bit images windowed
+    return np.asarray(load_image(path, size=(image_size, image_size)), dtype=np.uint8)
+
+
+def build_tensor_cache(root, cache_dir, image_size=224, num_workers=None, force=False, samples=None, classes=None):
+    """
+    Decode and resize every image of the ImageFolder at `root` into `cache_dir`
+
+    The cache is rebuilt only when files under `root` were added, removed or
+    modified since it was written (or when `force` is set). `samples` and
+    `classes` (e.g. one split of a dataset manifest) replace the ImageFolder
+    scan of `root`.
+
+    Returns:
+        dict: the cache index (classes, sample paths, fingerprint, shape)
+    """
+    if samples is None:
+        folder = datasets.ImageFolder(root=root)
+        samples, classes = folder.samples, folder.classes
+    fingerprint = source_fingerprint(samples, image_size)
+
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not force and os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('fingerprint') == fingerprint:
+            print(f"Tensor cache up to date: {cache_dir}")
+            return index
+        print(f"Source folder changed, rebuilding tensor cache: {cache_dir}")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    shape = (len(samples), image_size, image_size, 3)
+    print(f"Building tensor cache for {shape[0]} images in {cache_dir}...")
+    images = np.lib.format.open_memmap(os.path.join(cache_dir, IMAGES_FILE), mode='w+',
+                                       dtype=np.uint8, shape=shape)
+    with Pool(num_workers) as pool:
+        jobs = ((path, image_size) for path, _ in samples)
+        for i, array in enumerate(pool.imap(_decode, jobs, chunksize=16)):
+            images[i] = array
+    images.flush()
+    del images
+    np.save(os.path.join(cache_dir, LABELS_FILE), np.array([label for _, label in samples], dtype=np.int64))
+
+    index = {
+        'version': CACHE_VERSION,
+        'fingerprint': fingerprint,
+        'root': os.path.abspath(root),
+        'classes': classes,
+        'image_size': image_size,
+        'num_samples': shape[0],
+        'paths': [path for path, _ in samples],
+    }
+    # Written last, so an interrupted build is never mistaken for a valid cache
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    return index
+
+
+class CachedImageDataset(Dataset):
+    """
+    Dataset over a tensor cache built by build_tensor_cache
+
+    Images are read straight from the memory map; only `augment` (applied to
+    uint8 CHW tensors) and normalization run per sample.
+
+    Args:
+        cache_dir: Directory written by build_tensor_cache
+        augment: Optional transform for uint8 CHW tensors (e.g. flips, rotation)
+    """
+
+    def __init__(self, cache_dir, augment=None):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.classes = index['classes']
+        self.paths = index['paths']
+        self.targets = np.load(os.path.join(cache_dir, LABELS_FILE)).tolist()
+        self.augment = augment
+        self.normalize = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        self._images = None
+
+    @property
+    def images(self):
+        # Opened lazily so each DataLoader worker maps the file itself instead
+        # of receiving a pickled copy of the array
+        if self._images is None:
+            self._images = np.load(os.path.join(self.cache_dir, IMAGES_FILE), mmap_mode='c')
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        image = torch.from_numpy(self.images[index]).permute(2, 0, 1)
+        if self.augment is not None:
+            image = self.augment(image)
+        return self.normalize(image.float().div_(255)), self.targets[index]
+
+
+def cached_image_folder(root, cache_dir, train=False, image_size=224, samples=None, classes=None):
+    """
+    Drop-in replacement for the ImageFolder datasets built in external_trainer
+
+    Builds (or reuses) the cache for `root` and applies the same random flip
+    and rotation as the training transform when `train` is set.
+    """
+    build_tensor_cache(root, cache_dir, image_size, samples=samples, classes=classes)
+    augment = transforms.Compose([
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(10),
+    ]) if train else None
+    return CachedImageDataset(cache_dir, augment)
@@ -25,30 +25,49 @@ def download_dataset_if_needed(data_path, kaggle_dataset):
         print("Dataset found locally. Skipping download.")
 
 if __name__ == "__main__":
-    print("✅ Starting bone fracture classification training...")
+    import argparse
 
+    parser = argparse.ArgumentParser(description='Train the bone fracture classifier or the cascade screener')
     # Path to your dataset folder after unzipping
-    data_path = "C:\Data\dataset\Bone_Fracture_Binary\Bone_Fracture_Binary_Classification\Bone_Fracture_Binary_Classification\Bone_Fracture_Binary_Classification"
-    
+    parser.add_argument('--data-dir', type=str,
+                        default=r"C:\Data\dataset\Bone_Fracture_Binary\Bone_Fracture_Binary_Classification\Bone_Fracture_Binary_Classification\Bone_Fracture_Binary_Classification",
+                        help='Dataset root (downloaded from Kaggle if it has no train folder)')
+    parser.add_argument('--arch', type=str, choices=['resnet18', 'resnet34', 'resnet50'],
+                        help='Network to fine-tune (default: resnet50, resnet18 with --simulate); '
+                             'a resnet18 is the screener used by cascade.py')
+    parser.add_argument('--model-save-path', type=str,
+                        help='Where to save the model (default: ./pretrained_models/bone_fracture_screener.pth '
+                             'for resnet18, ./pretrained_models/bone_fracture_model.pth otherwise)')
+    parser.add_argument('--epochs', type=int, default=5, help='Number of epochs')
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch size')
+    parser.add_argument('--manifest', type=str, help='Dataset manifest to use (default: <data_dir>/manifest.json)')
+    # To quickly simulate training, enable simulation mode
+    parser.add_argument('--simulate', action='store_true', help='One epoch on a small subset of the data')
+    args = parser.parse_args()
+
+    print("✅ Starting bone fracture classification training...")
+
     # Kaggle dataset slug
     kaggle_dataset = "bmadushanirodrigo/fracture-multi-region-x-ray-data"
 
-    download_dataset_if_needed(data_path, kaggle_dataset)
-    
+    download_dataset_if_needed(args.data_dir, kaggle_dataset)
+
     # Directory for saving models
     save_dir = "./pretrained_models"
-    os.makedirs(save_dir, exist_ok=True)
-    model_save_path = os.path.join(save_dir, "bone_fracture_model.pth")
-    
-    # To quickly simulate training, enable simulation mode by setting simulate=True
+    model_name = "bone_fracture_screener.pth" if args.arch == 'resnet18' else "bone_fracture_model.pth"
+    model_save_path = args.model_save_path or os.path.join(save_dir, model_name)
+    os.makedirs(os.path.dirname(model_save_path) or '.', exist_ok=True)
+
     model, test_accuracy = train_model(
-        data_dir=data_path,
+        data_dir=args.data_dir,
         model_save_path=model_save_path,
-        epochs=5,
-        batch_size=32,
-        simulate=False  # Enable simulation mode for faster testing
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        simulate=args.simulate,
+        arch=args.arch,
+        manifest_path=args.manifest
     )
-    
+
     print(f"✅ Training complete! Final test accuracy: {test_accuracy:.2f}%")
     print(f"✅ Model saved to: {model_save_path}")
 #
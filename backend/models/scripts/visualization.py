@@ -0,0 +1,259 @@
+"""
+Prediction visualizations rendered off the hot path
+Draws the classifier confidence chart and YOLO bounding boxes with the
+non-interactive Agg canvas, either in a background thread pool or lazily the
+first time the PNG is requested, so predictions return without waiting on
+matplotlib (which is only imported once something is drawn)
+"""
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_OUTPUT_DIR = "./predictions"
+VISUALIZE_MODES = ('sync', 'async', 'lazy', 'off')
+# Longest side of the image drawn in a figure; a 1000px-wide figure never shows more
+DISPLAY_MAX_SIDE = 1024
+
+# An image already shrunk for display, with the size of the original it stands for
+DisplayImage = namedtuple('DisplayImage', ['image', 'original_size'])
+
+
+def visualization_path(image_path, output_dir=DEFAULT_OUTPUT_DIR, suffix='prediction'):
+    """./predictions/<image name>_<suffix>.png for an input image path."""
+    image_name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(output_dir, f"{image_name}_{suffix}.png")
+
+
+def to_image(source, max_side=DISPLAY_MAX_SIDE):
+    """
+    Image path, raw encoded bytes, PIL image or DisplayImage -> display-sized RGB PIL image
+
+    Returns:
+        tuple: (image, (width, height) of the original)
+    """
+    from image_io import decode_image
+
+    if isinstance(source, DisplayImage):
+        return source.image, source.original_size
+    return decode_image(source, max_side=max_side)
+
+
+def _new_figure(figsize):
+    # Figures are built on the Agg canvas directly instead of through pyplot,
+    # so nothing is registered globally and nothing needs plt.close()
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _save(figure, output_path):
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    figure.savefig(output_path)
+    return output_path
+
+
+def render_classification(image, result, output_path):
+    """Input image next to the per-class confidence bars (the predict.py figure)."""
+    image, _ = to_image(image)
+    class_names = list(result['probabilities'])
+    values = [result['probabilities'][c] for c in class_names]
+
+    figure = _new_figure((10, 5))
+
+    # Display the image
+    ax = figure.add_subplot(1, 2, 1)
+    ax.imshow(image)
+    ax.set_title('Input Image')
+    ax.axis('off')
+
+    # Display the probabilities, colored by prediction
+    ax = figure.add_subplot(1, 2, 2)
+    bars = ax.bar(class_names, values)
+    ax.set_title('Prediction Confidence')
+    ax.set_ylabel('Confidence (%)')
+    ax.set_ylim(0, 100)
+    for i, bar in enumerate(bars):
+        bar.set_color('green' if class_names[i] == result['prediction'] else 'red')
+    for i, v in enumerate(values):
+        ax.text(i, v + 2, f"{v:.1f}%", ha='center')
+
+    figure.tight_layout()
+    return _save(figure, output_path)
+
+
+def render_detections(image, result, output_path):
+    """Input image with the YOLO boxes and class/confidence labels drawn on it."""
+    from matplotlib.patches import Rectangle
+
+    image, (width, height) = to_image(image)
+    figure = _new_figure((10, max(2.0, min(10.0, 10 * height / width))))
+    ax = figure.add_subplot(1, 1, 1)
+    # Stretch the downscaled image over the original pixel grid the boxes refer to
+    ax.imshow(image, extent=(0, width, height, 0))
+    ax.axis('off')
+    ax.set_title(f"{result['prediction']} ({result['num_detections']} detections)")
+
+    for detection in result['detections']:
+        bbox = detection['bbox']
+        ax.add_patch(Rectangle((bbox['x1'], bbox['y1']), bbox['x2'] - bbox['x1'], bbox['y2'] - bbox['y1'],
+                               fill=False, edgecolor='red', linewidth=2))
+        ax.text(bbox['x1'], bbox['y1'] - 4, f"{detection['class']} {detection['confidence']:.1f}%",
+                color='white', fontsize=9, bbox={'facecolor': 'red', 'alpha': 0.7, 'pad': 1, 'edgecolor': 'none'})
+
+    figure.tight_layout()
+    return _save(figure, output_path)
+
+
+RENDERERS = {
+    'classify': render_classification,
+    'detect': render_detections,
+}
+
+
+class VisualizationRenderer:
+    """
+    Renders prediction figures in background threads or on demand
+
+    Deferred renders do not keep the caller's image in memory: encoded bytes
+    are spooled to a private temporary directory until the figure is
+    rendered, and decoded images are shrunk to display size right away.
+
+    Args:
+        max_workers: Threads rendering submitted figures
+        max_pending: Deferred (lazy) renders kept before the oldest are dropped
+        max_pending_bytes: Spooled and in-memory image bytes kept for deferred
+            renders before the oldest are dropped
+    """
+
+    def __init__(self, max_workers=1, max_pending=256, max_pending_bytes=128 * 1024 ** 2):
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='visualize')
+        self._pending = OrderedDict()
+        self._pending_bytes = 0
+        # Removed by close() or, at the latest, when the process exits
+        self._spool = None
+        self._lock = threading.Lock()
+
+    def submit(self, kind, image, result, output_path):
+        """
+        Render in the background
+
+        Returns:
+            Future: resolves to `output_path` once the PNG is written
+        """
+        return self._executor.submit(RENDERERS[kind], image, result, output_path)
+
+    def defer(self, kind, image, result, output_path):
+        """Remember what to draw; the PNG is only rendered when `ensure` asks for it."""
+        source, size = self._keep(image)
+        with self._lock:
+            dropped = [self._pending.pop(output_path)] if output_path in self._pending else []
+            self._pending[output_path] = (kind, source, result, size)
+            self._pending_bytes += size - sum(job[3] for job in dropped)
+            while len(self._pending) > self.max_pending or \
+                    (self._pending_bytes > self.max_pending_bytes and len(self._pending) > 1):
+                job = self._pending.popitem(last=False)[1]
+                self._pending_bytes -= job[3]
+                dropped.append(job)
+        for job in dropped:
+            self._discard(job[1])
+
+    def _keep(self, image):
+        """What a deferred render holds on to for `image`, and its size in bytes."""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            with self._lock:
+                if self._spool is None:
+                    self._spool = tempfile.TemporaryDirectory(prefix='meditrack-visualize-')
+                spool_dir = self._spool.name
+            fd, path = tempfile.mkstemp(suffix='.img', dir=spool_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image)
+            return path, len(image)
+        if isinstance(image, str):
+            # The caller's own file: nothing to keep
+            return image, 0
+        image, original_size = to_image(image)
+        return DisplayImage(image, original_size), image.width * image.height * len(image.getbands())
+
+    def _discard(self, source):
+        spool = self._spool
+        if isinstance(source, str) and spool is not None and os.path.dirname(source) == spool.name:
+            try:
+                os.remove(source)
+            except FileNotFoundError:
+                pass
+
+    def ensure(self, output_path):
+        """
+        Path of a rendered PNG, rendering a deferred one first if needed
+
+        Returns:
+            str: `output_path`, or None when nothing was rendered or deferred for it
+        """
+        with self._lock:
+            job = self._pending.pop(output_path, None)
+            if job is not None:
+                self._pending_bytes -= job[3]
+        if job is None:
+            return output_path if os.path.exists(output_path) else None
+        kind, source, result, _ = job
+        try:
+            return RENDERERS[kind](source, result, output_path)
+        finally:
+            self._discard(source)
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        with self._lock:
+            self._pending.clear()
+            self._pending_bytes = 0
+            spool, self._spool = self._spool, None
+        if spool is not None:
+            spool.cleanup()
+
+
+_default_renderer = None
+_default_lock = threading.Lock()
+
+
+def get_renderer():
+    """Process-wide renderer shared by the prediction entry points."""
+    global _default_renderer
+    with _default_lock:
+        if _default_renderer is None:
+            _default_renderer = VisualizationRenderer()
+        return _default_renderer
+
+
+def visualize(kind, image, result, output_path, mode='async', renderer=None):
+    """
+    Render a prediction figure according to `mode`
+
+    Args:
+        kind: 'classify' or 'detect'
+        mode: 'sync' renders before returning, 'async' in the background,
+            'lazy' only once `renderer.ensure(output_path)` is called, 'off' never
+
+    Returns:
+        Future or None: completes when the PNG is written (None for 'lazy'/'off')
+    """
+    if mode == 'off':
+        return None
+    renderer = renderer or get_renderer()
+    if mode == 'sync':
+        future = Future()
+        future.set_result(RENDERERS[kind](image, result, output_path))
+        return future
+    if mode == 'async':
+        return renderer.submit(kind, image, result, output_path)
+    if mode == 'lazy':
+        renderer.defer(kind, image, result, output_path)
+        return None
+    raise ValueError(f"Unknown visualize mode '{mode}', expected one of {VISUALIZE_MODES}")
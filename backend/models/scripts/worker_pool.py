@@ -0,0 +1,298 @@
+"""
+Multi-process classifier workers sharing one copy of the weights
+The parent loads the ResNet-50 once and moves its tensors into shared memory;
+every worker process maps the same pages instead of loading its own copy.
+Workers decode, preprocess and run the forward pass outside the parent's GIL,
+each pinned to its own slice of cores with a matching torch thread count
+"""
+
+import itertools
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+# Imported once by the fork server, so workers start from warm, shared pages
+PRELOAD_MODULES = ['torch', 'torchvision', 'predict_api', 'image_io']
+# A task in flight on a worker that died is retried this many times before it fails
+# (an image that crashes the decoder would otherwise take down every worker in turn)
+MAX_TASK_RETRIES = 1
+
+
+def core_slices(num_workers, cores=None):
+    """Split the usable cores into `num_workers` contiguous slices (shared round-robin if too few)."""
+    if cores is None:
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else \
+            list(range(os.cpu_count() or 1))
+    if len(cores) < num_workers:
+        return [[cores[i % len(cores)]] for i in range(num_workers)]
+    size, extra = divmod(len(cores), num_workers)
+    slices, start = [], 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def _worker_main(index, model_path, backend, cores, num_threads, inter_op_threads, tasks, results):
+    """
+    Worker loop: ('predict', task_id, image bytes) in, (task_id, result, error, stages) out
+
+    With the 'torch' backend the model arrives as a ('swap', task_id, model)
+    message: queues pass tensor storages as shared-memory handles, not copies.
+    """
+    import torch
+    from image_io import decode_image
+    from instrumentation import Trace
+    from predict_api import INPUT_SIZE, get_transform, load_model, predict_image
+
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+    device = torch.device('cpu')
+    model = None
+    if backend != 'torch':
+        # Exported backends cannot share their weights: each worker loads its own
+        model = load_model(model_path, device, backend, num_threads, inter_op_threads)
+    transform = get_transform()
+
+    while True:
+        message = tasks.get()
+        if message is None:
+            return
+        kind, task_id, payload = message
+        if kind == 'swap':
+            model = payload
+            results.put((task_id, None, None, {}))
+            continue
+        trace = Trace(f'worker{index}')
+        try:
+            with trace.stage('decode'):
+                image, original_size = decode_image(payload, size=INPUT_SIZE)
+            result = predict_image(model, image, device, transform, trace=trace)
+            results.put((task_id, dict(result, original_size=original_size), None, trace.stages))
+        except Exception as e:
+            results.put((task_id, None, f'{type(e).__name__}: {e}', trace.stages))
+
+
+class InferencePool:
+    """
+    Classifier served by `num_workers` processes sharing the parent's weights
+
+    Args:
+        model_path: Trained classifier checkpoint (or exported graph for other backends)
+        backend: 'torch' shares one copy of the weights; exported backends are
+            loaded once per worker
+        num_workers: Worker processes (default: one per 4 usable cores)
+        threads_per_worker: Torch intra-op threads per worker (default: its core count)
+        inter_op_threads: Inter-op threads per worker (onnx backend)
+        pin_cores: Pin every worker to its own slice of cores
+    """
+
+    def __init__(self, model_path, backend='torch', num_workers=None, threads_per_worker=None, pin_cores=True,
+                 inter_op_threads=None):
+        cores = core_slices(1)[0]
+        self.num_workers = num_workers or max(1, len(cores) // 4)
+        self.model_path = model_path
+        self.backend = backend
+        self.slices = core_slices(self.num_workers, cores)
+        self.threads = [threads_per_worker or len(cores_) for cores_ in self.slices]
+        self.pin_cores = pin_cores
+        self.inter_op_threads = inter_op_threads
+
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        if 'forkserver' in methods:
+            self._context.set_forkserver_preload(PRELOAD_MODULES)
+
+        self._model = self._load_shared(model_path)
+        self._results = self._context.Queue()
+        self._lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+        self._pending = {}
+        self._in_flight = [set() for _ in range(self.num_workers)]
+        self._completed = [0] * self.num_workers
+        self._task_ids = itertools.count()
+        self._closed = False
+
+        self._tasks = [None] * self.num_workers
+        self._processes = [None] * self.num_workers
+        start = time.perf_counter()
+        for index in range(self.num_workers):
+            self._start_worker(index)
+        print(f"Started {self.num_workers} inference workers in {time.perf_counter() - start:.1f}s "
+              f"(cores per worker: {[len(s) for s in self.slices]})", file=sys.stderr)
+
+        self._collector = threading.Thread(target=self._collect, name='worker-results', daemon=True)
+        self._collector.start()
+
+    def _load_shared(self, model_path):
+        if self.backend != 'torch':
+            return None
+        import torch
+        from predict_api import load_model
+
+        model = load_model(model_path, torch.device('cpu'))
+        # Parameters move to shared memory; workers receive handles to the same pages
+        model.share_memory()
+        return model
+
+    def _start_worker(self, index):
+        self._tasks[index] = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main, name=f'inference-worker-{index}', daemon=True,
+            args=(index, self.model_path, self.backend, self.slices[index] if self.pin_cores else None,
+                  self.threads[index], self.inter_op_threads, self._tasks[index], self._results))
+        process.start()
+        self._processes[index] = process
+        if self._model is not None:
+            self._send_model(index, self._model)
+
+    def _send_model(self, index, model):
+        """Queue the shared model for a worker; the future resolves once it switched."""
+        future = Future()
+        with self._lock:
+            task_id = next(self._task_ids)
+            self._pending[task_id] = (future, index, None, 0)
+            self._in_flight[index].add(task_id)
+        self._tasks[index].put(('swap', task_id, model))
+        return future
+
+    def submit(self, data):
+        """
+        Classify encoded image bytes in a worker
+
+        Returns:
+            Future: resolves to (result dict, {stage: seconds} measured in the worker)
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('InferencePool has been closed')
+            # Least loaded worker; ties go to the lowest index
+            index = min(range(self.num_workers), key=lambda i: len(self._in_flight[i]))
+            task_id = next(self._task_ids)
+            self._pending[task_id] = (future, index, data, 0)
+            self._in_flight[index].add(task_id)
+        self._tasks[index].put(('predict', task_id, data))
+        return future
+
+    def predict(self, data, timeout=None):
+        return self.submit(data).result(timeout)
+
+    def swap(self, model_path=None):
+        """
+        Load new weights once and hand them to every worker
+
+        Tasks already queued on a worker run on the old weights. Waits until
+        every worker has switched; a worker that dies meanwhile is restarted on
+        the new weights. If a worker cannot be switched, every worker goes back
+        to the previous weights and the error is raised, so the pool is never
+        left serving a mix of both.
+        """
+        model_path = model_path or self.model_path
+        if self.backend != 'torch':
+            raise RuntimeError("Swapping weights is only supported for the 'torch' backend")
+        model = self._load_shared(model_path)
+        with self._swap_lock:
+            previous = self._model
+            # Workers restarted from here on come up on the new weights
+            self._model = model
+            try:
+                self._switch_all(model)
+            except RuntimeError:
+                self._model = previous
+                self._switch_all(previous)
+                raise
+            self.model_path = model_path
+        return self.stats()
+
+    def _switch_all(self, model):
+        """Switch every worker to `model`, re-sending it once to a worker that died before acknowledging."""
+        futures = [self._send_model(index, model) for index in range(self.num_workers)]
+        for index, future in enumerate(futures):
+            try:
+                future.result()
+            except RuntimeError:
+                # The replacement was started with self._model; this waits for it to switch
+                self._send_model(index, model).result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.num_workers,
+                'backend': self.backend,
+                'model_path': self.model_path,
+                'alive': [p.is_alive() for p in self._processes],
+                'pids': [p.pid for p in self._processes],
+                'cores': self.slices if self.pin_cores else None,
+                'threads': self.threads,
+                'in_flight': [len(tasks) for tasks in self._in_flight],
+                'completed': list(self._completed),
+            }
+
+    def _collect(self):
+        while True:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                return
+            if message:
+                self._resolve(*message)
+            # On every iteration: results from the other workers must not delay noticing a dead one
+            if self._closed:
+                return
+            self._check_workers()
+
+    def _resolve(self, task_id, result, error, stages):
+        with self._lock:
+            future, index, _, _ = self._pending.pop(task_id, (None, None, None, None))
+            if future is None:
+                return
+            self._in_flight[index].discard(task_id)
+            self._completed[index] += 1
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result((result, stages))
+
+    def _check_workers(self):
+        """Restart dead workers and re-queue their predictions on the replacement."""
+        for index, process in enumerate(self._processes):
+            if process.is_alive():
+                continue
+            retry, failed = [], []
+            with self._lock:
+                for task_id in self._in_flight[index]:
+                    future, _, data, attempts = self._pending[task_id]
+                    if data is not None and attempts < MAX_TASK_RETRIES:
+                        self._pending[task_id] = (future, index, data, attempts + 1)
+                        retry.append((task_id, data))
+                    else:
+                        # Swaps are not retried: the replacement starts on the current weights
+                        del self._pending[task_id]
+                        failed.append(future)
+                self._in_flight[index] = {task_id for task_id, _ in retry}
+            print(f"⚠️ Inference worker {index} exited ({process.exitcode}), restarting it: "
+                  f"{len(retry)} tasks re-queued, {len(failed)} failed", file=sys.stderr)
+            # Restart first, so whoever handles a failed swap already talks to the replacement
+            self._start_worker(index)
+            for task_id, data in retry:
+                self._tasks[index].put(('predict', task_id, data))
+            for future in failed:
+                future.set_exception(RuntimeError(f'Inference worker {index} exited'))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+        self._results.put(None)
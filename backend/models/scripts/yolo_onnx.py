@@ -0,0 +1,78 @@
+"""
+YOLOv8 fracture detection through ONNX Runtime
+Runs the .onnx exported by train_yolo.py with NumPy letterboxing and NMS, so
+detection works on serving nodes without ultralytics (or torch) installed
+"""
+
+import ast
+
+import numpy as np
+
+from instrumentation import NULL_TRACE
+from yolo_utils import to_rgb_array, letterbox, to_input_tensor, postprocess, scale_boxes, format_detections
+
+
+class OnnxYoloDetector:
+    """
+    Exported YOLOv8 detector
+
+    Class names and the training image size are read from the metadata that
+    ultralytics embeds in the exported model.
+
+    Args:
+        model_path: Path to the exported .onnx file
+        num_threads: Intra-op threads for ONNX Runtime (None keeps the default)
+        providers: ONNX Runtime execution providers (CPU by default)
+    """
+
+    def __init__(self, model_path, num_threads=None, providers=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options,
+                                            providers=providers or ['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Dynamic-shape exports accept any stride-aligned size, so pad minimally
+        self.dynamic = not isinstance(model_input.shape[2], int)
+        # Static exports take a fixed batch (usually 1); None means any batch size
+        self.batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        imgsz = ast.literal_eval(metadata['imgsz']) if 'imgsz' in metadata else [640, 640]
+        self.imgsz = tuple(imgsz) if isinstance(imgsz, (list, tuple)) else (imgsz, imgsz)
+        self.stride = int(metadata.get('stride', 32))
+
+    def run(self, batch):
+        """Raw network output (N, 4 + num_classes, num_anchors) for an NCHW float32 batch."""
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def detect(self, source, conf=0.25, iou=0.45, max_det=300, trace=NULL_TRACE):
+        """
+        Detect fractures in one image
+
+        Returns:
+            tuple: (xyxy boxes in original pixels, scores, class ids, (height, width))
+        """
+        with trace.stage('decode'):
+            image = to_rgb_array(source)
+        trace.image((image.shape[1], image.shape[0]))
+        with trace.stage('preprocess'):
+            padded, ratio, pad = letterbox(image, self.imgsz, auto=self.dynamic, stride=self.stride)
+            batch = to_input_tensor([padded])
+        with trace.stage('forward'):
+            output = self.run(batch)[0]
+        with trace.stage('postprocess'):
+            boxes, scores, class_ids = postprocess(output, conf, iou, max_det)
+            boxes = scale_boxes(boxes, ratio, pad, image.shape[:2])
+        return boxes, scores, class_ids, image.shape[:2]
+
+    def predict(self, source, conf=0.25, iou=0.45, trace=NULL_TRACE):
+        """Detection JSON identical in shape to predict_fracture_yolo."""
+        boxes, scores, class_ids, orig_shape = self.detect(source, conf, iou, trace=trace)
+        names = self.names or {int(c): str(c) for c in np.unique(class_ids)}
+        return format_detections(boxes, scores, class_ids, names, orig_shape)
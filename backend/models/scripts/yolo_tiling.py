@@ -0,0 +1,143 @@
+"""
+Tiled YOLOv8 inference for large radiographs
+Slices the image into overlapping tiles at the detector's input resolution,
+runs them through the model a batch at a time, maps the boxes back onto the
+full image and merges duplicates across tile borders with NMS. Memory grows
+with the tile batch, not with the image size
+"""
+
+import numpy as np
+
+from instrumentation import NULL_TRACE
+from yolo_utils import to_rgb_array, letterbox, to_input_tensor, postprocess, scale_boxes, format_detections
+
+
+def tile_starts(length, tile_size, overlap):
+    """Offsets of tiles covering [0, length), the last one flush with the end."""
+    if length <= tile_size:
+        return [0]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_windows(height, width, tile_size, overlap):
+    """(x, y) top-left corners of the overlapping tiles for an image."""
+    return [(x, y) for y in tile_starts(height, tile_size, overlap)
+            for x in tile_starts(width, tile_size, overlap)]
+
+
+def merge_detections(boxes, scores, class_ids, iou=0.45, ios=0.6, max_det=300):
+    """
+    Class-aware greedy NMS that also merges boxes cut by tile borders
+
+    A tile that only sees part of an object reports a truncated box whose IoU
+    with the full box is low, so a box is also suppressed when more than
+    `ios` of its area lies inside a higher-scoring box of the same class.
+
+    Returns:
+        np.ndarray: indices of the kept boxes, highest score first
+    """
+    order = scores.argsort()[::-1]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size and len(keep) < max_det:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        x1 = np.maximum(boxes[best, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[best, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[best, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[best, 3], boxes[rest, 3])
+        intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        overlap = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+        contained = intersection / (np.minimum(areas[best], areas[rest]) + 1e-9)
+        duplicate = (class_ids[rest] == class_ids[best]) & ((overlap > iou) | (contained > ios))
+        order = rest[~duplicate]
+    return np.array(keep, dtype=np.int64)
+
+
+def _run_onnx(detector, images, conf, iou, max_det):
+    """Raw detections (boxes in `images` pixels) for a list of HxWx3 arrays."""
+    prepared = [letterbox(image, detector.imgsz, stride=detector.stride) for image in images]
+    if detector.batch_size is None:
+        outputs = detector.run(to_input_tensor([padded for padded, _, _ in prepared]))
+    else:
+        # Static-batch export: feed the tiles one at a time
+        outputs = [detector.run(to_input_tensor([padded]))[0] for padded, _, _ in prepared]
+
+    detections = []
+    for image, (_, ratio, pad), output in zip(images, prepared, outputs):
+        boxes, scores, class_ids = postprocess(output, conf, iou, max_det)
+        detections.append((scale_boxes(boxes, ratio, pad, image.shape[:2]), scores, class_ids))
+    return detections
+
+
+def _run_ultralytics(model, images, conf, iou, max_det, device, imgsz):
+    # Ultralytics expects NumPy sources in BGR order
+    sources = [np.ascontiguousarray(image[..., ::-1]) for image in images]
+    results = model.predict(source=sources, imgsz=imgsz, conf=conf, iou=iou, max_det=max_det,
+                            device=device, verbose=False)
+    return [(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy().astype(int))
+            for r in results]
+
+
+def detect_tiled(model, source, device=None, conf=0.25, iou=0.45, tile_size=640, overlap=0.2,
+                 batch_size=8, full_image=True, max_det=300, merge_ios=0.6, trace=NULL_TRACE):
+    """
+    Detect fractures in a large image tile by tile
+
+    Args:
+        model: Model returned by predict_yolo.load_yolo_model (ultralytics or ONNX)
+        source: Image path, PIL image or HxWx3 RGB array
+        tile_size: Side of the square tiles in original pixels
+        overlap: Fraction of a tile shared with its neighbour, so objects cut
+            by one tile border appear whole in the next tile
+        batch_size: Tiles per forward pass; bounds the memory used by inference
+        full_image: Also run the whole (downscaled) image, so objects larger
+            than a tile are still found
+        merge_ios: Containment ratio above which a box cut by a tile border is
+            merged into the higher-scoring box it lies in
+
+    Returns:
+        dict: the same detection JSON as detect_fractures
+    """
+    from yolo_onnx import OnnxYoloDetector
+
+    with trace.stage('decode'):
+        image = to_rgb_array(source)
+    height, width = image.shape[:2]
+    trace.image((width, height))
+
+    if isinstance(model, OnnxYoloDetector):
+        def run(images):
+            return _run_onnx(model, images, conf, iou, max_det)
+    else:
+        def run(images):
+            return _run_ultralytics(model, images, conf, iou, max_det, device, tile_size)
+
+    windows = tile_windows(height, width, tile_size, overlap)
+    all_boxes, all_scores, all_class_ids = [], [], []
+    with trace.stage('forward'):
+        for start in range(0, len(windows), batch_size):
+            chunk = windows[start:start + batch_size]
+            # Views into the decoded image; only the batch tensor is allocated
+            tiles = [image[y:y + tile_size, x:x + tile_size] for x, y in chunk]
+            for (x, y), (boxes, scores, class_ids) in zip(chunk, run(tiles)):
+                all_boxes.append(boxes + np.array([x, y, x, y], dtype=boxes.dtype))
+                all_scores.append(scores)
+                all_class_ids.append(class_ids)
+        if full_image and len(windows) > 1:
+            boxes, scores, class_ids = run([image])[0]
+            all_boxes.append(boxes)
+            all_scores.append(scores)
+            all_class_ids.append(class_ids)
+
+    with trace.stage('postprocess'):
+        boxes = np.concatenate(all_boxes).astype(np.float32).reshape(-1, 4)
+        scores = np.concatenate(all_scores).astype(np.float32)
+        class_ids = np.concatenate(all_class_ids).astype(np.int64)
+        # Boxes found by several overlapping tiles collapse into one here
+        keep = merge_detections(boxes, scores, class_ids, iou, merge_ios, max_det)
+        names = model.names or {int(c): str(c) for c in np.unique(class_ids)}
+        return format_detections(boxes[keep], scores[keep], class_ids[keep], names, (height, width))
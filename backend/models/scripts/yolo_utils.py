@@ -0,0 +1,185 @@
+"""
+NumPy pre/post-processing shared by the YOLOv8 inference paths
+Letterboxing, non-maximum suppression and conversion of raw boxes into the
+detection JSON returned by predict_fracture_yolo. Only depends on NumPy and
+Pillow so it can run on serving nodes without ultralytics or torch
+"""
+
+import numpy as np
+from PIL import Image
+
+from image_io import load_image
+
+
+def to_rgb_array(source):
+    """Image path, encoded bytes, PIL image or HxWx3 RGB uint8 array -> contiguous RGB uint8 array."""
+    if isinstance(source, np.ndarray):
+        return np.ascontiguousarray(source)
+    # Full resolution: detection boxes are reported in original pixels
+    return np.asarray(load_image(source))
+
+
+def letterbox(image, new_shape=(640, 640), color=114, auto=False, stride=32):
+    """
+    Resize keeping aspect ratio and pad to `new_shape`, like ultralytics' LetterBox
+
+    Args:
+        image: HxWx3 uint8 RGB array
+        new_shape: (height, width) of the network input
+        auto: Pad only up to the next multiple of `stride` (for dynamic-shape models)
+
+    Returns:
+        tuple: (padded image, scale ratio, (pad_left, pad_top))
+    """
+    height, width = image.shape[:2]
+    ratio = min(new_shape[0] / height, new_shape[1] / width)
+    resized_w, resized_h = int(round(width * ratio)), int(round(height * ratio))
+    if (resized_w, resized_h) != (width, height):
+        image = np.asarray(Image.fromarray(image).resize((resized_w, resized_h), Image.BILINEAR))
+
+    pad_w, pad_h = new_shape[1] - resized_w, new_shape[0] - resized_h
+    if auto:
+        pad_w, pad_h = pad_w % stride, pad_h % stride
+    pad_w, pad_h = pad_w / 2, pad_h / 2
+    left, top = int(round(pad_w - 0.1)), int(round(pad_h - 0.1))
+    right, bottom = int(round(pad_w + 0.1)), int(round(pad_h + 0.1))
+    padded = np.full((top + resized_h + bottom, left + resized_w + right, 3), color, dtype=np.uint8)
+    padded[top:top + resized_h, left:left + resized_w] = image
+    return padded, ratio, (left, top)
+
+
+def to_input_tensor(images):
+    """Stack letterboxed HxWx3 uint8 images into a normalized float32 NCHW batch."""
+    batch = np.stack(images).transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def xywh_to_xyxy(boxes):
+    xyxy = np.empty_like(boxes)
+    half_w, half_h = boxes[:, 2] / 2, boxes[:, 3] / 2
+    xyxy[:, 0] = boxes[:, 0] - half_w
+    xyxy[:, 1] = boxes[:, 1] - half_h
+    xyxy[:, 2] = boxes[:, 0] + half_w
+    xyxy[:, 3] = boxes[:, 1] + half_h
+    return xyxy
+
+
+def box_iou(box, boxes):
+    """IoU of one xyxy box against an (N, 4) array of xyxy boxes."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / (area + areas - intersection + 1e-9)
+
+
+def non_max_suppression(boxes, scores, class_ids, iou=0.45, max_det=300, max_wh=7680):
+    """
+    Class-aware greedy NMS
+
+    Boxes of different classes never suppress each other: they are shifted
+    apart by class_id * max_wh before computing overlaps, as ultralytics does.
+
+    Returns:
+        np.ndarray: indices of the kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    shifted = boxes + (class_ids[:, None] * max_wh).astype(boxes.dtype)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size and len(keep) < max_det:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        order = rest[box_iou(shifted[best], shifted[rest]) <= iou]
+    return np.array(keep, dtype=np.int64)
+
+
+def postprocess(output, conf=0.25, iou=0.45, max_det=300):
+    """
+    Decode one image of raw YOLOv8 output (4 + num_classes, num_anchors)
+
+    Returns:
+        tuple: (xyxy boxes in network input pixels, scores, class ids)
+    """
+    predictions = output.T
+    class_scores = predictions[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(class_scores)), class_ids]
+
+    mask = scores > conf
+    boxes = xywh_to_xyxy(predictions[mask, :4])
+    scores, class_ids = scores[mask], class_ids[mask]
+
+    keep = non_max_suppression(boxes, scores, class_ids, iou, max_det)
+    return boxes[keep], scores[keep], class_ids[keep]
+
+
+def scale_boxes(boxes, ratio, pad, orig_shape):
+    """Map boxes from letterboxed input pixels back onto the original image."""
+    boxes = boxes.copy()
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_shape[0])
+    return boxes
+
+
+def format_detections(boxes, scores, class_ids, names, orig_shape):
+    """
+    Build the predict_fracture_yolo JSON from raw detections
+
+    Args:
+        boxes: (N, 4) xyxy boxes in original image pixels
+        scores: (N,) confidences in [0, 1]
+        class_ids: (N,) integer class ids
+        names: Mapping of class id to class name
+        orig_shape: (height, width) of the original image
+    """
+    detections = []
+    max_confidence = 0.0
+    primary_class = "Healthy"
+
+    for bbox, confidence, cls_id in zip(boxes.tolist(), scores.tolist(), class_ids.tolist()):
+        class_name = names[int(cls_id)]
+        detections.append({
+            'class': class_name,
+            'confidence': confidence * 100,
+            'bbox': {
+                'x1': bbox[0],
+                'y1': bbox[1],
+                'x2': bbox[2],
+                'y2': bbox[3]
+            }
+        })
+
+        # Track highest confidence detection
+        if confidence > max_confidence:
+            max_confidence = confidence
+            primary_class = class_name
+
+    # Determine if fractured
+    is_fractured = len(detections) > 0 and primary_class != "Healthy"
+
+    # Calculate class counts
+    class_counts = {}
+    for detection in detections:
+        cls = detection['class']
+        class_counts[cls] = class_counts.get(cls, 0) + 1
+
+    return {
+        'prediction': 'fractured' if is_fractured else 'not fractured',
+        'confidence': float(max_confidence * 100) if detections else 0.0,
+        'primary_class': primary_class,
+        'num_detections': len(detections),
+        'detections': detections,
+        'class_summary': class_counts,
+        'image_shape': {
+            'width': int(orig_shape[1]),
+            'height': int(orig_shape[0])
+        }
+    }